@@ -0,0 +1 @@
+'''Performance benchmarks for rory. Not installed with the package.'''
@@ -0,0 +1,208 @@
+'''
+    Time and memory-profile each stage of compiling a song for the Player.
+
+    Usage:
+        python -m benchmarks.compile [--corpus directory] [--seed 0] [--scale 1] [--repeat 3]
+                                     [--quantize 16] [--quantize-tolerance ticks]
+                                     [--json results.json] [--compare previous.json]
+
+    Stages:
+        load: MIDI.load()
+        beat_chunks: MIDIInterface.calculate_beat_chunks()
+        grouping: MIDIInterface.beats_to_grouping()
+        flatten: Grouping.flatten() on every beat
+        reduce: Grouping.reduce() on a copy of every flattened beat
+        interface: The whole MIDIInterface constructor
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from apres import MIDI
+from rory.midiinterface import MIDIInterface
+from rory.structures import BadStateError
+from .corpus import generate_corpus
+
+STAGES = ("load", "beat_chunks", "grouping", "flatten", "reduce", "interface")
+
+def run_stages(path, **kwargs):
+    '''
+        Run each stage once, in the same order as MIDIInterface does.
+        kwargs are passed on to MIDIInterface.
+        Yields (stage name, seconds)
+    '''
+    start = time.perf_counter()
+    midi = MIDI.load(path)
+    yield "load", time.perf_counter() - start
+
+    interface = MIDIInterface.uncompiled(midi, **kwargs)
+
+    start = time.perf_counter()
+    beats = interface.calculate_beat_chunks()
+    yield "beat_chunks", time.perf_counter() - start
+
+    start = time.perf_counter()
+    grouping = interface.beats_to_grouping(beats)
+    yield "grouping", time.perf_counter() - start
+
+    beats = [
+        beat
+        for measure in list(grouping)
+        for beat in list(measure)
+        if not beat.is_open()
+    ]
+
+    start = time.perf_counter()
+    for beat in beats:
+        beat.flatten()
+    yield "flatten", time.perf_counter() - start
+
+    copies = [beat.copy() for beat in beats if beat.is_structural()]
+    start = time.perf_counter()
+    for beat in copies:
+        try:
+            beat.reduce()
+        except BadStateError:
+            pass
+    yield "reduce", time.perf_counter() - start
+
+    # The constructor changes the events' notes, so it gets a fresh load
+    midi = MIDI.load(path)
+    start = time.perf_counter()
+    MIDIInterface(midi, **kwargs)
+    yield "interface", time.perf_counter() - start
+
+def profile_memory(path, **kwargs):
+    ''' Get the peak bytes allocated during each stage '''
+    output = {}
+    tracemalloc.start()
+    try:
+        stages = run_stages(path, **kwargs)
+        while True:
+            tracemalloc.reset_peak()
+            try:
+                stage, _seconds = next(stages)
+            except StopIteration:
+                break
+            output[stage] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return output
+
+def benchmark_song(path, repeat=3, **kwargs):
+    ''' Get the timings and memory of each stage of compiling the song at path '''
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        for stage, seconds in run_stages(path, **kwargs):
+            timings[stage].append(seconds)
+
+    peaks = profile_memory(path, **kwargs)
+    midi_interface = MIDIInterface(MIDI.load(path), **kwargs)
+
+    return {
+        "states": len(midi_interface.state_map),
+        "measures": len(midi_interface.measure_map),
+        "size": os.path.getsize(path),
+        "stages": {
+            stage: {
+                "min": min(timings[stage]),
+                "median": statistics.median(timings[stage]),
+                "peak_bytes": peaks.get(stage, 0)
+            }
+            for stage in STAGES
+        }
+    }
+
+def get_commit():
+    ''' The commit being benchmarked, if this is a git checkout '''
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        output = None
+    return output
+
+def compare(results, previous):
+    ''' Print each stage's median time against a previous run '''
+    print(f"\nCompared to {previous.get('commit')}:")
+    if (previous.get('seed'), previous.get('scale')) != (results['seed'], results['scale']):
+        print("Warning: The runs used different corpora (seed or scale)")
+    if previous.get('options', {}) != results['options']:
+        print("Warning: The runs used different compile options")
+    for name, song in sorted(results['songs'].items()):
+        old_song = previous['songs'].get(name)
+        if old_song is None:
+            continue
+        ratios = []
+        for stage in STAGES:
+            old = old_song['stages'].get(stage, {}).get('median')
+            new = song['stages'][stage]['median']
+            if old:
+                ratios.append(f"{stage} {new / old:.2f}x")
+        print(f"{name:>14}: " + ", ".join(ratios))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark song compilation")
+    parser.add_argument("--corpus", help="Directory to generate the corpus in. Defaults to a temporary one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=1, help="Multiply the length of every song")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quantize", type=int, default=0, help="Grid to snap notes to, eg 16 for 1/16th notes")
+    parser.add_argument("--quantize-tolerance", type=int, default=0, help="Ticks apart that notes still count as one chord")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+    options = {
+        "quantize": args.quantize,
+        "quantize_tolerance": args.quantize_tolerance
+    }
+
+    with tempfile.TemporaryDirectory() as temporary_path:
+        corpus = generate_corpus(args.corpus or temporary_path, args.seed, args.scale)
+
+        results = {
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "seed": args.seed,
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "options": options,
+            "songs": {}
+        }
+
+        print(f"{'':>14}  {'states':>7}" + ''.join(f"{stage:>13}" for stage in STAGES))
+        for name, (song_path, song_kwargs) in sorted(corpus.items()):
+            song = benchmark_song(song_path, args.repeat, **options)
+            song['kwargs'] = song_kwargs
+            results['songs'][name] = song
+
+            print(
+                f"{name:>14}: {song['states']:>7}"
+                + ''.join(
+                    f"{song['stages'][stage]['median'] * 1000:>11.2f}ms"
+                    for stage in STAGES
+                )
+            )
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=4)
+
+    if args.compare:
+        with open(args.compare, 'r') as fp:
+            compare(results, json.load(fp))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
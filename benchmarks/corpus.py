@@ -0,0 +1,123 @@
+'''
+    Seeded generator of synthetic MIDI files for benchmarking.
+
+    Usage:
+        python -m benchmarks.corpus output/directory [--seed 0] [--scale 1]
+'''
+import argparse
+import os
+import random
+import sys
+
+from apres import MIDI, NoteOn, NoteOff, SetTempo, TimeSignature
+
+# (numerator, denominator as a power of 2)
+TIME_SIGNATURES = [(4, 2), (3, 2), (6, 3), (5, 2), (7, 3), (2, 1)]
+
+# Subdivisions of a beat. Tuplets are only used when asked for.
+SUBDIVISIONS = [1, 2, 4]
+TUPLET_SUBDIVISIONS = [3, 5, 6, 7]
+
+# name: keyword arguments for generate_song()
+CORPUS = {
+    "short": {"bars": 16},
+    "long": {"bars": 256},
+    "dense": {"bars": 32, "polyphony": 8, "density": .9},
+    "wide": {"bars": 32, "channels": 16},
+    "tuplets": {"bars": 64, "tuplets": True},
+    "unquantized": {"bars": 64, "jitter": 7},
+    "meter_changes": {"bars": 64, "signature_changes": 32},
+    "tempo_map": {"bars": 64, "tempo_changes": 1000}
+}
+
+def generate_song(seed, **kwargs):
+    '''
+        Build a random but reproducible song.
+        kwargs:
+            bars: Number of measures
+            ppqn: Ticks per quarter note
+            polyphony: Most notes struck at once
+            channels: Number of channels used
+            density: Chance of a chord on any subdivision
+            tuplets: Also divide beats into 3, 5, 6 or 7
+            jitter: Most ticks a note may be moved off the grid
+            signature_changes: Number of time signature changes
+            tempo_changes: Number of tempo changes
+    '''
+    rng = random.Random(seed)
+    bars = kwargs.get('bars', 32)
+    ppqn = kwargs.get('ppqn', 120)
+    polyphony = kwargs.get('polyphony', 3)
+    channels = kwargs.get('channels', 2)
+    density = kwargs.get('density', .6)
+    tuplets = kwargs.get('tuplets', False)
+    jitter = kwargs.get('jitter', 0)
+    signature_changes = kwargs.get('signature_changes', 0)
+    tempo_changes = kwargs.get('tempo_changes', 0)
+
+    subdivisions = SUBDIVISIONS + (TUPLET_SUBDIVISIONS if tuplets else [])
+    changing_bars = set(rng.sample(range(1, bars), min(bars - 1, signature_changes)))
+
+    midi = MIDI(ppqn=ppqn)
+    midi.add_event(SetTempo(500000), tick=0)
+    midi.add_event(TimeSignature(numerator=4, denominator=2), tick=0)
+
+    tick = 0
+    numerator, denominator = (4, 2)
+    for bar in range(bars):
+        if bar in changing_bars:
+            numerator, denominator = rng.choice(TIME_SIGNATURES)
+            midi.add_event(TimeSignature(numerator=numerator, denominator=denominator), tick=tick)
+
+        beat_size = int(ppqn // ((2 ** denominator) / 4))
+        for _ in range(numerator):
+            divisions = rng.choice(subdivisions)
+            for i in range(divisions):
+                if rng.random() > density:
+                    continue
+
+                start = tick + ((i * beat_size) // divisions)
+                end = tick + (((i + 1) * beat_size) // divisions)
+                if jitter:
+                    start = max(0, start + rng.randint(-jitter, jitter))
+                    end = max(start + 1, end + rng.randint(-jitter, jitter))
+
+                for note in rng.sample(range(36, 96), rng.randint(1, polyphony)):
+                    channel = rng.randrange(channels)
+                    midi.add_event(NoteOn(note=note, velocity=100, channel=channel), tick=start)
+                    midi.add_event(NoteOff(note=note, velocity=0, channel=channel), tick=end)
+            tick += beat_size
+
+    for _ in range(tempo_changes):
+        midi.add_event(SetTempo(rng.randint(300000, 1000000)), tick=rng.randrange(max(1, tick)))
+
+    return midi
+
+def generate_corpus(path, seed=0, scale=1):
+    '''
+        Write every song in CORPUS to path.
+        scale multiplies the number of bars.
+        Returns {name: (file path, kwargs)}
+    '''
+    os.makedirs(path, exist_ok=True)
+    output = {}
+    for i, (name, song_kwargs) in enumerate(sorted(CORPUS.items())):
+        song_kwargs = dict(song_kwargs)
+        song_kwargs['bars'] = max(2, int(song_kwargs.get('bars', 32) * scale))
+        song_path = os.path.join(path, name + '.mid')
+        generate_song(seed + i, **song_kwargs).save(song_path)
+        output[name] = (song_path, song_kwargs)
+    return output
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic MIDI corpus")
+    parser.add_argument("path", help="Directory to write the songs to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=1, help="Multiply the length of every song")
+    args = parser.parse_args(argv)
+
+    for name, (song_path, song_kwargs) in generate_corpus(args.path, args.seed, args.scale).items():
+        print(f"{name}: {song_path} {song_kwargs}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,250 @@
+'''
+    Time PlayerScene's render loop against an offscreen terminal.
+
+    Usage:
+        python -m benchmarks.render [path/to/song.mid] [--preset dense] [--size 160x48]
+                                    [--frames 200] [--json results.json]
+
+    The scene is run in a child process attached to a pseudo-terminal of the given size,
+    so nothing is drawn to the real terminal. What it draws is counted, as bytes written per frame.
+    Each scenario steps the scene through different changes, timing every frame and
+    the PlayerScene methods called while rendering it. Method times are inclusive,
+    eg __draw_visible_notes includes __draw_song_position.
+'''
+import argparse
+import fcntl
+import json
+import os
+import pty
+import struct
+import sys
+import tempfile
+import termios
+import time
+import traceback
+
+from .stats import summarize, format_ms
+from .corpus import CORPUS, generate_song
+
+TIMED_METHODS = (
+    "__draw_background",
+    "__draw_visible_notes",
+    "__draw_note_rows",
+    "__draw_song_position",
+    "__draw_pressed_row"
+)
+
+class FrameTimer:
+    '''Collects the time spent in each timed method over a frame'''
+    def __init__(self):
+        self.current = {}
+        self.frames = []
+
+    def wrap(self, scene, name):
+        ''' Replace one of the scene's (name mangled) methods with a timed version '''
+        attribute = '_PlayerScene' + name
+        method = getattr(scene, attribute)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.current[name] = self.current.get(name, 0) + (time.perf_counter() - start)
+
+        setattr(scene, attribute, timed)
+
+    def start_frame(self):
+        self.current = {}
+
+    def end_frame(self, tick_time, draw_time):
+        self.current['tick'] = tick_time
+        self.current['draw'] = draw_time
+        self.current['total'] = tick_time + draw_time
+        self.frames.append(self.current)
+
+    def summarize(self):
+        ''' Get {part: summary} over every frame. Parts not called in a frame count as 0 '''
+        parts = ['total', 'tick', 'draw', *TIMED_METHODS]
+        return {
+            part: summarize([frame.get(part, 0) for frame in self.frames])
+            for part in parts
+        }
+
+
+def scenario_step(scene, frames):
+    ''' Move forward one state per frame '''
+    for _ in range(frames):
+        scene.player.next_state()
+        yield
+
+def scenario_loop(scene, frames):
+    ''' Go around a short loop, so most frames are repeats '''
+    player = scene.player
+    player.set_state(0)
+    player.set_loop_start_to_position()
+    for _ in range(16):
+        player.next_state()
+    player.set_loop_end_to_position()
+    player.set_state(0)
+    for _ in range(frames):
+        player.next_state()
+        yield
+    player.clear_loop()
+
+def scenario_note_range(scene, frames):
+    ''' Switch between a narrow and the full note range every frame '''
+    player = scene.player
+    for i in range(frames):
+        if i % 2:
+            player.set_note_range(21, 109)
+        else:
+            player.set_note_range(48, 84)
+        yield
+    player.set_note_range(21, 109)
+
+def scenario_pressed(scene, frames):
+    ''' Cycle through the patterns of pressed notes the indicators show, without moving '''
+    player = scene.player
+    controller_manager = player.controller_manager
+    state = sorted(player.midi_interface.get_state(player.song_position, set()))
+    patterns = [
+        set(),
+        set(state[:1]), # Correct, but more are needed
+        set(state), # Correct chord
+        {note + 1 for note in state}, # Wrong notes
+        set(state) | {21, 108} # Correct chord with extras
+    ]
+    for i in range(frames):
+        controller_manager.pressed = patterns[i % len(patterns)]
+        yield
+    controller_manager.pressed = set()
+
+SCENARIOS = {
+    "step": scenario_step,
+    "loop": scenario_loop,
+    "note_range": scenario_note_range,
+    "pressed": scenario_pressed
+}
+
+def run_scenarios(song_path, frames):
+    ''' Build a PlayerScene in the current terminal and run every scenario in it '''
+    from rory.interface import RoryStage, PlayerScene
+    from rory.input_backends import ScriptedBackend
+
+    stage = RoryStage()
+    try:
+        scene = PlayerScene(stage, path=song_path, input_backend=ScriptedBackend())
+        stage.key_scene(RoryStage.CONTEXT_PLAYER, scene)
+        scene.enable()
+        scene.tick()
+        scene.draw()
+
+        output = {
+            "size": [stage.root.width, stage.root.height],
+            "states": len(scene.player.midi_interface.state_map),
+            "scenarios": {}
+        }
+        for name, scenario in SCENARIOS.items():
+            timer = FrameTimer()
+            for method_name in TIMED_METHODS:
+                timer.wrap(scene, method_name)
+
+            for _ in scenario(scene, frames):
+                timer.start_frame()
+                start = time.perf_counter()
+                scene.tick()
+                tick_time = time.perf_counter() - start
+                scene.draw()
+                timer.end_frame(tick_time, time.perf_counter() - (start + tick_time))
+
+            # Unwrap, so the next scenario's timer doesn't time through this one's
+            for method_name in TIMED_METHODS:
+                delattr(scene, '_PlayerScene' + method_name)
+
+            output['scenarios'][name] = timer.summarize()
+    finally:
+        stage.kill()
+
+    return output
+
+def run_offscreen(song_path, columns, rows, frames):
+    ''' Run the scenarios in a child process on a pseudo-terminal of the given size '''
+    handle, result_path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+
+    pid, fd = pty.fork()
+    if pid == 0:
+        status = 0
+        try:
+            fcntl.ioctl(1, termios.TIOCSWINSZ, struct.pack('HHHH', rows, columns, 0, 0))
+            output = run_scenarios(song_path, frames)
+        except Exception:
+            output = {"error": traceback.format_exc()}
+            status = 1
+
+        with open(result_path, 'w') as fp:
+            json.dump(output, fp)
+        os._exit(status)
+
+    # Whatever the child draws has to be read, or it blocks once the pty fills up
+    bytes_written = 0
+    while True:
+        try:
+            chunk = os.read(fd, 65536)
+        except OSError:
+            break
+        if not chunk:
+            break
+        bytes_written += len(chunk)
+    os.waitpid(pid, 0)
+    os.close(fd)
+
+    with open(result_path, 'r') as fp:
+        output = json.load(fp)
+    os.remove(result_path)
+
+    if 'error' in output:
+        raise RuntimeError(output['error'])
+
+    # Includes setting up and tearing down the terminal, so it's an upper bound
+    output['bytes_written'] = bytes_written
+    output['bytes_per_frame'] = bytes_written / (1 + frames * len(output['scenarios']))
+
+    return output
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PlayerScene rendering")
+    parser.add_argument("path", nargs='?', help="MIDI file to render. Defaults to a generated song")
+    parser.add_argument("--preset", default="dense", choices=sorted(CORPUS.keys()), help="Generated song to use when no path is given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", default="160x48", help="Terminal size, COLUMNSxROWS")
+    parser.add_argument("--frames", type=int, default=200, help="Frames per scenario")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args(argv)
+
+    columns, rows = (int(value) for value in args.size.lower().split('x'))
+
+    with tempfile.TemporaryDirectory() as temporary_path:
+        song_path = args.path
+        if song_path is None:
+            song_path = temporary_path + '/' + args.preset + '.mid'
+            generate_song(args.seed, **CORPUS[args.preset]).save(song_path)
+
+        results = run_offscreen(song_path, columns, rows, args.frames)
+
+    print(f"{results['size'][0]}x{results['size'][1]}, {results['states']} states, {args.frames} frames per scenario")
+    print(f"{results['bytes_written']} bytes written, {results['bytes_per_frame']:.0f}/frame")
+    for name, parts in results['scenarios'].items():
+        print(f"\n{name}:")
+        for part, summary in parts.items():
+            print(f"{part:>22}: " + format_ms(summary))
+
+    if args.json:
+        results['path'] = args.path
+        results['preset'] = None if args.path else args.preset
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=4)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
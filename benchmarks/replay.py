@@ -0,0 +1,178 @@
+'''
+    Replay note input into a headless Player and measure how quickly it reacts.
+
+    Usage:
+        python -m benchmarks.replay path/to/song.mid [--speed 0] [--session path] [--json out.json]
+
+    Notes are taken from the song itself unless a recorded session is given.
+    A session is a text file with one "seconds note velocity" event per line.
+    A speed of 0 replays as fast as possible, measuring throughput.
+'''
+import argparse
+import json
+import sys
+import time
+
+from apres import MIDI, NoteOn, NoteOff, SetTempo
+from rory.player import Player
+from rory.input_backends import ScriptedBackend
+from .stats import summarize, format_ms
+
+def get_song_events(midi, transpose=0):
+    '''
+        Convert a song's notes into a list of (seconds, note, velocity).
+        A keyboard can't hold the same key twice, so overlapping notes of the same pitch
+        are played as a release and re-strike, and the key is let go after the last one ends.
+    '''
+    timed_events = []
+    seconds = 0
+    last_tick = 0
+    us_per_tick = 500000 / midi.ppqn
+    for tick, event in sorted(midi.get_all_events(), key=lambda pair: pair[0]):
+        seconds += (tick - last_tick) * us_per_tick / 1000000
+        last_tick = tick
+
+        if isinstance(event, SetTempo):
+            us_per_tick = event.get_us_per_quarter_note() / midi.ppqn
+        elif isinstance(event, NoteOn) and event.velocity:
+            timed_events.append((seconds, event.note + transpose, event.velocity))
+        elif isinstance(event, (NoteOn, NoteOff)):
+            timed_events.append((seconds, event.note + transpose, 0))
+
+    # Like a performer, let go of keys before pressing the next ones
+    timed_events.sort(key=lambda event: (event[0], event[2] > 0))
+
+    events = []
+    held = {} # note: number of song notes holding it down
+    for seconds, note, velocity in timed_events:
+        count = held.get(note, 0)
+        if velocity:
+            if count:
+                events.append((seconds, note, 0))
+            events.append((seconds, note, velocity))
+            held[note] = count + 1
+        elif count:
+            held[note] = count - 1
+            if count == 1:
+                events.append((seconds, note, 0))
+
+    return events
+
+def load_session(path):
+    ''' Read a recorded session of "seconds note velocity" lines '''
+    events = []
+    with open(path, 'r') as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            seconds, note, velocity = line.split()
+            events.append((float(seconds), int(note), int(velocity)))
+    return events
+
+class ReplayResult:
+    '''Timings collected over a single replay'''
+    def __init__(self):
+        self.events = 0
+        self.advances = 0
+        self.elapsed = 0
+        self.press_latencies = [] # Every press, whether or not it moved the song
+        self.advance_latencies = [] # Only the presses that moved the song
+
+    def to_dict(self):
+        return {
+            "events": self.events,
+            "advances": self.advances,
+            "elapsed": self.elapsed,
+            "events_per_second": self.events / self.elapsed if self.elapsed else 0,
+            "press_latency": summarize(self.press_latencies),
+            "advance_latency": summarize(self.advance_latencies)
+        }
+
+    def __str__(self):
+        data = self.to_dict()
+        return "\n".join([
+            f"Events: {self.events} in {self.elapsed:.3f}s ({data['events_per_second']:.0f}/s)",
+            f"Advances: {self.advances}",
+            "Press latency: " + format_ms(data['press_latency']),
+            "Press-to-advance latency: " + format_ms(data['advance_latency'])
+        ])
+
+def replay(player, backend, events, speed=0):
+    '''
+        Feed events into the backend, timing each press up to the end of
+        Player.do_state_check. Events are scheduled against a single start time,
+        so time spent handling one event doesn't delay the rest.
+    '''
+    result = ReplayResult()
+    start = time.perf_counter()
+    for seconds, note, velocity in events:
+        if speed:
+            delay = start + (seconds / speed) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        position = player.song_position
+        before = time.perf_counter()
+        if velocity:
+            backend.press_note(note)
+        else:
+            backend.release_note(note)
+        latency = time.perf_counter() - before
+
+        result.events += 1
+        if velocity:
+            result.press_latencies.append(latency)
+            if player.song_position != position:
+                result.advances += 1
+                result.advance_latencies.append(latency)
+
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay note input into a headless Player")
+    parser.add_argument("path", help="MIDI file to play")
+    parser.add_argument("--session", help="Recorded session to replay instead of the song's notes")
+    parser.add_argument("--speed", type=float, default=0, help="Playback speed. 0 is as fast as possible")
+    parser.add_argument("--transpose", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="Number of times to replay the events")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args(argv)
+
+    backend = ScriptedBackend()
+    start = time.perf_counter()
+    player = Player(path=args.path, transpose=args.transpose, input_backend=backend)
+    startup = time.perf_counter() - start
+
+    if args.session:
+        events = load_session(args.session)
+    else:
+        events = get_song_events(MIDI.load(args.path), args.transpose)
+
+    # Later repeats are scheduled after the earlier ones have finished
+    duration = events[-1][0] if events else 0
+    events = [
+        (seconds + (duration * i), note, velocity)
+        for i in range(args.repeat)
+        for seconds, note, velocity in events
+    ]
+
+    try:
+        result = replay(player, backend, events, args.speed)
+    finally:
+        player.kill()
+
+    print(f"Player startup: {startup * 1000:.1f}ms")
+    print(result)
+
+    if args.json:
+        output = result.to_dict()
+        output['path'] = args.path
+        output['speed'] = args.speed
+        output['startup'] = startup
+        with open(args.json, 'w') as fp:
+            json.dump(output, fp, indent=4)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
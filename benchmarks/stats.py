@@ -0,0 +1,30 @@
+'''Small helpers for summarizing benchmark timings'''
+# The same percentiles as the player's performance overlay reports
+from rory.metrics import percentile
+
+def summarize(values):
+    ''' Get a dict of count, mean, p50, p90, p99 and max '''
+    if values:
+        mean = sum(values) / len(values)
+    else:
+        mean = 0
+
+    return {
+        "count": len(values),
+        "mean": mean,
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0)
+    }
+
+def format_ms(summary):
+    ''' Format a summary of second-timings as milliseconds '''
+    return "n=%d mean=%.3fms p50=%.3fms p90=%.3fms p99=%.3fms max=%.3fms" % (
+        summary['count'],
+        summary['mean'] * 1000,
+        summary['p50'] * 1000,
+        summary['p90'] * 1000,
+        summary['p99'] * 1000,
+        summary['max'] * 1000
+    )
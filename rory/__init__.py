@@ -2,7 +2,11 @@
 # coding=utf-8
 """
 Usage:
-    rory path/to/midi.midi
+    rory path/to/midi.midi [-t transpose] [-i path/to/pipe] [-p profile/prefix] [-s metrics/path] [-q 16] [-c ticks] [-l session.rorylog] [-k chord_window_ms]
+    rory compile path/to/midi.midi [-o path/to/output.rory] [-t transpose] [-q 16] [-c ticks]
+    rory validate path/to/library [-j workers] [-w timeout_seconds] [-r report.json] [-f 1] [-q 16] [-c ticks]
+    rory classroom path/to/midi.midi [-i path/to/pipe,path/to/other/pipe] [-q 16] [-c ticks]
+    rory export path/to/session.rorylog [-o path/to/output.mid]
 """
 
 __version__ = "0.3.9"
@@ -19,7 +23,19 @@ def main():
     from .interface import RoryStage, TerminalTooNarrow
     options = {
         "-t": ("transpose", int),
-        "-m": ('numode', int)
+        "-m": ('numode', int),
+        "-i": ('input_path', str),
+        "-p": ('profile', str),
+        "-s": ('metrics_path', str),
+        "-q": ('quantize', int),
+        "-c": ('quantize_tolerance', int),
+        "-o": ('output_path', str),
+        "-j": ('workers', int),
+        "-w": ('timeout', int),
+        "-r": ('report_path', str),
+        "-f": ('fill_cache', int),
+        "-l": ('session_log_path', str),
+        "-k": ('chord_window', int)
     }
 
     arguments = sys.argv[1:]
@@ -43,25 +59,130 @@ def main():
         else:
             i += 1
 
+    if arguments and arguments[0] == 'compile':
+        from .songfile import compile_file
+        if len(arguments) < 2:
+            print("A song is required to compile")
+            sys.exit()
+
+        start = time.perf_counter()
+        try:
+            midi_interface, output_path = compile_file(arguments[1], kwargs.pop('output_path', None), **kwargs)
+        except InvalidMIDIFile:
+            print("\"%s\" is not a valid MIDI" % arguments[1])
+            sys.exit(1)
+        print("Compiled %d states to %s in %.2fs" % (
+            len(midi_interface.state_map),
+            output_path,
+            time.perf_counter() - start
+        ))
+        return
+
+    if arguments and arguments[0] == 'export':
+        from .session_log import export_midi, InvalidSessionLog
+        if len(arguments) < 2:
+            print("A session log is required to export")
+            sys.exit()
+
+        output_path = kwargs.get('output_path', None)
+        if output_path is None:
+            output_path = os.path.splitext(arguments[1])[0] + '.mid'
+        try:
+            note_count = export_midi(arguments[1], output_path)
+        except (OSError, InvalidSessionLog) as exception:
+            print("Couldn't export \"%s\": %s" % (arguments[1], exception))
+            sys.exit(1)
+        print("Wrote %d notes to %s" % (note_count, output_path))
+        return
+
+    if arguments and arguments[0] == 'validate':
+        from .batch import validate_library
+        from .prefetch import SongPrefetcher
+        from .songfile import CompiledSongCache
+        if len(arguments) < 2:
+            print("A directory is required to validate")
+            sys.exit()
+
+        cache = None
+        if kwargs.get('fill_cache', 0):
+            cache = CompiledSongCache()
+
+        try:
+            validate_library(
+                arguments[1],
+                report_path=kwargs.get('report_path', None),
+                workers=kwargs.get('workers', None),
+                timeout=kwargs.get('timeout', 30),
+                cache=cache,
+                **SongPrefetcher.get_compile_options(kwargs)
+            )
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if arguments and arguments[0] == 'classroom':
+        from .classroom import run_classroom
+        if len(arguments) < 2:
+            print("A song is required for the classroom")
+            sys.exit()
+
+        input_path = kwargs.pop('input_path', None)
+        try:
+            run_classroom(
+                arguments[1],
+                input_paths=input_path.split(',') if input_path else (),
+                **kwargs
+            )
+        except KeyboardInterrupt:
+            pass
+        except InvalidMIDIFile:
+            print("\"%s\" is not a valid MIDI" % arguments[1])
+        return
+
+    session_log_path = kwargs.get('session_log_path', None)
+    if session_log_path and os.path.isfile(session_log_path) and os.path.getsize(session_log_path):
+        from .session_log import read_header, InvalidSessionLog
+        # Checked up front rather than failing once the song has loaded
+        try:
+            with open(session_log_path, 'rb') as fp:
+                read_header(fp)
+        except (OSError, InvalidSessionLog) as exception:
+            print("Can't append to \"%s\": %s" % (session_log_path, exception))
+            sys.exit(1)
+
+    profile_path = kwargs.pop('profile', None)
+    metrics_path = kwargs.pop('metrics_path', None)
     try:
         interface = RoryStage()
     except TerminalTooNarrow:
         print("Terminal needs to be at least 106 characters wide")
         sys.exit()
 
+    profiler = None
+    if profile_path:
+        from .profiler import SamplingProfiler
+        profiler = SamplingProfiler()
+        profiler.start()
+
+    metrics_writer = None
+    if metrics_path:
+        from .metrics import METRICS, MetricsWriter
+        metrics_writer = MetricsWriter(METRICS, metrics_path)
+        metrics_writer.start()
+
     try:
         interface.play()
 
-        if len(sys.argv) < 2:
+        if not arguments:
             kwargs['path'] = os.path.realpath(".")
             interface.start_scene(
                 RoryStage.CONTEXT_BROWSER,
                 **kwargs
             )
         else:
-            kwargs['path'] = sys.argv[1]
+            kwargs['path'] = arguments[0]
             interface.start_scene(
-                RoryStage.CONTEXT_PLAYER,
+                RoryStage.CONTEXT_LOADING,
                 **kwargs
             )
 
@@ -73,8 +194,19 @@ def main():
         interface.kill()
     except InvalidMIDIFile:
         interface.kill()
-        print("\"%s\" is not a valid MIDI" % sys.argv[1])
+        print("\"%s\" is not a valid MIDI" % arguments[0])
+    except BaseException:
+        # Give the terminal back before the traceback is printed
+        interface.kill()
+        raise
+    finally:
+        if metrics_writer is not None:
+            metrics_writer.stop()
 
+        if profiler is not None:
+            profiler.stop()
+            pstats_path, folded_path = profiler.write(profile_path)
+            print("Profile written to %s and %s" % (pstats_path, folded_path))
 
 
 if __name__ == "__main__":
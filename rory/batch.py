@@ -0,0 +1,186 @@
+'''Validate and compile a whole library of songs in parallel'''
+import json
+import multiprocessing
+import os
+import resource
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from apres import MIDI, InvalidMIDIFile
+from .midiinterface import MIDIInterface
+from .library import LibraryIndex
+from .songfile import write
+
+STATUS_OK = 'ok'
+STATUS_INVALID = 'invalid' # Not a MIDI file apres can read
+STATUS_ERROR = 'error' # Read, but failed to compile
+STATUS_TIMEOUT = 'timeout'
+STATUS_CRASHED = 'crashed' # The worker died without reporting, eg it ran out of memory
+
+def find_songs(path):
+    ''' Get every midi file under path, sorted '''
+    output = []
+    for directory, _directories, filenames in os.walk(path):
+        for filename in filenames:
+            if LibraryIndex.is_midi(filename):
+                output.append(os.path.join(directory, filename))
+    output.sort()
+    return output
+
+def get_peak_rss():
+    ''' Highest resident memory of this process so far, in bytes '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def compile_song(connection, path, kwargs, cache_path):
+    ''' Compile one song and send back its result. Runs in its own process '''
+    start_rss = get_peak_rss()
+    start = time.perf_counter()
+    result = {}
+    try:
+        midi_interface = MIDIInterface(MIDI.load(path), **kwargs)
+        result['status'] = STATUS_OK
+        result['states'] = len(midi_interface.state_map)
+        result['measures'] = len(midi_interface.measure_map)
+        if cache_path is not None:
+            write(midi_interface, cache_path)
+    except InvalidMIDIFile as exception:
+        result['status'] = STATUS_INVALID
+        result['error'] = str(exception) or "Not a valid MIDI file"
+    except Exception as exception:
+        result['status'] = STATUS_ERROR
+        result['error'] = f"{type(exception).__name__}: {exception}"
+
+    result['seconds'] = time.perf_counter() - start
+    result['peak_memory'] = max(0, get_peak_rss() - start_rss)
+    connection.send(result)
+    connection.close()
+
+
+class BatchCompiler:
+    '''
+        Compiles songs each in their own process, a bounded number at once.
+        A song taking longer than timeout seconds has its process killed,
+        so one pathological file can't hold up the rest.
+    '''
+    def __init__(self, workers=None, timeout=30, cache=None, **kwargs):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        # A CompiledSongCache to fill with every song that compiles
+        self.cache = cache
+        self.compile_options = kwargs
+        # Forked, so starting a process per song stays cheap.
+        # This is only used from the command line, before any threads are started.
+        self.context = multiprocessing.get_context('fork')
+
+    def __start(self, path):
+        receiver, sender = self.context.Pipe(duplex=False)
+        cache_path = None
+        if self.cache is not None:
+            try:
+                cache_path = self.cache.get_path(path, **self.compile_options)
+            except OSError:
+                pass
+
+        process = self.context.Process(
+            target=compile_song,
+            args=(sender, path, self.compile_options, cache_path),
+            daemon=True
+        )
+        process.start()
+        sender.close()
+        return (process, receiver, time.perf_counter())
+
+    def run(self, paths):
+        ''' Compile every path. Yields (path, result) in the order they finish '''
+        pending = deque(paths)
+        running = {} # path: (process, connection, started)
+        while pending or running:
+            while pending and len(running) < self.workers:
+                path = pending.popleft()
+                running[path] = self.__start(path)
+
+            now = time.perf_counter()
+            next_deadline = min(started + self.timeout for _, _, started in running.values())
+            wait(
+                [connection for _, connection, _ in running.values()]
+                + [process.sentinel for process, _, _ in running.values()],
+                timeout=max(0, next_deadline - now)
+            )
+
+            now = time.perf_counter()
+            for path, (process, connection, started) in list(running.items()):
+                result = None
+                if connection.poll():
+                    try:
+                        result = connection.recv()
+                    except EOFError:
+                        result = None
+                    if result is None:
+                        result = {"status": STATUS_CRASHED, "error": f"Exit code {process.exitcode}"}
+                elif not process.is_alive():
+                    result = {"status": STATUS_CRASHED, "error": f"Exit code {process.exitcode}"}
+                elif now - started >= self.timeout:
+                    process.kill()
+                    result = {"status": STATUS_TIMEOUT, "error": f"Took over {self.timeout}s"}
+
+                if result is None:
+                    continue
+
+                process.join()
+                connection.close()
+                del running[path]
+                result.setdefault('seconds', now - started)
+                yield (path, result)
+
+
+def validate_library(path, report_path=None, workers=None, timeout=30, cache=None, **kwargs):
+    '''
+        Compile every song under path, printing each result as it finishes.
+        Writes a json report to report_path if given. Returns {song path: result}
+    '''
+    songs = find_songs(path)
+    print(f"Compiling {len(songs)} songs")
+
+    results = {}
+    batch = BatchCompiler(workers, timeout, cache, **kwargs)
+    for i, (song_path, result) in enumerate(batch.run(songs)):
+        results[song_path] = result
+        if result['status'] == STATUS_OK:
+            detail = f"{result['states']} states, {result['peak_memory'] / (1024 * 1024):.1f}MB"
+        else:
+            detail = result.get('error', '')
+        print(f"[{i + 1}/{len(songs)}] {result['status']:>7} {result['seconds']:>7.2f}s {os.path.relpath(song_path, path)}: {detail}")
+
+    if cache is not None:
+        cache.prune()
+
+    counts = {}
+    for result in results.values():
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+
+    slowest = sorted(
+        (result['seconds'], song_path)
+        for song_path, result in results.items()
+        if result['status'] == STATUS_OK
+    )[-5:]
+    if slowest:
+        print("Slowest:")
+        for seconds, song_path in reversed(slowest):
+            print(f"{seconds:>9.2f}s {os.path.relpath(song_path, path)}")
+
+    if report_path is not None:
+        with open(report_path, 'w') as fp:
+            json.dump(
+                {
+                    "path": os.path.realpath(path),
+                    "options": kwargs,
+                    "timeout": timeout,
+                    "counts": counts,
+                    "songs": results
+                },
+                fp,
+                indent=4
+            )
+
+    return results
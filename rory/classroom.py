@@ -0,0 +1,209 @@
+'''Host many players in one process, sharing compiled songs between them'''
+import threading
+import time
+from apres import MIDI
+from .midiinterface import MIDIInterface
+from .player import Player
+from .prefetch import SongPrefetcher
+from .input_backends import DeviceBackend, PipeBackend, list_midi_devices
+
+class SharedSongs:
+    '''
+        Compiled songs, shared read-only between every session playing them.
+        Each song is compiled once and dropped when its last session lets go of it.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.songs = {} # key: [compile lock, MIDIInterface, sessions using it]
+
+    def acquire(self, path, **kwargs):
+        '''
+            Get a compiled song, compiling it if no session is using it yet.
+            Returns (key, MIDIInterface). The key is needed to release it.
+        '''
+        kwargs = SongPrefetcher.get_compile_options(kwargs)
+        key = SongPrefetcher.get_key(path, **kwargs)
+        with self.lock:
+            entry = self.songs.get(key)
+            if entry is None:
+                entry = [threading.Lock(), None, 0]
+                self.songs[key] = entry
+            entry[2] += 1
+
+        # Only sessions waiting on this song wait on its compile
+        with entry[0]:
+            if entry[1] is None:
+                try:
+                    entry[1] = MIDIInterface(MIDI.load(path), **kwargs)
+                except BaseException:
+                    self.release(key)
+                    raise
+
+        return (key, entry[1])
+
+    def release(self, key):
+        with self.lock:
+            entry = self.songs.get(key)
+            if entry is None:
+                return
+            entry[2] -= 1
+            if entry[2] <= 0:
+                del self.songs[key]
+
+    def get_users(self, key):
+        ''' Number of sessions using a song '''
+        with self.lock:
+            entry = self.songs.get(key)
+            if entry is None:
+                return 0
+            return entry[2]
+
+    def __len__(self):
+        return len(self.songs)
+
+
+class Session:
+    '''One student: a Player with its own input, on a song shared with the class'''
+    def __init__(self, name, player, song_key):
+        self.name = name
+        self.player = player
+        self.song_key = song_key
+        self.started = time.time()
+
+    def get_status(self):
+        player = self.player
+        controller_manager = player.controller_manager
+        return {
+            "name": self.name,
+            "path": player.active_path,
+            "position": player.song_position,
+            "states": len(player.midi_interface.state_map),
+            "loop": tuple(player.loop),
+            "pressed": sorted(controller_manager.get_pressed()),
+            "connected": controller_manager.is_connected(),
+            "time": time.time() - self.started
+        }
+
+
+class Classroom:
+    '''
+        Runs one Player per connected controller.
+        Only the per-session state (position, loop, ignored channels, pressed notes) is kept
+        for each student, so memory and compile time grow with the number of songs.
+    '''
+    def __init__(self, **kwargs):
+        # Compile options (see SongPrefetcher.COMPILE_OPTIONS) used for every song
+        self.compile_options = SongPrefetcher.get_compile_options(kwargs)
+        self.songs = SharedSongs()
+        self.sessions = {} # name: Session
+        self.lock = threading.Lock()
+
+    def add_session(self, name, path, backend):
+        ''' Start a Player for a student, reading notes from backend '''
+        song_key, midi_interface = self.songs.acquire(path, **self.compile_options)
+        try:
+            player = Player(
+                path=path,
+                midi_interface=midi_interface,
+                input_backend=backend
+            )
+        except BaseException:
+            self.songs.release(song_key)
+            raise
+
+        session = Session(name, player, song_key)
+        with self.lock:
+            old_session = self.sessions.pop(name, None)
+            self.sessions[name] = session
+
+        if old_session is not None:
+            self.__end_session(old_session)
+
+        return session
+
+    def remove_session(self, name):
+        with self.lock:
+            session = self.sessions.pop(name, None)
+
+        if session is not None:
+            self.__end_session(session)
+
+    def __end_session(self, session):
+        session.player.kill()
+        self.songs.release(session.song_key)
+
+    def assign(self, path, names=None):
+        ''' Move sessions (all of them by default) onto another song, from its beginning '''
+        with self.lock:
+            if names is None:
+                sessions = list(self.sessions.values())
+            else:
+                sessions = [self.sessions[name] for name in names if name in self.sessions]
+
+        for session in sessions:
+            song_key, midi_interface = self.songs.acquire(path, **self.compile_options)
+            old_key = session.song_key
+            session.song_key = song_key
+            session.player.active_path = path
+            session.player.set_midi_interface(midi_interface)
+            self.songs.release(old_key)
+
+    def get_session(self, name):
+        return self.sessions.get(name)
+
+    def get_names(self):
+        with self.lock:
+            return list(self.sessions.keys())
+
+    def get_status(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return [session.get_status() for session in sessions]
+
+    def close(self):
+        for name in self.get_names():
+            self.remove_session(name)
+
+
+def format_status(statuses):
+    ''' Format a table with a row for every session '''
+    lines = [f"{'session':<16} {'position':>14} {'time':>8}  pressed"]
+    for status in statuses:
+        if status['connected']:
+            position = f"{status['position']}/{status['states'] - 1}"
+        else:
+            position = "disconnected"
+        minutes, seconds = divmod(int(status['time']), 60)
+        pressed = ' '.join(str(note) for note in status['pressed'])
+        lines.append(f"{status['name']:<16} {position:>14} {minutes:>5}:{seconds:02}  {pressed}")
+    return "\n".join(lines)
+
+def run_classroom(path, input_paths=(), interval=1, **kwargs):
+    '''
+        Host a session for every MIDI device, and every path in input_paths, all on one song.
+        Devices plugged in or removed while running get sessions started or ended.
+        Status is redrawn every interval seconds until interrupted.
+    '''
+    classroom = Classroom(**kwargs)
+    try:
+        for input_path in input_paths:
+            classroom.add_session(input_path, path, PipeBackend(input_path))
+
+        while True:
+            devices = {
+                "midiC%dD%d" % device: device
+                for device in list_midi_devices()
+            }
+            names = classroom.get_names()
+            for name, device in devices.items():
+                if name not in names:
+                    classroom.add_session(name, path, DeviceBackend(*device))
+            for name in names:
+                if name.startswith("midiC") and name not in devices:
+                    classroom.remove_session(name)
+
+            # Clear the screen, then draw the table from the top
+            print("\033[H\033[2J" + path + "\n" + format_status(classroom.get_status()), flush=True)
+            time.sleep(interval)
+    finally:
+        classroom.close()
@@ -0,0 +1,185 @@
+'''Compile songs in a worker process, handing the result back without copying it'''
+import glob
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+from multiprocessing import resource_tracker
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from apres import MIDI
+from .midiinterface import MIDIInterface
+from .songfile import CompiledMIDIInterface, EXTENSION, SHARED_MEMORY_PATH, replace_file, serialize, write
+
+# Shared memory blocks are named after the worker making them, so the blocks of
+# a worker that is stopped part way through can be found and removed
+SHARED_MEMORY_PREFIX = 'rory_'
+
+def compile_in_worker(path, kwargs, cache_path=None):
+    '''
+        Compile a song in the worker process.
+        It's written to cache_path if given, otherwise to a new shared memory block
+        that the caller is responsible for unlinking.
+        Returns ('file', cache_path) or ('shared_memory', block name)
+    '''
+    midi_interface = MIDIInterface(MIDI.load(path), **kwargs)
+    if cache_path is not None:
+        write(midi_interface, cache_path)
+        return ('file', cache_path)
+
+    data = serialize(midi_interface)
+    shared_memory = SharedMemory(
+        name=f"{SHARED_MEMORY_PREFIX}{os.getpid()}_{uuid.uuid4().hex}",
+        create=True,
+        size=max(len(data), 1)
+    )
+    # The block belongs to the caller now, so it mustn't be cleaned up when this process exits
+    resource_tracker.unregister(shared_memory._name, 'shared_memory')
+    try:
+        shared_memory.buf[0:len(data)] = data
+    finally:
+        shared_memory.close()
+    return ('shared_memory', shared_memory.name)
+
+def get_block_path(name):
+    '''
+        Get where a shared memory block can be opened as a file. Blocks are mapped that way
+        rather than through SharedMemory, whose finalizer fails while the block is still mapped.
+    '''
+    return os.path.join(SHARED_MEMORY_PATH, name.lstrip('/'))
+
+def remove_block(block_path):
+    ''' Unlink a shared memory block, which SongCompiler.close() may have done already '''
+    try:
+        os.unlink(block_path)
+    except OSError:
+        pass
+
+def copy_block(block_path, path):
+    ''' Copy a compiled song out of a shared memory block, replacing path in one step '''
+    with open(block_path, 'rb') as source:
+        replace_file(path, lambda fp: shutil.copyfileobj(source, fp))
+
+
+class SongCompiler:
+    '''
+        Compiles songs in a worker process so the work doesn't hold this process's GIL.
+        Results are handed back as compiled song files or shared memory, which are mapped
+        rather than copied, so the cost of receiving a song doesn't grow with its size.
+    '''
+    def __init__(self, workers=1, cache=None):
+        # A CompiledSongCache. Songs found in it aren't compiled at all.
+        self.cache = cache
+        # Spawned, since forking a process with running threads isn't safe
+        context = multiprocessing.get_context('spawn')
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        # Speculative compiles (see SongPrefetcher) get a worker of their own,
+        # so a song that has actually been opened never waits behind one
+        self.background_pool = ProcessPoolExecutor(max_workers=1, mp_context=context)
+        # Submitted to either pool and not yet finished, so close() can cancel them
+        self.worker_futures = set()
+        self.lock = threading.Lock()
+
+    def submit(self, path, background=False, **kwargs):
+        '''
+            Start compiling a song. Returns a Future of a CompiledMIDIInterface.
+            background compiles are for songs that may not be opened at all.
+        '''
+        output = Future()
+
+        # Already compiled (see `rory compile`)
+        if path.endswith(EXTENSION):
+            try:
+                output.set_result(CompiledMIDIInterface.open(path))
+            except Exception as exception:
+                output.set_exception(exception)
+            return output
+
+        cache_path = None
+        if self.cache is not None:
+            midi_interface = self.cache.load(path, **kwargs)
+            if midi_interface is not None:
+                output.set_result(midi_interface)
+                return output
+            try:
+                cache_path = self.cache.get_path(path, **kwargs)
+            except OSError:
+                cache_path = None
+
+        if background:
+            pool = self.background_pool
+            # Nobody is waiting, so it may as well go straight into the cache
+            worker_future = pool.submit(compile_in_worker, path, kwargs, cache_path)
+        else:
+            # Handed over in memory, since the song is wanted now. It's cached from there.
+            pool = self.pool
+            worker_future = pool.submit(compile_in_worker, path, kwargs)
+        with self.lock:
+            self.worker_futures.add(worker_future)
+
+        def handoff(worker_future):
+            with self.lock:
+                self.worker_futures.discard(worker_future)
+            if worker_future.cancelled():
+                output.cancel()
+                return
+
+            block_path = None
+            try:
+                kind, location = worker_future.result()
+                if kind == 'file':
+                    midi_interface = CompiledMIDIInterface.open(location)
+                else:
+                    block_path = get_block_path(location)
+                    midi_interface = CompiledMIDIInterface.open(block_path)
+            except BaseException as exception:
+                if block_path is not None:
+                    remove_block(block_path)
+                output.set_exception(exception)
+                return
+
+            output.set_result(midi_interface)
+            if block_path is not None:
+                # Cached from the block rather than the mapping, which may already have been closed.
+                # The mapping outlives the block's name, so it's unlinked either way.
+                try:
+                    if cache_path is not None:
+                        copy_block(block_path, cache_path)
+                except OSError:
+                    pass
+                finally:
+                    remove_block(block_path)
+
+            if cache_path is not None:
+                self.cache.prune()
+
+        worker_future.add_done_callback(handoff)
+        return output
+
+    def compile(self, path, background=False, **kwargs):
+        ''' Compile a song, waiting for the result '''
+        return self.submit(path, background, **kwargs).result()
+
+    def close(self):
+        '''
+            Drop any queued compiles and stop the workers.
+            Compiles already underway are abandoned rather than waited on.
+        '''
+        # shutdown(cancel_futures=True) needs python 3.9
+        with self.lock:
+            worker_futures = list(self.worker_futures)
+        for worker_future in worker_futures:
+            worker_future.cancel()
+
+        for pool in (self.pool, self.background_pool):
+            # Only reachable through the executor before ProcessPoolExecutor.terminate_workers() (3.14)
+            processes = list((pool._processes or {}).values())
+            pool.shutdown(wait=False)
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+                # Anything a worker was part way through handing over
+                for block_path in glob.glob(get_block_path(f"{SHARED_MEMORY_PREFIX}{process.pid}_*")):
+                    remove_block(block_path)
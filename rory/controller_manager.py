@@ -1,113 +1,218 @@
 '''Plays MIDILike Objects'''
-import time
-import os
-import asyncio
-from asyncinotify import Inotify, Mask
+import queue
 import threading
+import time
 
-from apres import MIDI, MIDIController, MIDIEvent, NoteOn, NoteOff
-from .midiinterface import MIDIInterface
+from .input_backends import AlsaBackend
+from .metrics import METRICS
 
 class ControllerManager:
-    def __init__(self):
+    def __init__(self, backend=None, capture=None, chord_window=0):
         self.callbacks = {}
+        # A TimingCapture to record every note in, before anything else happens with it
+        self.capture = capture
 
         self.pressed = set()
+        # Several devices can hold the same note. It's only released once all of them let go
+        self.press_counts = {} # note: number of sources holding it
+        self.source_notes = {} # source: notes it holds
         self.state_check_ticket = 0
         self.processing_ticket = 0
+        self.ticket_condition = threading.Condition()
+
+        # Notes within chord_window seconds of each other are checked together, once.
+        # target_check is a function taking the pressed notes and returning whether they'd advance
+        # the song. If it's met, the check isn't held back at all.
+        self.chord_window = chord_window
+        self.target_check = None
+        self.check_condition = threading.Condition()
+        self.check_deadline = None
+        self.is_running = True
+        if self.chord_window:
+            self.check_thread = threading.Thread(target=self.__coalesce_state_checks, daemon=True)
+            self.check_thread.start()
+        else:
+            self.check_thread = None
+        # When the latest note came in. Used to measure how long it takes to advance.
+        self.last_input_time = 0
 
-        channel = 0
-        device_index = 0
-        self.controller = None
-        self.active_key = None
-        self.is_listening = True
-        self.watcher = threading.Thread(target=self.kludge_watch_for_midi_devices)
-        self.watcher.start()
-
-    def kludge_watch_for_midi_devices(self):
-        asyncio.run(self.async_process())
-
-    async def async_process(self):
-        watcher_task = asyncio.create_task(self.watch_for_midi_devices())
-        await asyncio.create_task(self.task_killer(watcher_task))
-
-    async def task_killer(self, task):
-        """Kill the an async task when is_listening becomes false."""
-        while self.is_listening:
-           await asyncio.sleep(.5)
-        task.cancel()
-
-    async def watch_for_midi_devices(self):
-        self.is_listening = True
-        for filename in os.listdir("/dev/snd/"):
-            if "midi" in filename:
-                device_index = int(filename[filename.rfind("D") + 1])
-                channel = int(filename[filename.rfind("C") + 1])
-                self.new_controller(channel, device_index)
-                break
-
-        with Inotify() as inotify:
-            inotify.add_watch("/dev/snd/", Mask.CREATE | Mask.DELETE)
-
-            async for event in inotify:
-                if event.name is None:
-                    continue
+        # Devices only put their notes on this queue. A single thread takes them off in order
+        # and applies them, so any number of devices share one pressed state without contending for it
+        self.input_queue = queue.SimpleQueue()
+        self.input_thread = threading.Thread(target=self.__process_input, daemon=True)
+        self.input_thread.start()
 
-                file_name = event.path.parts[-1]
-                if event.mask == Mask.CREATE:
-                    if file_name[0:4] == 'midi':
-                        time.sleep(.5)
-                        channel = int(file_name[file_name.rfind("C") + 1])
-                        device_id = int(file_name[file_name.rfind("D") + 1])
-                        self.new_controller(channel, device_id)
-
-                elif event.mask == Mask.DELETE:
-                    if 'midi' in file_name:
-                        channel = file_name[file_name.rfind("C") + 1]
-                        device_id = file_name[file_name.rfind("D") + 1]
-                        active_key = self.get_active_key()
-                        if active_key == (channel, device_id):
-                            self.disconnect_current()
+        if backend is None:
+            backend = AlsaBackend()
+        self.backend = backend
+        self.backend.start(self)
 
     def get_pressed(self):
         return self.pressed.copy()
 
     def close(self):
-        self.disconnect_current()
-        self.is_listening = False
+        self.backend.close()
+        self.input_queue.put(None)
+        if self.input_thread is not threading.current_thread():
+            self.input_thread.join()
+        with self.check_condition:
+            self.is_running = False
+            self.check_condition.notify()
+        if self.check_thread is not None and self.check_thread is not threading.current_thread():
+            self.check_thread.join()
+
+    def queue_note(self, source, note, pressed, timestamp=None):
+        '''
+            Press or release a note from a device's own thread. source identifies the device.
+            The note is applied by the input thread, in the order notes arrive across every device.
+            timestamp is the perf_counter() when the note was read, if that was before now.
+        '''
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        self.input_queue.put((timestamp, source, note, pressed))
+
+    def queue_disconnect(self, source):
+        ''' Release every note a device was holding, once the notes queued before it are applied '''
+        self.input_queue.put((time.perf_counter(), source, None, False))
+
+    def wait_for_input(self):
+        '''
+            Wait until the notes queued so far have been applied, and their state checks run
+            unless they're being held back by the chord window.
+            Returns False if the input thread stopped first.
+        '''
+        if self.input_thread is threading.current_thread():
+            return True
+
+        applied = threading.Event()
+        self.input_queue.put(applied)
+        while not applied.wait(.1):
+            if not self.input_thread.is_alive():
+                return False
+        return True
+
+    def __process_input(self):
+        while True:
+            item = self.input_queue.get()
+            if item is None:
+                break
 
-    def press_note(self, note):
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+
+            timestamp, source, note, pressed = item
+            if note is None:
+                for held_note in list(self.source_notes.get(source, ())):
+                    self.release_note(held_note, source, timestamp)
+                self.source_notes.pop(source, None)
+            elif pressed:
+                self.press_note(note, source, timestamp)
+            else:
+                self.release_note(note, source, timestamp)
+
+    def press_note(self, note, source=None, timestamp=None):
         '''Press a Midi Note'''
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        self.last_input_time = timestamp
+        if self.capture is not None:
+            self.capture.record(timestamp, note, True)
+
+        held = self.source_notes.setdefault(source, set())
+        if note not in held:
+            held.add(note)
+            self.press_counts[note] = self.press_counts.get(note, 0) + 1
         self.pressed.add(note)
-        self.do_state_check()
+        self.queue_state_check()
 
-    def release_note(self, note):
+    def release_note(self, note, source=None, timestamp=None):
         '''Release a Midi Note'''
-        try:
-            self.pressed.remove(note)
-        except KeyError:
-            pass
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        self.last_input_time = timestamp
+        if self.capture is not None:
+            self.capture.record(timestamp, note, False)
+
+        held = self.source_notes.get(source, ())
+        if note in held:
+            held.remove(note)
+            self.press_counts[note] -= 1
+            if not self.press_counts[note]:
+                del self.press_counts[note]
+
+        # Still held down on another device
+        if note in self.press_counts:
+            return
+
+        self.pressed.discard(note)
         try:
             self._do_callbacks("release_note", note)
         except KeyError:
             pass
-        self.do_state_check()
+        self.queue_state_check()
+
+    def queue_state_check(self):
+        '''
+            Check the state now if the pressed notes would advance the song or there's no chord window.
+            Otherwise leave it until the window from the first unchecked note has passed.
+        '''
+        if not self.chord_window \
+        or (self.target_check is not None and self.target_check(self.pressed)):
+            with self.check_condition:
+                self.check_deadline = None
+            self.do_state_check()
+            return
 
-    def do_state_check(self):
-        ''' Ticketed wrapper for player's do_state_check '''
-        my_ticket = self.state_check_ticket
-        self.state_check_ticket += 1
+        with self.check_condition:
+            if self.check_deadline is None:
+                self.check_deadline = time.perf_counter() + self.chord_window
+                self.check_condition.notify()
+            else:
+                METRICS.increment('state_checks_coalesced')
+
+    def __coalesce_state_checks(self):
+        ''' Run the state checks held back by queue_state_check once their window is up '''
+        with self.check_condition:
+            while self.is_running:
+                if self.check_deadline is None:
+                    self.check_condition.wait()
+                    continue
 
-        while my_ticket != self.processing_ticket:
-            time.sleep(.05)
+                remaining = self.check_deadline - time.perf_counter()
+                if remaining > 0:
+                    self.check_condition.wait(remaining)
+                    continue
 
-        # If there are newer tickets queued, skip this state_check
-        if my_ticket == self.state_check_ticket - 1:
-            self._do_callbacks('do_state_check')
-        else:
-            pass
+                self.check_deadline = None
+                self.check_condition.release()
+                try:
+                    self.do_state_check()
+                finally:
+                    self.check_condition.acquire()
 
-        self.processing_ticket += 1
+    def do_state_check(self):
+        ''' Ticketed wrapper for player's do_state_check '''
+        METRICS.increment('state_checks')
+        # Taken under the lock since held back checks are run from another thread
+        with self.ticket_condition:
+            my_ticket = self.state_check_ticket
+            self.state_check_ticket += 1
+            while my_ticket != self.processing_ticket:
+                self.ticket_condition.wait()
+
+        try:
+            # If there are newer tickets queued, skip this state_check
+            if my_ticket == self.state_check_ticket - 1:
+                start = time.perf_counter()
+                self._do_callbacks('do_state_check')
+                METRICS.add_time('state_check', time.perf_counter() - start)
+            else:
+                METRICS.increment('state_checks_skipped')
+        finally:
+            with self.ticket_condition:
+                self.processing_ticket += 1
+                self.ticket_condition.notify_all()
 
     def _do_callbacks(self, key, *args):
         if key in self.callbacks:
@@ -119,49 +224,16 @@ class ControllerManager:
             self.callbacks[key] = []
         self.callbacks[key].append((callback, args))
 
-    def new_controller(self, channel, device_id):
-        if self.controller is not None:
-            self.controller.close()
-
+    def new_controller_connected(self):
+        '''Called by the backend when it switches to a new device'''
         self._do_callbacks("new_controller")
-        self.controller = RoryController(channel, device_id, self)
-        self.active_key = (channel, device_id)
-        thread = threading.Thread(target=self.controller.listen)
-        thread.start()
-
-    def disconnect_current(self):
-        if self.controller is None:
-            return
 
-        self.controller.close()
-        self.controller = None
+    def get_queue_depth(self):
+        ''' Number of state checks waiting on, or being processed '''
+        return self.state_check_ticket - self.processing_ticket
 
     def get_active_key(self):
-        return self.active_key
+        return self.backend.get_active_key()
 
     def is_connected(self):
-        return self.controller is not None
-
-
-class RoryController(MIDIController):
-    def __init__(self, channel, device_index, controller_manager):
-        super().__init__(channel, device_index)
-        self.controller_manager = controller_manager
-
-    def hook_NoteOn(self, event):
-        if event.velocity == 0:
-            self.release_note(event.note)
-        else:
-            self.press_note(event.note)
-
-    def hook_NoteOff(self, event):
-        self.release_note(event.note)
-
-    def press_note(self, note):
-        '''Press a Midi Note'''
-        self.controller_manager.press_note(note)
-
-    def release_note(self, note):
-        '''Release a Midi Note'''
-        self.controller_manager.release_note(note)
-
+        return self.backend.is_connected()
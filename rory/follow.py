@@ -0,0 +1,97 @@
+'''Scroll through a song in real time, at its own tempo'''
+import threading
+import time
+from collections import deque
+from .metrics import METRICS
+
+class FollowScheduler:
+    '''
+        Advances a Player's song position at the times in its MIDIInterface's seconds_map.
+        Every deadline is measured from a single anchor on a monotonic clock, rather than
+        from the previous advance, so lateness doesn't accumulate over a song.
+    '''
+    # Sleeps can overshoot, so the last stretch before a deadline is spun through instead
+    SPIN = .001
+
+    def __init__(self, player):
+        self.player = player
+        self.thread = None
+        self.stop_event = threading.Event()
+        # Seconds each advance came after its deadline
+        self.lateness = deque(maxlen=256)
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        ''' Start following from the player's current position '''
+        if self.is_running():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def get_next_position(self, position):
+        ''' Get the next position with notes, or None if it's past the end of the loop '''
+        player = self.player
+        position += 1
+        while position <= player.loop[1] \
+        and not player.midi_interface.get_state(position, player.ignored_channels):
+            position += 1
+
+        if position > player.loop[1]:
+            return None
+        return position
+
+    def wait_until(self, deadline):
+        ''' Wait for a time on the perf_counter clock. Returns False if stopped first '''
+        remaining = deadline - time.perf_counter() - self.SPIN
+        if remaining > 0 and self.stop_event.wait(remaining):
+            return False
+
+        while time.perf_counter() < deadline:
+            if self.stop_event.is_set():
+                return False
+
+        return not self.stop_event.is_set()
+
+    def run(self):
+        player = self.player
+        midi_interface = None
+        position = None
+        anchor = 0 # perf_counter time of the start of the song
+        while not self.stop_event.is_set():
+            if player.midi_interface is not midi_interface or player.song_position != position:
+                # Jumped or changed songs. Carry on from wherever the player is now
+                midi_interface = player.midi_interface
+                position = player.song_position
+                anchor = time.perf_counter() - midi_interface.get_seconds(position)
+
+            next_position = self.get_next_position(position)
+            if next_position is None:
+                # Go back to the start of the loop once the end of the loop's last state is reached
+                next_position = player.loop[0]
+                anchor += midi_interface.get_seconds(player.loop[1] + 1) \
+                    - midi_interface.get_seconds(next_position)
+
+            deadline = anchor + midi_interface.get_seconds(next_position)
+            if not self.wait_until(deadline):
+                break
+
+            # Moved by something else while waiting
+            if player.song_position != position or player.midi_interface is not midi_interface:
+                continue
+
+            player.song_position = next_position
+            lateness = time.perf_counter() - deadline
+            position = next_position
+
+            self.lateness.append(lateness)
+            METRICS.add_time('follow_lateness', lateness)
+            player.update_tempo()
@@ -0,0 +1,398 @@
+'''Sources of note input for the ControllerManager'''
+import time
+import os
+import select
+import asyncio
+import threading
+from asyncinotify import Inotify, Mask
+
+from apres import MIDIController
+from .metrics import METRICS
+
+class InputBackend:
+    '''
+        Base class for anything that can press and release notes.
+        Backends report notes through the ControllerManager they are started with.
+    '''
+    def __init__(self):
+        self.controller_manager = None
+
+    def start(self, controller_manager):
+        ''' Begin passing notes to the controller_manager '''
+        self.controller_manager = controller_manager
+
+    def close(self):
+        ''' Stop listening for input '''
+
+    def is_connected(self):
+        ''' Is there currently a device to read from? '''
+        return False
+
+    def get_active_key(self):
+        ''' Get an identifier of the connected device '''
+        return None
+
+
+class AlsaBackend(InputBackend):
+    '''
+        Listens to every MIDI device in /dev/snd/ through apres at once,
+        picking up devices as they are plugged in, eg for duets or a keyboard and pads.
+        Their notes are merged by the ControllerManager.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.controllers = {} # (channel, device_id): RoryController
+        self.lock = threading.Lock()
+        # The most recently connected device
+        self.active_key = None
+        self.is_listening = False
+        self.watcher = None
+
+    def start(self, controller_manager):
+        super().start(controller_manager)
+        self.is_listening = True
+        self.watcher = threading.Thread(target=self.kludge_watch_for_midi_devices)
+        self.watcher.start()
+
+    def kludge_watch_for_midi_devices(self):
+        asyncio.run(self.async_process())
+
+    async def async_process(self):
+        watcher_task = asyncio.create_task(self.watch_for_midi_devices())
+        await asyncio.create_task(self.task_killer(watcher_task))
+
+    async def task_killer(self, task):
+        """Kill the an async task when is_listening becomes false."""
+        while self.is_listening:
+           await asyncio.sleep(.5)
+        task.cancel()
+
+    async def watch_for_midi_devices(self):
+        for channel, device_id in list_midi_devices():
+            self.new_controller(channel, device_id)
+
+        with Inotify() as inotify:
+            inotify.add_watch("/dev/snd/", Mask.CREATE | Mask.DELETE)
+
+            async for event in inotify:
+                if event.name is None:
+                    continue
+
+                file_name = event.path.parts[-1]
+                if event.mask == Mask.CREATE:
+                    if file_name[0:4] == 'midi':
+                        time.sleep(.5)
+                        channel = int(file_name[file_name.rfind("C") + 1])
+                        device_id = int(file_name[file_name.rfind("D") + 1])
+                        self.new_controller(channel, device_id)
+
+                elif event.mask == Mask.DELETE:
+                    if 'midi' in file_name:
+                        channel = int(file_name[file_name.rfind("C") + 1])
+                        device_id = int(file_name[file_name.rfind("D") + 1])
+                        self.disconnect((channel, device_id))
+
+    def new_controller(self, channel, device_id):
+        key = (channel, device_id)
+        # Plugged in again without being seen leaving
+        self.disconnect(key)
+
+        METRICS.increment('device_connections')
+        self.controller_manager.new_controller_connected()
+        controller = RoryController(channel, device_id, self.controller_manager)
+        with self.lock:
+            self.controllers[key] = controller
+            self.active_key = key
+        thread = threading.Thread(target=controller.listen)
+        thread.start()
+
+    def disconnect(self, key):
+        with self.lock:
+            controller = self.controllers.pop(key, None)
+            if self.active_key == key:
+                self.active_key = max(self.controllers, default=None)
+
+        if controller is None:
+            return
+
+        METRICS.increment('device_disconnections')
+        controller.close()
+        self.controller_manager.queue_disconnect(key)
+
+    def close(self):
+        for key in self.get_active_keys():
+            self.disconnect(key)
+        self.is_listening = False
+
+    def get_active_key(self):
+        return self.active_key
+
+    def get_active_keys(self):
+        ''' Get the (channel, device_id) of every connected device '''
+        with self.lock:
+            return sorted(self.controllers)
+
+    def is_connected(self):
+        return bool(self.controllers)
+
+
+def list_midi_devices():
+    ''' Get the (channel, device_id) of every MIDI device in /dev/snd/ '''
+    output = []
+    try:
+        filenames = os.listdir("/dev/snd/")
+    except OSError:
+        filenames = []
+
+    for filename in filenames:
+        if filename[0:4] == 'midi':
+            channel = int(filename[filename.rfind("C") + 1])
+            device_id = int(filename[filename.rfind("D") + 1])
+            output.append((channel, device_id))
+    output.sort()
+    return output
+
+
+class DeviceBackend(InputBackend):
+    '''
+        Listens to one specific MIDI device, for when several are in use at once.
+        Unlike AlsaBackend, it doesn't follow devices being plugged in.
+    '''
+    def __init__(self, channel, device_id):
+        super().__init__()
+        self.active_key = (channel, device_id)
+        self.controller = None
+
+    def start(self, controller_manager):
+        super().start(controller_manager)
+        METRICS.increment('device_connections')
+        self.controller = RoryController(*self.active_key, controller_manager)
+        thread = threading.Thread(target=self.controller.listen, daemon=True)
+        thread.start()
+
+    def close(self):
+        if self.controller is None:
+            return
+
+        METRICS.increment('device_disconnections')
+        self.controller.close()
+        self.controller = None
+        self.controller_manager.queue_disconnect(self.active_key)
+
+    def get_active_key(self):
+        return self.active_key
+
+    def is_connected(self):
+        return self.controller is not None
+
+
+class ScriptedBackend(InputBackend):
+    '''
+        Notes are pressed and released by calling this backend directly,
+        or by feeding it a script to play out. Needs no hardware.
+        Notes go through the input queue like any device's, but each call waits
+        until its note has been applied, so scripts and tests see the result right away.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.is_playing = False
+        self.thread = None
+
+    def is_connected(self):
+        return self.controller_manager is not None
+
+    def get_active_key(self):
+        return 'scripted'
+
+    def press_note(self, note):
+        self.controller_manager.queue_note('scripted', note, True)
+        self.controller_manager.wait_for_input()
+
+    def release_note(self, note):
+        self.controller_manager.queue_note('scripted', note, False)
+        self.controller_manager.wait_for_input()
+
+    def play(self, script, block=True):
+        '''
+            Play a list of (seconds to wait, note, velocity) in order.
+            A velocity of 0 releases the note.
+        '''
+        self.is_playing = True
+        if block:
+            self.__play(script)
+        else:
+            self.thread = threading.Thread(target=self.__play, args=(script,), daemon=True)
+            self.thread.start()
+
+    def __play(self, script):
+        for wait, note, velocity in script:
+            if not self.is_playing:
+                break
+
+            if wait:
+                time.sleep(wait)
+
+            if velocity:
+                self.press_note(note)
+            else:
+                self.release_note(note)
+        self.is_playing = False
+
+    def close(self):
+        self.is_playing = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class RawMIDIParser:
+    '''
+        Turns a stream of raw MIDI bytes into note presses and releases.
+        Handles running status and skips realtime, system and sysex messages.
+    '''
+    def __init__(self, press_note, release_note):
+        self.press_note = press_note
+        self.release_note = release_note
+        self.running_status = 0
+        self.data = []
+        self.in_sysex = False
+
+    @staticmethod
+    def get_data_length(status):
+        ''' Number of data bytes that follow a channel status byte '''
+        if status & 0xF0 in (0xC0, 0xD0):
+            return 1
+        return 2
+
+    def feed(self, chunk):
+        for byte in chunk:
+            if byte >= 0xF8:
+                # Realtime messages can appear anywhere, even between data bytes
+                continue
+
+            if byte & 0x80:
+                if byte == 0xF0:
+                    self.in_sysex = True
+                    self.running_status = 0
+                elif byte == 0xF7:
+                    self.in_sysex = False
+                elif byte >= 0xF0:
+                    # System common messages cancel running status
+                    self.in_sysex = False
+                    self.running_status = 0
+                else:
+                    self.in_sysex = False
+                    self.running_status = byte
+                self.data = []
+                continue
+
+            if self.in_sysex or not self.running_status:
+                continue
+
+            self.data.append(byte)
+            if len(self.data) == self.get_data_length(self.running_status):
+                self.__dispatch(self.running_status, self.data)
+                self.data = []
+
+    def __dispatch(self, status, data):
+        event_type = status & 0xF0
+        if event_type == 0x90 and data[1] > 0:
+            self.press_note(data[0])
+        elif event_type in (0x80, 0x90):
+            self.release_note(data[0])
+
+
+class PipeBackend(InputBackend):
+    '''
+        Reads raw MIDI bytes from a path, typically a named pipe (mkfifo).
+        A regular file also works, with bytes read as they are appended.
+    '''
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.fd = None
+        self.is_listening = False
+        self.thread = None
+        self.parser = None
+
+    def start(self, controller_manager):
+        super().start(controller_manager)
+        self.parser = RawMIDIParser(
+            lambda note: controller_manager.queue_note(self.path, note, True),
+            lambda note: controller_manager.queue_note(self.path, note, False)
+        )
+        # Non-blocking, so opening a pipe doesn't wait for a writer
+        self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        self.is_listening = True
+        self.thread = threading.Thread(target=self.listen, daemon=True)
+        self.thread.start()
+
+    def listen(self):
+        while self.is_listening:
+            readable, _, _ = select.select([self.fd], [], [], .5)
+            if not readable:
+                continue
+
+            try:
+                chunk = os.read(self.fd, 1024)
+            except BlockingIOError:
+                chunk = b''
+
+            if chunk:
+                METRICS.increment('input_bytes', len(chunk))
+                self.parser.feed(chunk)
+            else:
+                # End of a regular file or no writer on the pipe. Wait for more.
+                time.sleep(.02)
+
+    def get_active_key(self):
+        return self.path
+
+    def is_connected(self):
+        return self.fd is not None
+
+    def close(self):
+        self.is_listening = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class RoryController(MIDIController):
+    def __init__(self, channel, device_index, controller_manager):
+        super().__init__(channel, device_index)
+        self.controller_manager = controller_manager
+        self.key = (channel, device_index)
+
+    def get_next_byte(self):
+        output = super().get_next_byte()
+        METRICS.increment('input_bytes')
+        return output
+
+    def get_next_event(self):
+        # Stamped on the reading thread. apres calls the hooks from a list it only polls
+        # every 10ms, which would otherwise be added to when each note came in.
+        event = super().get_next_event()
+        if event is not None:
+            event.read_time = time.perf_counter()
+        return event
+
+    def hook_NoteOn(self, event):
+        if event.velocity == 0:
+            self.release_note(event.note, event.read_time)
+        else:
+            self.press_note(event.note, event.read_time)
+
+    def hook_NoteOff(self, event):
+        self.release_note(event.note, event.read_time)
+
+    def press_note(self, note, timestamp=None):
+        '''Press a Midi Note'''
+        self.controller_manager.queue_note(self.key, note, True, timestamp)
+
+    def release_note(self, note, timestamp=None):
+        '''Release a Midi Note'''
+        self.controller_manager.queue_note(self.key, note, False, timestamp)
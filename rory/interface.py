@@ -4,12 +4,17 @@ import threading
 import time
 import os
 from typing import Final
+from collections import OrderedDict, deque
 from abc import ABC
 import wrecked
 from wrecked import get_terminal_size
-from apres import MIDI
 from .player import Player
 from .interactor import Interactor
+from .library import LibraryIndex, SongSummaryScanner
+from .prefetch import SongPrefetcher
+from .compiler import SongCompiler
+from .songfile import CompiledSongCache
+from .metrics import METRICS, get_rss, percentile
 
 class TerminalTooNarrow(Exception):
     '''Error thrown when the minimum width required isn't available'''
@@ -22,6 +27,7 @@ class RoryStage:
     CONTEXT_DEFAULT = 0
     CONTEXT_PLAYER = 1
     CONTEXT_BROWSER = 2
+    CONTEXT_LOADING = 3
 
     CONTROL_QUIT = 'q'
 
@@ -44,6 +50,15 @@ class RoryStage:
         self.interactor_running = False
         self.delay = 1/32
         self.playing = False
+        # (time drawn, seconds spent in tick and draw) of recent frames
+        self.frame_times = deque(maxlen=256)
+
+        # Songs are compiled in another process, so loading one doesn't stall drawing or input
+        try:
+            song_cache = CompiledSongCache()
+        except OSError:
+            song_cache = None
+        self.song_compiler = SongCompiler(cache=song_cache)
 
         if self.root.width < 106:
             self.kill()
@@ -55,10 +70,10 @@ class RoryStage:
             self.kill
         )
 
-
         self.scene_constructors = {
             self.CONTEXT_PLAYER: PlayerScene,
-            self.CONTEXT_BROWSER: BrowserScene
+            self.CONTEXT_BROWSER: BrowserScene,
+            self.CONTEXT_LOADING: LoadingScene
         }
 
 
@@ -97,6 +112,7 @@ class RoryStage:
         self.interactor.kill_flag = True
 
         for scene in self.scenes.values():
+            scene.takedown()
             scene.disable()
             scene.root.detach()
             del scene
@@ -104,6 +120,7 @@ class RoryStage:
         while self.interactor_running:
             time.sleep(.1)
         wrecked.kill()
+        self.song_compiler.close()
 
     def resize(self, width, height):
         ''' Resize the wrecked screen and adjust the active scene's size '''
@@ -152,8 +169,15 @@ class RoryStage:
                 try:
                     if scene.has_kill_message():
                         self.process_kill_message(scene.get_kill_message())
-                    elif scene.tick():
-                        scene.draw()
+                    else:
+                        start = time.perf_counter()
+                        if scene.tick():
+                            scene.draw()
+                            now = time.perf_counter()
+                            self.frame_times.append((now, now - start))
+                            METRICS.add_time('frame', now - start)
+                        else:
+                            METRICS.increment('frames_skipped')
                 except Exception as generic_exception:
                     self.kill()
                     raise generic_exception
@@ -165,6 +189,7 @@ class RoryStage:
     def remove_scene(self, key):
         ''' Remove the scene found @ 'key' '''
         if self.scenes[key]:
+            self.scenes[key].takedown()
             self.scenes[key].disable()
             self.scenes[key].root.detach()
             del self.scenes[key]
@@ -173,7 +198,13 @@ class RoryStage:
         ''' Process kill message that may have been set in a scene '''
         dokill, scene_context, kwargs = msg
 
-        if dokill:
+        if dokill and scene_context:
+            # Replace the scene without adding it to the history, eg once a song has loaded
+            self.remove_scene(self.active_scene)
+            self.active_scene = None
+            self.start_scene(scene_context, **kwargs)
+
+        elif dokill:
             self.remove_scene(self.active_scene)
             if self.history_stack:
                 previous_scene_key = self.history_stack.pop()
@@ -267,6 +298,9 @@ class RoryScene(ABC):
 class BrowserScene(RoryScene):
     ''' File Browser. Shows only .mid files and directories '''
     CONTROL_QUIT = 'q'
+    # Seconds the cursor has to rest on a song before it's compiled ahead
+    PREFETCH_DELAY = .25
+
     def init_interactor(self, interactor):
         interactor.assign_context_sequence(
             RoryStage.CONTEXT_BROWSER,
@@ -303,9 +337,18 @@ class BrowserScene(RoryScene):
     def __init__(self, rorystage: RoryStage, **kwargs):
         super().__init__(rorystage)
         self.path = kwargs.get('path', os.environ['HOME'])
+        self.input_path = kwargs.get('input_path', None)
+        self.session_log_path = kwargs.get('session_log_path', None)
+        self.chord_window = kwargs.get('chord_window', Player.CHORD_WINDOW)
+        self.compile_options = SongPrefetcher.get_compile_options(kwargs)
 
         self.path_offsets = {}
         self._working_file_list = []
+        self.library = LibraryIndex()
+        self.summary_scanner = SongSummaryScanner()
+        self.song_prefetcher = SongPrefetcher(compiler=rorystage.song_compiler)
+        self.offset_changed_at = 0
+        self.prefetched_offset = None
 
         self.set_working_path(self.path)
 
@@ -313,11 +356,15 @@ class BrowserScene(RoryScene):
         self.rect_title_path = self.rect_title.new_rect()
         self.rect_offset = self.root.new_rect()
         self.rect_browser_main = self.root.new_rect()
-        self.working_rect_columns = []
+        # A fixed grid of rects, reused for whichever page of entries is visible
         self.working_rect_files = []
+        self.column_count = 1
+        self.column_width = 0
 
         self.rendered_path = None
         self.rendered_offset = None
+        self.rendered_page = None
+        self.rendered_size = None
 
     def get_offset(self):
         ''' Get the current position of the cursor '''
@@ -332,8 +379,15 @@ class BrowserScene(RoryScene):
         else:
             self.end_scene(
                 False,
-                RoryStage.CONTEXT_PLAYER,
-                { 'path': self.working_path + '/' + path }
+                RoryStage.CONTEXT_LOADING,
+                {
+                    'path': self.working_path + '/' + path,
+                    'prefetcher': self.song_prefetcher,
+                    'input_path': self.input_path,
+                    'session_log_path': self.session_log_path,
+                    'chord_window': self.chord_window,
+                    **self.compile_options
+                }
             )
 
     def set_working_path(self, new_path):
@@ -343,34 +397,26 @@ class BrowserScene(RoryScene):
             self.path_offsets[self.working_path] = 0
 
         self._working_file_list = [(True, '..')]
-        dirs = []
-        files = []
-        for filename in os.listdir(self.working_path):
-            if os.path.isfile(self.working_path + '/' + filename):
-                if filename[filename.rfind(".") + 1:].lower() == 'mid':
-                    files.append(filename)
-            elif os.path.isdir(self.working_path + '/' + filename):
-                dirs.append(filename)
-
-        dirs.sort()
+        dirs, files = self.library.get_listing(self.working_path)
         for directory in dirs:
             self._working_file_list.append((True, directory))
-        files.sort()
         for filename in files:
             self._working_file_list.append((False, filename))
+        # The listing was reread, so the page has to be redrawn even if the path didn't change
         self.rendered_offset = None
+        self.rendered_page = None
 
     def next_row(self):
         ''' Move the cursor down to the next row '''
         offset = self.path_offsets[self.working_path]
-        offset += len(self.working_rect_columns)
+        offset += self.column_count
         offset = min(len(self._working_file_list) - 1, offset)
         self.path_offsets[self.working_path] = offset
 
     def prev_row(self):
         ''' Move the cursor up to the previous row '''
         offset = self.path_offsets[self.working_path]
-        offset -= len(self.working_rect_columns)
+        offset -= self.column_count
         offset = max(0, offset)
         self.path_offsets[self.working_path] = offset
 
@@ -388,66 +434,110 @@ class BrowserScene(RoryScene):
         offset = max(0, offset)
         self.path_offsets[self.working_path] = offset
 
-    def tick(self):
-        ''' Update the display '''
-        was_changed = False
+    def takedown(self):
+        self.library.close()
+        self.summary_scanner.close()
+        self.song_prefetcher.close()
 
-        if self.working_path != self.rendered_path:
-            self.rect_browser_main.resize(self.root.width, self.root.height - 1)
-            self.rect_browser_main.move(0,1)
-
-            min_column_width = 50
-            columns = 1
-            while True:
-                if not (
-                    len(self._working_file_list) / columns < self.rect_browser_main.height or
-                    self.rect_browser_main.width / columns < min_column_width
-                ):
-                    columns += 1
-                else:
-                    break
+    def get_page_size(self):
+        ''' Number of entries that fit on screen at once '''
+        return self.column_count * self.rect_browser_main.height
 
-            for path in self.working_rect_files:
-                path.detach()
-                del path
+    def __layout_file_grid(self):
+        '''
+            Work out the columns for the current directory and (re)build the grid
+            of entry rects. The grid is bounded by the terminal size, not the directory size.
+        '''
+        self.rect_browser_main.resize(self.root.width, self.root.height - 1)
+        self.rect_browser_main.move(0, 1)
+
+        min_column_width = 50
+        columns = 1
+        while True:
+            if not (
+                len(self._working_file_list) / columns < self.rect_browser_main.height or
+                self.rect_browser_main.width / columns < min_column_width
+            ):
+                columns += 1
+            else:
+                break
+
+        column_width = (self.root.width - (columns * 2)) // columns
+        slot_count = columns * self.rect_browser_main.height
+        if columns != self.column_count \
+        or column_width != self.column_width \
+        or slot_count != len(self.working_rect_files):
+            for rect_file in self.working_rect_files:
+                rect_file.remove()
+            METRICS.increment('rects_removed', len(self.working_rect_files))
             self.working_rect_files = []
 
-            column_width = (self.root.width - (columns * 2)) // columns
-            for column in self.working_rect_columns:
-                column.remove()
-                del column
-            self.working_rect_columns = []
-
-
-            files_per_column = max(1, len(self._working_file_list) // columns)
-            extra = len(self._working_file_list) % files_per_column
-            for i in range(columns):
-                column_height = files_per_column
-                if extra:
-                    column_height += 1
-                    extra -= 1
-                rect_col = self.rect_browser_main.new_rect(width=column_width, height=column_height)
-                rect_col.move((i * (column_width + 1)), 0)
-                self.working_rect_columns.append(rect_col)
-
-            for i, (isdir, filename) in enumerate(self._working_file_list):
-                rect_column = self.working_rect_columns[i % columns]
-                rect_file = rect_column.new_rect()
-                rect_file.resize(rect_column.width, 1)
-                if isdir:
-                    rect_file.set_fg_color(wrecked.BLUE)
-                    f_text = "%02d) %s" % (i, filename)
-                else:
-                    f_text = "%02d) %s" % (i, filename[0:filename.rfind(".")])
-
-                if len(f_text) > column_width:
-                    f_text = f_text[0:column_width]
-                y = i // columns
-                rect_file.move(0, y)
-                rect_file.set_string(0, 0, f_text)
+            for i in range(slot_count):
+                rect_file = self.rect_browser_main.new_rect()
+                rect_file.resize(column_width, 1)
+                rect_file.move((i % columns) * (column_width + 1), i // columns)
                 self.working_rect_files.append(rect_file)
+            METRICS.increment('rects_created', slot_count)
+
+        self.column_count = columns
+        self.column_width = column_width
+        self.rendered_size = (self.root.width, self.root.height)
+
+    def __draw_file_page(self, page):
+        ''' Fill the grid with the entries on the given page '''
+        first_index = page * len(self.working_rect_files)
+        entries = self._working_file_list[first_index:first_index + len(self.working_rect_files)]
+
+        # Summaries are read in the background. The page is redrawn as they come in.
+        summaries = self.summary_scanner.request([
+            self.working_path + '/' + filename
+            for isdir, filename in entries
+            if not isdir
+        ])
 
+        for slot, rect_file in enumerate(self.working_rect_files):
+            rect_file.clear_characters()
+            rect_file.unset_invert()
+
+            if slot >= len(entries):
+                continue
+
+            i = first_index + slot
+            isdir, filename = entries[slot]
+            if isdir:
+                rect_file.set_fg_color(wrecked.BLUE)
+                f_text = "%02d) %s" % (i, filename)
+            else:
+                rect_file.unset_fg_color()
+                f_text = "%02d) %s" % (i, filename[0:filename.rfind(".")])
+
+                summary = summaries.get(self.working_path + '/' + filename)
+                if summary is not None:
+                    summary_text = str(summary)
+                    name_width = self.column_width - len(summary_text) - 1
+                    if name_width > 8:
+                        f_text = f_text[0:name_width].ljust(name_width) + ' ' + summary_text
+
+            rect_file.set_string(0, 0, f_text[0:self.column_width])
+
+        self.rendered_page = page
+
+    def tick(self):
+        ''' Update the display '''
+        was_changed = False
+
+        if self.working_path != self.rendered_path \
+        or self.rendered_size != (self.root.width, self.root.height):
+            self.__layout_file_grid()
             self.rendered_path = self.working_path
+            self.rendered_page = None
+            self.rendered_offset = None
+
+        if self.summary_scanner.has_updates() and self.rendered_page is not None:
+            self.__draw_file_page(self.rendered_page)
+            if self.rendered_offset is not None:
+                self.working_rect_files[self.rendered_offset % self.get_page_size()].invert()
+            was_changed = True
 
         offset = self.path_offsets[self.working_path]
         if offset != self.rendered_offset:
@@ -479,34 +569,150 @@ class BrowserScene(RoryScene):
             self.rect_title_path.underline()
             self.rect_title_path.set_string(0, 0, title_string)
 
-            columns = len(self.working_rect_columns)
-            column_width = (self.root.width - (columns * 2)) // columns
-            isdir, fname = self._working_file_list[offset]
-            fname = fname[0:min(len(fname), column_width)]
-            if not isdir:
-                fname = fname[0:fname.rfind(".")]
-            f_text = "%02d) %s" % (offset, fname)
+            # Only rewrite the grid when the cursor moves to another page
+            page_size = self.get_page_size()
+            page = offset // page_size
+            if page != self.rendered_page:
+                self.__draw_file_page(page)
+            elif self.rendered_offset is not None:
+                self.working_rect_files[self.rendered_offset % page_size].unset_invert()
 
-            if self.rendered_offset is not None:
-                self.working_rect_files[self.rendered_offset].unset_invert()
-
-            rect_cursor = self.working_rect_files[offset]
-            rect_cursor.invert()
-
-            # Shift Page
-            column_page = (offset // len(self.working_rect_columns))
-            column_page //= self.rect_browser_main.height
-            for i, column in enumerate(self.working_rect_columns):
-                column.move(
-                    i * (column_width + 1),
-                    0 - (column_page * self.rect_browser_main.height)
-                )
+            self.working_rect_files[offset % page_size].invert()
 
             self.rendered_offset = offset
+            self.offset_changed_at = time.time()
             was_changed = True
 
+        elif (self.working_path, offset) != self.prefetched_offset \
+        and time.time() - self.offset_changed_at >= self.PREFETCH_DELAY:
+            isdir, filename = self._working_file_list[offset]
+            if not isdir:
+                self.song_prefetcher.prefetch(
+                    self.working_path + '/' + filename,
+                    **self.compile_options
+                )
+            self.prefetched_offset = (self.working_path, offset)
+
         return was_changed
 
+class NoteLayer:
+    '''
+        The rects that make up one rendering of the visible notes:
+        measure/beat lines, tails of held notes, notes and loop lines.
+    '''
+    def __init__(self, parent):
+        self.root = parent.new_rect()
+        self.layer_lines = self.root.new_rect()
+        # Between the lines and notes so a tail never covers the note it belongs to
+        self.layer_tails = self.root.new_rect()
+        self.layer_notes = self.root.new_rect()
+        self.rect_loop_start = self.layer_notes.new_rect()
+        self.rect_loop_end = self.layer_notes.new_rect()
+
+        for rect in (self.root, self.layer_lines, self.layer_tails, self.layer_notes):
+            rect.set_transparency(True)
+
+        for rect in (self.rect_loop_start, self.rect_loop_end):
+            rect.unset_bg_color()
+            rect.set_fg_color(wrecked.BRIGHTWHITE)
+
+        self.note_rects = {}
+        self.tail_rects = {}
+        self.line_rects = {}
+        METRICS.increment('rects_created', 6)
+
+    def resize(self, width, height):
+        ''' Resize the layer and its sub-layers '''
+        for rect in (self.root, self.layer_lines, self.layer_tails, self.layer_notes):
+            rect.resize(width, height)
+
+    def enable(self):
+        self.root.enable()
+
+    def disable(self):
+        self.root.disable()
+
+    def remove(self):
+        self.root.remove()
+        METRICS.increment(
+            'rects_removed',
+            6 + len(self.note_rects) + len(self.tail_rects) + len(self.line_rects)
+        )
+
+
+class LoadingScene(RoryScene):
+    '''
+        Shown while a song is compiled in the background.
+        Replaces itself with a PlayerScene once the song is ready.
+    '''
+    CONTROL_QUIT = 'q'
+    def init_interactor(self, interactor):
+        interactor.assign_context_sequence(
+            RoryStage.CONTEXT_LOADING,
+            self.CONTROL_QUIT,
+            self.end_scene
+        )
+
+    def __init__(self, rorystage: RoryStage, **kwargs):
+        super().__init__(rorystage)
+        prefetcher = kwargs.pop('prefetcher', None)
+        self.player_kwargs = kwargs
+        self.path = kwargs['path']
+        self.started = time.time()
+        self.midi_interface = None
+        self.error = None
+        self.rendered_text = None
+
+        self.rect_text = self.root.new_rect()
+
+        thread = threading.Thread(
+            target=self.load,
+            args=(prefetcher, SongPrefetcher.get_compile_options(kwargs)),
+            daemon=True
+        )
+        thread.start()
+
+    def load(self, prefetcher, compile_options):
+        ''' Wait on the compiled song. Called in its own thread '''
+        try:
+            if prefetcher is not None:
+                self.midi_interface = prefetcher.take(self.path, **compile_options)
+            else:
+                self.midi_interface = self.stage.song_compiler.compile(self.path, **compile_options)
+        except Exception as exception:
+            self.error = exception
+
+    def tick(self):
+        if self.midi_interface is not None:
+            self.end_scene(
+                True,
+                RoryStage.CONTEXT_PLAYER,
+                {
+                    **self.player_kwargs,
+                    'midi_interface': self.midi_interface
+                }
+            )
+            return False
+
+        filename = os.path.basename(self.path)
+        if self.error is not None:
+            text = f"Couldn't load {filename}: {self.error}. Press '{self.CONTROL_QUIT}' to go back"
+        else:
+            text = f"Loading {filename} ({int(time.time() - self.started)}s)"
+
+        text = text[0:self.root.width]
+        if text == self.rendered_text:
+            return False
+
+        self.rect_text.resize(len(text), 1)
+        self.rect_text.move((self.root.width - len(text)) // 2, self.root.height // 2)
+        self.rect_text.clear_characters()
+        self.rect_text.set_string(0, 0, text)
+        self.rendered_text = text
+
+        return True
+
+
 class PlayerScene(RoryScene):
     '''Handles visualization of the Player'''
     # Display constants
@@ -527,6 +733,14 @@ class PlayerScene(RoryScene):
     CONTROL_SET_POSITION = 'p'
     CONTROL_SET_MEASURE = 'P'
     CONTROL_SET_RANGE = 'r'
+    CONTROL_TOGGLE_HUD = 'd'
+    CONTROL_FOLLOW = 'f'
+
+    FRAME_CACHE_SIZE = 256
+    # Seconds between updates of the performance overlay
+    HUD_INTERVAL = .5
+    # Seconds a notice (see show_notice()) stays up
+    NOTICE_DURATION = 3
 
     COLORORDER: Final[list[int]] = [
         wrecked.BLUE,
@@ -551,6 +765,7 @@ class PlayerScene(RoryScene):
         'keyboard_sharp': chr(9608),
         'keyboard_natural': chr(9620),
         'keyboard_pressed': chr(9473),
+        'tail': chr(9474),
         'a_line': chr(9550),
         'menu': {
             'top': chr(9552),
@@ -616,6 +831,18 @@ class PlayerScene(RoryScene):
             self.toggle_help_menu
         )
 
+        interactor.assign_context_sequence(
+            RoryStage.CONTEXT_PLAYER,
+            self.CONTROL_TOGGLE_HUD,
+            self.toggle_hud
+        )
+
+        interactor.assign_context_sequence(
+            RoryStage.CONTEXT_PLAYER,
+            self.CONTROL_FOLLOW,
+            self.player.toggle_follow
+        )
+
         interactor.assign_context_sequence(
             RoryStage.CONTEXT_PLAYER,
             self.CONTROL_SET_POSITION,
@@ -674,25 +901,35 @@ class PlayerScene(RoryScene):
             fp.write(ansi_string)
 
     def __init__(self, rorystage: RoryStage, **kwargs):
-        self.player = Player(**kwargs)
+        prefetcher = kwargs.pop('prefetcher', None)
+        if prefetcher is not None:
+            kwargs['midi_interface'] = prefetcher.take(
+                kwargs['path'],
+                **SongPrefetcher.get_compile_options(kwargs)
+            )
+
+        self.player = Player(compiler=rorystage.song_compiler, **kwargs)
         self.nu_mode = kwargs.get('numode', False)
 
         super().__init__(rorystage)
 
-        self.active_midi = MIDI.load(kwargs['path'])
+        self.active_midi = self.player.active_midi
 
         self.rect_inner = self.root.new_rect()
         self.rect_background = self.rect_inner.new_rect()
         self.rect_active_row_line = self.rect_background.new_rect()
 
-        self.layer_visible_notes = self.rect_background.new_rect()
-        self.rect_loop_start = self.layer_visible_notes.new_rect()
-        self.rect_loop_end = self.layer_visible_notes.new_rect()
+        self.layer_visible_notes = NoteLayer(self.rect_background)
+        self.layer_cached_frames = self.rect_background.new_rect()
+        self.visible_frame = self.layer_visible_notes
+
+        # Fully rendered note layers, reused when looping over the same positions
+        self.frame_cache = OrderedDict()
+        self.frame_cache_context = None
 
         self.layer_active_notes = self.rect_background.new_rect()
 
-        self.visible_note_rects = {}
-        self.visible_note_rects_lines = {}
+        self.background_a_line_xs = set()
         self.pressed_note_rects = {}
 
         self.rect_position_display = self.rect_background.new_rect()
@@ -710,12 +947,6 @@ class PlayerScene(RoryScene):
         #self.rect_background.set_bg_color(wrecked.BLACK)
         self.rect_background.unset_bg_color()
         self.rect_background.set_fg_color(wrecked.BRIGHTBLACK)
-        #self.rect_loop_start.set_bg_color(wrecked.BLACK)
-        self.rect_loop_start.unset_bg_color()
-        #self.rect_loop_end.set_bg_color(wrecked.BLACK)
-        self.rect_loop_end.unset_bg_color()
-        self.rect_loop_start.set_fg_color(wrecked.BRIGHTWHITE)
-        self.rect_loop_end.set_fg_color(wrecked.BRIGHTWHITE)
 
         self.active_row_position = 8
 
@@ -728,6 +959,12 @@ class PlayerScene(RoryScene):
         self.last_rendered_note_range = self.player.note_range
         self.rect_help_menu = None
         self.flag_show_menu = False
+        self.rect_hud = None
+        self.flag_show_hud = False
+        self.last_hud_update = 0
+        self.rect_notice = None
+        self.notice_text = None
+        self.notice_expiry = 0
 
         self.mapped_colors = {}
         self.rechanneled = {}
@@ -743,6 +980,10 @@ class PlayerScene(RoryScene):
     def reset_transpose(self):
         ''' Set the transposition back to 0 '''
         register = self.player.get_register()
+        if not self.player.can_recompile():
+            self.show_notice("Compiled songs (.rory) can't be transposed. Compile it again with -t instead.")
+            return
+
         self.player.reinit_midi_interface(
             transpose=register
         )
@@ -817,23 +1058,188 @@ class PlayerScene(RoryScene):
                 was_flagged = True
                 self.rect_help_menu.disable()
 
+        # After the help menu, since the overlay's own updates shouldn't close it
+        if self.flag_show_hud:
+            if not self.rect_hud \
+            or not self.rect_hud.enabled \
+            or time.time() - self.last_hud_update >= self.HUD_INTERVAL:
+                self.draw_hud()
+                was_flagged = True
+        elif self.rect_hud and self.rect_hud.enabled:
+            self.rect_hud.disable()
+            was_flagged = True
+
+        if self.notice_text is not None:
+            self.draw_notice()
+            was_flagged = True
+        elif self.rect_notice and self.rect_notice.enabled and time.time() >= self.notice_expiry:
+            self.rect_notice.disable()
+            was_flagged = True
+
         return was_flagged
 
     def toggle_help_menu(self):
         ''' Set the flag to draw the help menu in the tick function '''
         self.flag_show_menu = not self.flag_show_menu
 
+    def toggle_hud(self):
+        ''' Set the flag to draw the performance overlay in the tick function '''
+        self.flag_show_hud = not self.flag_show_hud
+
+    def show_notice(self, text):
+        ''' Set a line of text to be shown along the bottom for NOTICE_DURATION seconds in the tick function '''
+        self.notice_text = text
+
+    def draw_notice(self):
+        ''' Draw the latest notice centred on the bottom row '''
+        if not self.rect_notice:
+            self.rect_notice = self.root.new_rect()
+            self.rect_notice.set_fg_color(wrecked.BRIGHTWHITE)
+            self.rect_notice.set_bg_color(wrecked.BLACK)
+
+        notice = self.rect_notice
+        text = self.notice_text[0:max(self.root.width - 2, 0)]
+        self.notice_text = None
+        notice.resize(len(text) + 2, 1)
+        notice.move(max((self.root.width - notice.width) // 2, 0), self.root.height - 1)
+        notice.clear_characters()
+        notice.set_string(1, 0, text)
+
+        if not notice.enabled:
+            notice.enable()
+        self.notice_expiry = time.time() + self.NOTICE_DURATION
+
+    def draw_hud(self):
+        '''
+            Draw render, input and memory figures in the top right corner.
+            Only called every HUD_INTERVAL seconds so it barely adds to what it measures.
+        '''
+        if not self.rect_hud:
+            self.rect_hud = self.root.new_rect()
+            self.rect_hud.set_fg_color(wrecked.BRIGHTWHITE)
+            self.rect_hud.set_bg_color(wrecked.BLACK)
+
+        now = time.perf_counter()
+        frame_times = list(self.stage.frame_times)
+        durations = [seconds for _drawn, seconds in frame_times]
+        fps = len([drawn for drawn, _seconds in frame_times if now - drawn <= 1])
+        last_frame = durations[-1] if durations else 0
+        latencies = list(self.player.advance_latencies)
+        last_latency = latencies[-1] if latencies else 0
+        measure = self.player.scorer.get_latest_measure()
+        if measure is None:
+            timing = "-"
+        else:
+            score = self.player.get_scores([measure])[measure]
+            timing = f"m{measure + 1} {score['hits']}/{score['expected']} +-{score['mean_error'] * 1000:.1f}ms"
+
+        lines = [
+            f"fps   {fps:>8d}",
+            f"frame {last_frame * 1000:>6.1f}ms  p95 {percentile(durations, 95) * 1000:>6.1f}ms",
+            f"input {last_latency * 1000:>6.1f}ms  p95 {percentile(latencies, 95) * 1000:>6.1f}ms",
+            f"queue {self.player.controller_manager.get_queue_depth():>8d}",
+            f"score {timing:>8}",
+            f"rss   {get_rss() / (1024 * 1024):>6.1f}MB"
+        ]
+
+        hud = self.rect_hud
+        hud.resize(max(len(line) for line in lines) + 2, len(lines))
+        hud.move(self.root.width - hud.width, 0)
+        hud.clear_characters()
+        for y, line in enumerate(lines):
+            hud.set_string(1, y, line)
+
+        if not hud.enabled:
+            hud.enable()
+        self.last_hud_update = time.time()
+
+
+    def __get_frame_key(self):
+        ''' All the inputs that determine what the visible note layer looks like '''
+        player = self.player
+        return (
+            player.song_position,
+            tuple(player.loop),
+            player.note_range,
+            player.get_transpose(),
+            frozenset(player.ignored_channels),
+            (self.root.width, self.root.height)
+        )
+
+    def __show_frame(self, frame):
+        if frame is not self.visible_frame:
+            self.visible_frame.disable()
+            frame.enable()
+            self.visible_frame = frame
+
+    def clear_frame_cache(self):
+        ''' Remove all the pre-rendered note layers '''
+        # Switch back before the visible frame is removed with the rest
+        self.__show_frame(self.layer_visible_notes)
+        for frame in self.frame_cache.values():
+            frame.remove()
+        self.frame_cache = OrderedDict()
+        self.frame_cache_context = None
+
+    def __get_cached_frame(self, frame_key):
+        '''
+            Get the fully rendered note layer for the given key, rendering it if needed.
+            Keys only differ by song position within a context, so any change
+            to the context invalidates the whole cache.
+        '''
+        context = frame_key[1:]
+        if context != self.frame_cache_context:
+            self.clear_frame_cache()
+            self.frame_cache_context = context
+
+        try:
+            frame = self.frame_cache[frame_key]
+            self.frame_cache.move_to_end(frame_key)
+        except KeyError:
+            frame = NoteLayer(self.layer_cached_frames)
+            frame.resize(self.rect_background.width, self.rect_background.height)
+            self.__draw_note_rows(frame)
+            self.frame_cache[frame_key] = frame
+            if len(self.frame_cache) > self.FRAME_CACHE_SIZE:
+                _, oldest = self.frame_cache.popitem(last=False)
+                oldest.remove()
+
+        return frame
 
     def __draw_visible_notes(self):
-        self.rect_loop_start.disable()
-        self.rect_loop_end.disable()
+        player = self.player
+        looping = player.loop != [0, len(player.midi_interface.state_map) - 1]
+
+        # Positions only repeat while looping, so only cache frames then
+        if looping:
+            frame = self.__get_cached_frame(self.__get_frame_key())
+        else:
+            if self.frame_cache:
+                self.clear_frame_cache()
+            frame = self.layer_visible_notes
+            self.__draw_note_rows(frame)
+
+        self.__show_frame(frame)
+
+        active_y = self.rect_background.height - self.active_row_position
+        self.rect_active_row_line.resize(self.rect_background.width, 1)
+        self.rect_active_row_line.move(0, active_y)
+        self.__draw_active_row_line()
+
+        self.__draw_song_position()
+
+    def __draw_note_rows(self, frame):
+        ''' Draw the notes, measure lines and loop lines at the current position into a NoteLayer '''
+        frame.rect_loop_start.disable()
+        frame.rect_loop_end.disable()
 
         song_position = self.player.song_position
         midi_interface = self.player.midi_interface
         state_map = midi_interface.state_map
         cache_keys_used = set()
         used_lines = set()
-        for _y in range(self.layer_visible_notes.height):
+        row_ys = {} # position: y
+        for _y in range(frame.layer_notes.height):
             position = song_position - self.active_row_position + _y
 
             if position < 0 or position >= len(state_map):
@@ -846,7 +1252,7 @@ class PlayerScene(RoryScene):
                 y = self.rect_background.height - _y + 1
             else:
                 y = self.rect_background.height - ((_y * 2) - self.active_row_position)
-
+            row_ys[position] = y
 
             row = midi_interface.active_notes_map[position]
             blocked_xs = set()
@@ -862,10 +1268,11 @@ class PlayerScene(RoryScene):
 
                 # Don't need to create and color a new rect if one already exists
                 try:
-                    note_rect = self.visible_note_rects[cachekey]
+                    note_rect = frame.note_rects[cachekey]
                 except KeyError:
-                    note_rect = self.layer_visible_notes.new_rect()
-                    self.visible_note_rects[cachekey] = note_rect
+                    note_rect = frame.layer_notes.new_rect()
+                    METRICS.increment('rects_created')
+                    frame.note_rects[cachekey] = note_rect
                     if self.nu_mode:
                         notename = '0123456789AB'[(message.note + 3) % 12]
                         note_rect.set_character(0, 0, notename)
@@ -884,65 +1291,138 @@ class PlayerScene(RoryScene):
 
             # Draw Measure Lines
             if position in midi_interface.beat_map and _y != self.active_row_position:
-                line_char = self.CHARS['measureline']
-                if position in midi_interface.measure_map:
-                    base = 1
-                else:
-                    base = 3
-
-                for x in range(1, self.rect_background.width, base):
-                    if x in blocked_xs:
-                        continue
-                    used_lines.add((position, x))
-
-                    try:
-                        line_rect = self.visible_note_rects_lines[(position, x)]
-                    except KeyError:
-                        line_rect = self.layer_visible_notes.new_rect()
-                        line_rect.set_character(0, 0, line_char)
-                        line_rect.set_fg_color(wrecked.BRIGHTBLACK)
-                        #line_rect.set_bg_color(wrecked.BLACK)
-                        line_rect.unset_bg_color()
-                        self.visible_note_rects_lines[(position, x)] = line_rect
-                    line_rect.move(x, y)
+                linekey = (position, self.player.note_range, frozenset(blocked_xs))
+                used_lines.add(linekey)
 
+                try:
+                    line_rect = frame.line_rects[linekey]
+                except KeyError:
+                    line_rect = self.__new_line_rect(
+                        frame.layer_lines,
+                        position in midi_interface.measure_map,
+                        blocked_xs
+                    )
+                    frame.line_rects[linekey] = line_rect
+                line_rect.move(0, y)
 
             if position == self.player.loop[0]:
-                self.rect_loop_start.enable()
+                frame.rect_loop_start.enable()
                 if _y != self.active_row_position:
-                    self.rect_loop_start.move(0, y + 1)
+                    frame.rect_loop_start.move(0, y + 1)
                 else:
-                    self.rect_loop_start.move(0, y + 2)
-                self.rect_loop_start.resize(self.rect_background.width, 1)
-                string = self.CHARS['loopline'] * self.rect_loop_start.width
-                self.rect_loop_start.set_string(0, 0, string)
+                    frame.rect_loop_start.move(0, y + 2)
+                frame.rect_loop_start.resize(self.rect_background.width, 1)
+                string = self.CHARS['loopline'] * frame.rect_loop_start.width
+                frame.rect_loop_start.set_string(0, 0, string)
 
             if position == self.player.loop[1]:
-                self.rect_loop_end.enable()
+                frame.rect_loop_end.enable()
                 if _y != self.active_row_position:
-                    self.rect_loop_end.move(0, y - 1)
+                    frame.rect_loop_end.move(0, y - 1)
                 else:
-                    self.rect_loop_end.move(0, y - 2)
-                self.rect_loop_end.resize(self.rect_background.width, 1)
-                string = self.CHARS['loopline'] * self.rect_loop_end.width
-                self.rect_loop_end.set_string(0, 0, string)
-
-        active_y = self.rect_background.height - self.active_row_position
-        self.rect_active_row_line.resize(self.rect_background.width, 1)
-        self.rect_active_row_line.move(0, active_y)
-        self.__draw_active_row_line()
+                    frame.rect_loop_end.move(0, y - 2)
+                frame.rect_loop_end.resize(self.rect_background.width, 1)
+                string = self.CHARS['loopline'] * frame.rect_loop_end.width
+                frame.rect_loop_end.set_string(0, 0, string)
 
-        unused_cache_keys = set(self.visible_note_rects.keys()) - cache_keys_used
+        unused_cache_keys = set(frame.note_rects.keys()) - cache_keys_used
         for key in unused_cache_keys:
-            self.visible_note_rects[key].remove()
-            del self.visible_note_rects[key]
+            frame.note_rects[key].remove()
+            del frame.note_rects[key]
+
+        unused_tails = set(frame.tail_rects.keys()) - self.__draw_tails(frame, row_ys)
+        for key in unused_tails:
+            frame.tail_rects[key].remove()
+            del frame.tail_rects[key]
+        METRICS.increment('rects_removed', len(unused_tails))
 
-        unused_lines = set(self.visible_note_rects_lines.keys()) - used_lines
+        unused_lines = set(frame.line_rects.keys()) - used_lines
         for key in unused_lines:
-            self.visible_note_rects_lines[key].remove()
-            del self.visible_note_rects_lines[key]
+            frame.line_rects[key].remove()
+            del frame.line_rects[key]
+        METRICS.increment('rects_removed', len(unused_cache_keys) + len(unused_lines))
 
-        self.__draw_song_position()
+    def __draw_tails(self, frame, row_ys):
+        '''
+            Draw a tail up from each held note to the row it's released at.
+            Only the held notes overlapping the visible positions are looked up.
+            Returns the keys of the tail rects used.
+        '''
+        used = set()
+        if not row_ys:
+            return used
+
+        first_position = min(row_ys)
+        last_position = max(row_ys)
+        bottom_limit = frame.layer_tails.height - 1
+        sustained = self.player.midi_interface.get_sustained_notes(first_position, last_position + 1)
+        for start, end, note, channel in sustained:
+            if note < self.player.note_range[0] or note > self.player.note_range[1]:
+                continue
+
+            if start >= first_position:
+                bottom = row_ys[start] - 1
+            else:
+                bottom = row_ys[first_position]
+
+            if end <= last_position:
+                top = row_ys[end] + 1
+            else:
+                top = row_ys[last_position]
+
+            top = max(top, 0)
+            bottom = min(bottom, bottom_limit)
+            if bottom < top:
+                continue
+
+            color = self.get_channel_color(channel)
+            height = bottom - top + 1
+            key = (channel, color, note, start, height)
+            used.add(key)
+            try:
+                tail_rect = frame.tail_rects[key]
+            except KeyError:
+                tail_rect = frame.layer_tails.new_rect()
+                METRICS.increment('rects_created')
+                frame.tail_rects[key] = tail_rect
+                tail_rect.resize(1, height)
+                tail_rect.set_fg_color(color)
+                tail_rect.unset_bg_color()
+                for y in range(height):
+                    tail_rect.set_character(0, y, self.CHARS['tail'])
+
+            tail_rect.move(self.__get_displayed_key_position(note), top)
+
+        return used
+
+    def __new_line_rect(self, layer, is_measure, blocked_xs):
+        '''
+            Build a single row-wide rect for a measure or beat line.
+            Columns occupied by notes are masked out and the background's
+            A-lines are carried over since the row rect is opaque.
+        '''
+        if is_measure:
+            base = 1
+        else:
+            base = 3
+
+        row = []
+        for x in range(self.rect_background.width):
+            if x and x % base == 1 % base and x not in blocked_xs:
+                row.append(self.CHARS['measureline'])
+            elif x in self.background_a_line_xs:
+                row.append(self.CHARS['a_line'])
+            else:
+                row.append(' ')
+
+        line_rect = layer.new_rect()
+        METRICS.increment('rects_created')
+        line_rect.resize(self.rect_background.width, 1)
+        line_rect.set_fg_color(wrecked.BRIGHTBLACK)
+        line_rect.unset_bg_color()
+        line_rect.set_string(0, 0, ''.join(row))
+
+        return line_rect
 
     def __draw_active_row_line(self):
         midi_interface = self.player.midi_interface
@@ -1036,6 +1516,7 @@ class PlayerScene(RoryScene):
         for key in keys:
             self.pressed_note_rects[key].remove()
             del self.pressed_note_rects[key]
+        METRICS.increment('rects_removed', len(keys))
 
         active_state = midi_interface.get_state(song_position)
 
@@ -1043,6 +1524,7 @@ class PlayerScene(RoryScene):
             x = self.__get_displayed_key_position(note)
 
             note_rect = self.layer_active_notes.new_rect()
+            METRICS.increment('rects_created')
             note_rect.set_character(0, 0, self.CHARS['keyboard_pressed'])
             #note_rect.set_bg_color(wrecked.BLACK)
             note_rect.unset_bg_color()
@@ -1096,10 +1578,15 @@ class PlayerScene(RoryScene):
         )
 
         self.layer_visible_notes.resize(
-            height=self.rect_background.height,
-            width=self.rect_background.width
+            self.rect_background.width,
+            self.rect_background.height
+        )
+        self.layer_cached_frames.resize(
+            self.rect_background.width,
+            self.rect_background.height
         )
-        self.layer_visible_notes.set_transparency(True)
+        self.layer_cached_frames.set_transparency(True)
+        self.background_a_line_xs = set()
 
 
         y = max(0, self.root.height - self.active_row_position)
@@ -1116,6 +1603,7 @@ class PlayerScene(RoryScene):
                 self.rect_background.set_character(x, y + 1, self.CHARS['keyboard_natural'])
 
             if (i + 3) % 12 == 0:
+                self.background_a_line_xs.add(x)
                 for j in range(0, y - 1):
                     self.rect_background.set_character(x, j, self.CHARS['a_line'])
 
@@ -1132,10 +1620,12 @@ class PlayerScene(RoryScene):
         descriptions = [
             (PlayerScene.CONTROL_QUIT, "Close Rory"),
             (PlayerScene.CONTROL_TOGGLE_HELP, "Toggle this pop up"),
+            (PlayerScene.CONTROL_TOGGLE_HUD, "Toggle the performance overlay"),
             ("0-9", "Set register"),
             ("ESC", "Clear register"),
             (PlayerScene.CONTROL_NEXT_STATE, "Next state"),
             (PlayerScene.CONTROL_PREV_STATE, "Previous state"),
+            (PlayerScene.CONTROL_FOLLOW, "Scroll through the song at its tempo"),
             (PlayerScene.CONTROL_IGNORE_CHANNEL, "Ignore the channel in register"),
             (PlayerScene.CONTROL_UNIGNORE_CHANNELS, "Unignore all channels"),
             (PlayerScene.CONTROL_SET_POSITION, "Jump to state in register"),
@@ -0,0 +1,381 @@
+'''Cached index of the directories and MIDI files the browser can show'''
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asyncinotify import Inotify, Mask
+
+class DirectoryListing:
+    '''The subdirectories and MIDI files of a single directory'''
+    def __init__(self, mtime, directories, files):
+        self.mtime = mtime
+        self.directories = directories
+        self.files = files
+        self._sorted = None
+
+    def add(self, name, is_directory):
+        if is_directory:
+            self.directories.add(name)
+        elif LibraryIndex.is_midi(name):
+            self.files.add(name)
+        else:
+            return
+        self._sorted = None
+
+    def remove(self, name):
+        self.directories.discard(name)
+        self.files.discard(name)
+        self._sorted = None
+
+    def get_sorted(self):
+        ''' Get (sorted directories, sorted files), sorting only after changes '''
+        if self._sorted is None:
+            self._sorted = (sorted(self.directories), sorted(self.files))
+        return self._sorted
+
+
+class LibraryIndex:
+    '''
+        Keeps directory listings in memory so moving between directories
+        doesn't have to hit the disk.
+        Listings are revalidated against the directory's mtime and, where possible,
+        kept current with inotify.
+    '''
+    MIDI_EXTENSIONS = ('.mid',)
+    WATCH_MASK = Mask.CREATE | Mask.DELETE | Mask.MOVED_FROM | Mask.MOVED_TO
+
+    def __init__(self, watch=True):
+        self.listings = {}
+        self.lock = threading.Lock()
+
+        self.inotify = None
+        self.watched = set()
+        self.is_watching = False
+        if watch:
+            try:
+                self.inotify = Inotify()
+            except OSError:
+                self.inotify = None
+
+        if self.inotify is not None:
+            self.inotify.sync_timeout = .5
+            self.is_watching = True
+            self.watcher = threading.Thread(target=self.watch_for_changes, daemon=True)
+            self.watcher.start()
+
+    @classmethod
+    def is_midi(cls, filename):
+        ''' Check if a filename looks like a midi file '''
+        return filename.lower().endswith(cls.MIDI_EXTENSIONS)
+
+    def get_listing(self, path):
+        ''' Get (sorted directories, sorted midi files) found in path '''
+        path = os.path.realpath(path)
+        mtime = os.stat(path).st_mtime_ns
+
+        with self.lock:
+            listing = self.listings.get(path)
+            if listing is None or listing.mtime != mtime:
+                listing = self.scan(path, mtime)
+                self.listings[path] = listing
+                self.__watch(path)
+
+            output = listing.get_sorted()
+
+        return output
+
+    @staticmethod
+    def scan(path, mtime):
+        ''' Read a directory in a single pass, using the entry types scandir already knows '''
+        directories = set()
+        files = set()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        directories.add(entry.name)
+                    elif entry.is_file() and LibraryIndex.is_midi(entry.name):
+                        files.add(entry.name)
+                except OSError:
+                    continue
+
+        return DirectoryListing(mtime, directories, files)
+
+    def invalidate(self, path):
+        ''' Forget the cached listing of a directory '''
+        with self.lock:
+            try:
+                del self.listings[os.path.realpath(path)]
+            except KeyError:
+                pass
+
+    def __watch(self, path):
+        if self.inotify is None or path in self.watched:
+            return
+
+        try:
+            self.inotify.add_watch(path, self.WATCH_MASK)
+            self.watched.add(path)
+        except OSError:
+            # Out of watches or unsupported filesystem. mtime checks still apply.
+            pass
+
+    def watch_for_changes(self):
+        ''' Apply inotify events to the cached listings as they come in '''
+        while self.is_watching:
+            try:
+                event = self.inotify.sync_get()
+            except (OSError, ValueError):
+                break
+
+            if event is None or event.name is None:
+                continue
+
+            directory = str(event.watch.path)
+            name = str(event.name)
+            with self.lock:
+                listing = self.listings.get(directory)
+                if listing is None:
+                    continue
+
+                if event.mask & (Mask.CREATE | Mask.MOVED_TO):
+                    listing.add(name, os.path.isdir(directory + '/' + name))
+                elif event.mask & (Mask.DELETE | Mask.MOVED_FROM):
+                    listing.remove(name)
+
+                try:
+                    listing.mtime = os.stat(directory).st_mtime_ns
+                except OSError:
+                    del self.listings[directory]
+
+    def close(self):
+        ''' Stop watching for changes '''
+        self.is_watching = False
+        if self.inotify is not None:
+            self.watcher.join()
+            self.inotify.close()
+            self.inotify = None
+
+
+class SongSummary:
+    '''What can be learned about a song from a single, cheap pass over its file'''
+    def __init__(self, **kwargs):
+        self.ppqn = kwargs.get('ppqn', 0)
+        self.track_count = kwargs.get('track_count', 0)
+        self.note_count = kwargs.get('note_count', 0)
+        self.channels = kwargs.get('channels', set())
+        self.duration = kwargs.get('duration', 0) # seconds
+        self.bpm = kwargs.get('bpm', 120)
+        self.time_signature = kwargs.get('time_signature', (4, 4))
+
+    def __str__(self):
+        minutes, seconds = divmod(int(self.duration), 60)
+        return "%d:%02d %5dn %3dbpm %d/%d" % (
+            minutes,
+            seconds,
+            self.note_count,
+            round(self.bpm),
+            *self.time_signature
+        )
+
+
+def read_varlen(data, index):
+    ''' Read a variable length quantity. Returns (value, next index) '''
+    value = 0
+    while True:
+        byte = data[index]
+        index += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return value, index
+
+
+def read_song_summary(path):
+    '''
+        Get a SongSummary by walking the MIDI file's chunks once,
+        without building any event objects.
+        Raises ValueError if the file isn't a usable MIDI.
+    '''
+    with open(path, 'rb') as fp:
+        data = fp.read()
+
+    if data[0:4] != b'MThd':
+        raise ValueError("Missing MThd chunk")
+
+    header_length, _midi_format, track_count, division = struct.unpack('>IHHH', data[4:14])
+    if division & 0x8000:
+        # SMPTE timing: Ticks are a fixed length
+        ticks_per_second = (256 - (division >> 8)) * (division & 0xFF)
+        ppqn = 0
+    else:
+        ticks_per_second = 0
+        ppqn = division
+
+    note_count = 0
+    channels = set()
+    tempos = [] # (tick, microseconds per quarter note)
+    time_signature = None
+    last_tick = 0
+
+    index = 8 + header_length
+    try:
+        while index + 8 <= len(data):
+            chunk_type = data[index:index + 4]
+            chunk_length = struct.unpack('>I', data[index + 4:index + 8])[0]
+            index += 8
+            chunk_end = min(len(data), index + chunk_length)
+            if chunk_type != b'MTrk':
+                index = chunk_end
+                continue
+
+            tick = 0
+            running_status = 0
+            while index < chunk_end:
+                delta, index = read_varlen(data, index)
+                tick += delta
+
+                status = data[index]
+                if status & 0x80:
+                    index += 1
+                    if status < 0xF0:
+                        running_status = status
+                else:
+                    status = running_status
+
+                if status == 0xFF:
+                    meta_type = data[index]
+                    length, index = read_varlen(data, index + 1)
+                    if meta_type == 0x51 and length == 3:
+                        tempos.append((tick, int.from_bytes(data[index:index + 3], 'big')))
+                    elif meta_type == 0x58 and length >= 2 and time_signature is None:
+                        time_signature = (data[index], 2 ** data[index + 1])
+                    index += length
+                elif status in (0xF0, 0xF7):
+                    length, index = read_varlen(data, index)
+                    index += length
+                elif status & 0xF0 in (0xC0, 0xD0):
+                    index += 1
+                else:
+                    if status & 0xF0 == 0x90 and data[index + 1] > 0 and status & 0x0F != 9:
+                        note_count += 1
+                        channels.add(status & 0x0F)
+                    index += 2
+
+            last_tick = max(last_tick, tick)
+            index = chunk_end
+    except IndexError as exception:
+        raise ValueError("Truncated MIDI") from exception
+
+    tempos.sort()
+    if ticks_per_second:
+        duration = last_tick / ticks_per_second
+    else:
+        # Sum the length of each tempo segment
+        duration = 0
+        current_tick = 0
+        current_tempo = 500000
+        for tick, tempo in tempos:
+            duration += (tick - current_tick) * current_tempo / (ppqn * 1000000)
+            current_tick = tick
+            current_tempo = tempo
+        duration += (last_tick - current_tick) * current_tempo / (ppqn * 1000000)
+
+    if tempos and tempos[0][1]:
+        bpm = 60000000 / tempos[0][1]
+    else:
+        bpm = 120
+
+    return SongSummary(
+        ppqn=ppqn,
+        track_count=track_count,
+        note_count=note_count,
+        channels=channels,
+        duration=duration,
+        bpm=bpm,
+        time_signature=time_signature or (4, 4)
+    )
+
+
+class SongSummaryScanner:
+    '''
+        Reads SongSummaries on worker threads so the browser never waits on the disk.
+        Results are cached by (path, mtime, size).
+    '''
+    def __init__(self, workers=2):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.summaries = {} # path: (mtime, size, summary or None)
+        self.pending = set()
+        self.wanted = set()
+        self.flag_updated = False
+
+    def request(self, paths):
+        '''
+            Get the known summaries of the given paths, queueing scans for the rest.
+            Cached summaries are returned right away but are also revalidated in the background.
+            Paths from earlier requests that haven't been scanned yet are dropped.
+        '''
+        output = {}
+        with self.lock:
+            self.wanted = set(paths)
+            for path in paths:
+                try:
+                    output[path] = self.summaries[path][2]
+                except KeyError:
+                    pass
+
+                if path not in self.pending:
+                    self.pending.add(path)
+                    self.pool.submit(self._scan, path)
+
+        return output
+
+    def get(self, path):
+        ''' Get the summary of a path if it has already been scanned '''
+        with self.lock:
+            try:
+                output = self.summaries[path][2]
+            except KeyError:
+                output = None
+        return output
+
+    def has_updates(self):
+        ''' Check (and reset) whether any new summaries came in since the last check '''
+        with self.lock:
+            output = self.flag_updated
+            self.flag_updated = False
+        return output
+
+    def _scan(self, path):
+        try:
+            with self.lock:
+                if path not in self.wanted:
+                    return
+                cached = self.summaries.get(path)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return
+
+            if cached is not None and cached[0:2] == (stat.st_mtime_ns, stat.st_size):
+                return
+
+            try:
+                summary = read_song_summary(path)
+            except (OSError, ValueError):
+                summary = None
+
+            with self.lock:
+                self.summaries[path] = (stat.st_mtime_ns, stat.st_size, summary)
+                self.flag_updated = True
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+    def close(self):
+        ''' Stop the workers, dropping any queued scans '''
+        with self.lock:
+            self.wanted = set()
+        self.pool.shutdown(wait=False)
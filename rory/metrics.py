@@ -0,0 +1,154 @@
+'''Counters and timers for rory's hot paths, kept in memory and flushed to a file'''
+import functools
+import json
+import os
+import threading
+import time
+
+class Metrics:
+    '''
+        Counters and timers aggregated in memory.
+        Updates take no lock to keep them cheap on the hot paths, so an increment
+        racing another thread's increment of the same name can rarely be lost.
+    '''
+    def __init__(self):
+        self.counters = {}
+        self.timers = {} # name: [count, total seconds, max seconds]
+        self.started = time.time()
+
+    def increment(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name, seconds):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    def get_count(self, name):
+        return self.counters.get(name, 0)
+
+    def get_timer(self, name):
+        ''' Get (count, total seconds, max seconds) '''
+        return tuple(self.timers.get(name, (0, 0, 0)))
+
+    def reset(self):
+        self.counters = {}
+        self.timers = {}
+        self.started = time.time()
+
+    def snapshot(self):
+        ''' Get a copy of every measurement as a json-friendly dict '''
+        now = time.time()
+        return {
+            "time": now,
+            "uptime": now - self.started,
+            "counters": dict(self.counters),
+            "timers": {
+                name: {"count": count, "total": total, "max": maximum}
+                for name, (count, total, maximum) in list(self.timers.items())
+            }
+        }
+
+    def to_prometheus(self):
+        ''' Format every measurement in the Prometheus text exposition format '''
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE rory_{name}_total counter")
+            lines.append(f"rory_{name}_total {value}")
+
+        for name, (count, total, maximum) in sorted(self.timers.items()):
+            lines.append(f"# TYPE rory_{name}_seconds summary")
+            lines.append(f"rory_{name}_seconds_count {count}")
+            lines.append(f"rory_{name}_seconds_sum {total}")
+            lines.append(f"# TYPE rory_{name}_seconds_max gauge")
+            lines.append(f"rory_{name}_seconds_max {maximum}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every module, so measurements are always being taken
+METRICS = Metrics()
+
+def get_rss():
+    ''' Get the resident memory of this process in bytes, or 0 if it can't be read '''
+    try:
+        with open('/proc/self/statm', 'r') as fp:
+            pages = int(fp.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+def percentile(values, percent):
+    ''' Get the value at the given percent (0-100) of values, interpolating between ranks '''
+    if not values:
+        return 0
+
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + ((ordered[upper] - ordered[lower]) * (rank - lower))
+
+def timed(name):
+    ''' Decorate a function so each call is added to the METRICS timer called name '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                METRICS.add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class MetricsWriter:
+    '''
+        Flushes Metrics to a file from a background thread.
+        Paths ending in .prom are rewritten with Prometheus text each flush
+        (eg for node_exporter's textfile collector). Anything else gets a json line appended.
+    '''
+    def __init__(self, metrics, path, interval=10):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.is_running = False
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        ''' Stop flushing, writing one last time '''
+        self.is_running = False
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def flush_loop(self):
+        while self.is_running:
+            self.wake.wait(self.interval)
+            if self.is_running:
+                self.flush()
+
+    def flush(self):
+        if self.path.endswith('.prom'):
+            # Replaced in one step, so a collector never reads half a file
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w') as fp:
+                fp.write(self.metrics.to_prometheus())
+            os.replace(temporary_path, self.path)
+        else:
+            with open(self.path, 'a') as fp:
+                fp.write(json.dumps(self.metrics.snapshot()) + "\n")
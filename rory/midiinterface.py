@@ -1,6 +1,7 @@
 '''Plays MIDILike Objects'''
+from bisect import bisect_left, bisect_right
 from apres import NoteOn, NoteOff, TimeSignature, SetTempo
-from .structures import Grouping
+from .structures import Grouping, IntervalIndex
 
 class MIDIInterface:
     '''Layer between Player and the MIDI input file'''
@@ -8,8 +9,20 @@ class MIDIInterface:
 
     def __handle_kwargs(self, kwargs):
         self.transpose = kwargs.get('transpose', 0)
-
-    def __calculate_beat_chunks(self):
+        # Note value of the grid note-ons are snapped to, eg 16 for 1/16ths, 12 for 1/8th triplets. 0 to leave them be.
+        self.quantize = kwargs.get('quantize', 0)
+        # Note-ons within this many ticks of the first note of a chord are moved onto it
+        self.quantize_tolerance = kwargs.get('quantize_tolerance', 0)
+
+    def __quantize(self, tick_diff, beat_size):
+        ''' Snap a tick (relative to the last time signature) to the nearest point on the quantize grid '''
+        beat, offset = divmod(tick_diff, beat_size)
+        step = (self.midi.ppqn * 4) / self.quantize
+        # Rounding up to the end of the beat carries into the next one
+        offset = min(int(round(round(offset / step) * step)), beat_size)
+        return (beat * beat_size) + offset
+
+    def calculate_beat_chunks(self):
         ''' Group the midi events into beats '''
         beats = []
 
@@ -20,8 +33,18 @@ class MIDIInterface:
         active_notes = {}
         min_note = 128
         max_note = 0
+        chord_start = None # (tick, quantized tick_diff) of the first note-on in the latest chord
         for tick, event in self.midi.get_all_events():
+            self.midi_length = max(self.midi_length, tick)
             tick_diff = tick - running_beat_count[1]
+            if self.is_note_on(event) and (self.quantize or self.quantize_tolerance):
+                if chord_start is not None and tick - chord_start[0] <= self.quantize_tolerance:
+                    tick_diff = chord_start[1]
+                else:
+                    if self.quantize:
+                        tick_diff = self.__quantize(tick_diff, beat_size)
+                    chord_start = (tick, tick_diff)
+
             current_beat = int(running_beat_count[0] + (tick_diff // beat_size))
             while len(beats) <= current_beat:
                 beats.append([[], beat_size, None, current_numerator, None])
@@ -55,6 +78,7 @@ class MIDIInterface:
                     pass
 
             elif isinstance(event, TimeSignature):
+                chord_start = None
                 running_beat_count = (current_beat, tick)
                 current_numerator = event.numerator
                 beat_size = int(self.midi.ppqn // ((2 ** event.denominator) / 4))
@@ -93,6 +117,21 @@ class MIDIInterface:
 
 
     def __init__(self, midi, **kwargs):
+        # Compiling is split into stages so they can be timed one by one (see benchmarks/compile.py)
+        self.prepare(midi, **kwargs)
+        beats = self.calculate_beat_chunks()
+        grouping = self.beats_to_grouping(beats)
+        self.build_maps(grouping)
+
+    @classmethod
+    def uncompiled(cls, midi, **kwargs):
+        ''' Get an interface with empty maps, for running the stages of compiling one at a time '''
+        output = cls.__new__(cls)
+        output.prepare(midi, **kwargs)
+        return output
+
+    def prepare(self, midi, **kwargs):
+        ''' Set up the empty maps that the other stages fill '''
         self.midi = midi
 
         # For quick access to which keys are pressed
@@ -107,16 +146,30 @@ class MIDIInterface:
         self.timing_map = {
             0: 0
         }
+        # Sorted keys of timing_map, so the nearest timed positions can be bisected for
+        self.timed_positions = []
         self.transpose = 0
         self.tempo_map = []
+        # Tick of the last event. MIDI objects don't have a len()
+        self.midi_length = 0
+        # Notes held past the position they start at, sorted by start position.
+        # [start, end) positions, see get_sustained_notes()
+        self.sustain_starts = []
+        self.sustain_ends = []
+        self.sustain_notes = []
+        self.sustain_channels = []
+        self.sustain_index = None
+        # Seconds from the start of the song to each position, plus one more entry for the end
+        self.seconds_map = []
 
         self.__handle_kwargs(kwargs)
 
-        beats = self.__calculate_beat_chunks()
-        grouping = self.__beats_to_grouping(beats)
+    def build_maps(self, grouping):
+        ''' Flatten the grouping from beats_to_grouping() into the states and the maps that index them '''
         self.tempo_map.sort()
         self.tempo_map = self.tempo_map[::-1]
 
+        held = [] # (start position, end tick, note, channel)
         beat_count = 0
         for measure in list(grouping):
             self.measure_map.append(len(self.state_map))
@@ -137,41 +190,112 @@ class MIDIInterface:
                     self.state_map.append(set())
                     self.active_notes_map.append({})
 
-                    for event, realtick in list(group.events):
+                    for event, realtick, duration in list(group.events):
                         new_note = event.note + self.transpose
                         event.set_note(new_note)
                         self.state_map[i].add(event.note)
                         self.active_notes_map[i][event.note] = event
                         self.timing_map[i] = realtick
+                        if duration > 0:
+                            held.append((i, realtick + duration, event.note, event.channel))
                     i += 1
 
                 beat_count += 1
 
+        self.timed_positions = sorted(self.timing_map)
+        self.__build_sustain_index(held)
+        self.__build_seconds_map()
+
+    def __build_sustain_index(self, held):
+        ''' Convert the end ticks of held notes to positions and index them '''
+        positions = self.timed_positions
+        ticks = [self.timing_map[position] for position in positions]
+        # Quantizing can leave a position's tick behind the one before it
+        for i in range(1, len(ticks)):
+            ticks[i] = max(ticks[i], ticks[i - 1])
+
+        held.sort()
+        for start, end_tick, note, channel in held:
+            # The note is released at the first position at or after its note-off
+            index = bisect_left(ticks, end_tick)
+            if index < len(positions):
+                end = max(positions[index], start + 1)
+            else:
+                end = len(self.state_map)
+
+            # Released by the next position; there's nothing to draw
+            if end - start <= 1:
+                continue
+
+            self.sustain_starts.append(start)
+            self.sustain_ends.append(end)
+            self.sustain_notes.append(note)
+            self.sustain_channels.append(channel)
+
+        self.sustain_index = IntervalIndex(self.sustain_starts, self.sustain_ends)
+
+    def __build_seconds_map(self):
+        ''' Convert the tick of every position to seconds, following the tempo changes between them '''
+        tempos = sorted(self.tempo_map)
+        tempo_index = 0
+        bpm = 120
+        seconds = 0
+        last_tick = 0
+
+        ticks = []
+        for position in range(len(self.state_map)):
+            if position in self.timing_map:
+                tick = self.timing_map[position]
+            else:
+                tick = self.get_real_tick(position)
+            ticks.append(tick)
+        ticks.append(self.midi_length)
+
+        for tick in ticks:
+            # Quantizing can leave a position's tick behind the one before it
+            tick = max(tick, last_tick)
+            while tempo_index < len(tempos) and tempos[tempo_index][0] <= tick:
+                change_tick, new_bpm = tempos[tempo_index]
+                seconds += (change_tick - last_tick) * 60 / (bpm * self.midi.ppqn)
+                last_tick = change_tick
+                bpm = new_bpm
+                tempo_index += 1
+
+            seconds += (tick - last_tick) * 60 / (bpm * self.midi.ppqn)
+            last_tick = tick
+            self.seconds_map.append(seconds)
+
+    def get_seconds(self, position):
+        ''' Get the time, in seconds from the start of the song, of a position '''
+        return self.seconds_map[position]
+
     def get_tempo_at_tick(self, tick):
         for i, tempo in self.tempo_map:
             if tick >= i:
                 return tempo
         return 120
 
+    def get_timed_bounds(self, first_position, last_position):
+        '''
+            Find the closest positions with a recorded tick, at or before first_position
+            and at or after last_position. A position past the last recorded one is kept as it is.
+            Returns (first_post, last_post, number of positions walked over)
+        '''
+        positions = self.timed_positions
+        index = bisect_right(positions, first_position) - 1
+        first_post = positions[index] if index >= 0 else first_position
+
+        index = bisect_left(positions, last_position)
+        last_post = positions[index] if index < len(positions) else last_position
+
+        return (first_post, last_post, (first_position - first_post) + (last_post - last_position))
+
     def get_real_tick(self, song_position):
         ''' Get the tick from before the midi is processed for playing '''
-        first_post = song_position
-        last_post = song_position
-        keys = self.timing_map.keys()
-        max_tick = max(keys)
-        min_tick = min(keys)
-
-        divs = 0
-        while first_post not in keys and first_post > min_tick:
-            first_post -= 1
-            divs += 1
-
-        while last_post not in keys and last_post <= max_tick:
-            last_post += 1
-            divs += 1
-
-        if last_post > max_tick:
-            diff = len(self.midi) - self.timing_map[first_post]
+        first_post, last_post, divs = self.get_timed_bounds(song_position, song_position)
+
+        if last_post not in self.timing_map:
+            diff = self.midi_length - self.timing_map[first_post]
         else:
             diff = self.timing_map[last_post] - self.timing_map[first_post]
 
@@ -182,23 +306,10 @@ class MIDIInterface:
 
     def get_tick_wait(self, song_position, new_position):
         ''' Calculate how long, in midi ticks, between to song positions '''
-        first_post = song_position
-        last_post = new_position
-        keys = self.timing_map.keys()
-        max_tick = max(keys)
-        min_tick = min(keys)
-
-        divs = 0
-        while first_post not in keys and first_post > min_tick:
-            first_post -= 1
-            divs += 1
-
-        while last_post not in keys and last_post <= max_tick:
-            last_post += 1
-            divs += 1
-
-        if last_post > max_tick:
-            diff = len(self.midi) - self.timing_map[first_post]
+        first_post, last_post, divs = self.get_timed_bounds(song_position, new_position)
+
+        if last_post not in self.timing_map:
+            diff = self.midi_length - self.timing_map[first_post]
         else:
             diff = self.timing_map[last_post] - self.timing_map[first_post]
 
@@ -220,6 +331,25 @@ class MIDIInterface:
 
         return state
 
+    def get_sustained_notes(self, first, last):
+        ''' Get (start, end, note, channel) of every held note sounding in the positions [first, last) '''
+        return [
+            (
+                self.sustain_starts[i],
+                self.sustain_ends[i],
+                self.sustain_notes[i],
+                self.sustain_channels[i]
+            )
+            for i in self.sustain_index.overlapping(first, last)
+        ]
+
+    def get_sounding_notes(self, position):
+        ''' Get the notes sounding at a position, whether they start there or are still held '''
+        output = set(self.state_map[position])
+        for i in self.sustain_index.at(position):
+            output.add(self.sustain_notes[i])
+        return output
+
     def get_active_channels(self, position):
         ''' Get set of channels present at a given position '''
         active = set()
@@ -406,7 +536,7 @@ class MIDIInterface:
         )
 
     @staticmethod
-    def __beats_to_grouping(beats):
+    def beats_to_grouping(beats):
         ''' Convert the beats into 'Grouping' structure for ease of manipulation. '''
         grouping = Grouping()
         measures = []
@@ -423,8 +553,8 @@ class MIDIInterface:
             for (pos, event, _real, _duration) in events:
                 beat.set_size(beat_size)
 
-            for (pos, event, real, _duration) in events:
+            for (pos, event, real, duration) in events:
                 tick = beat[int(pos)]
-                tick.add_event((event, real))
+                tick.add_event((event, real, duration))
 
         return grouping
@@ -2,19 +2,33 @@
 import threading
 import time
 import os
+from collections import deque
 
-from apres import MIDI, MIDIController, MIDIEvent, NoteOn, NoteOff
+from apres import MIDI, MIDIEvent, NoteOn, NoteOff
 from .midiinterface import MIDIInterface
+from .songfile import EXTENSION
 from .controller_manager import ControllerManager
+from .input_backends import PipeBackend
+from .follow import FollowScheduler
+from .scoring import TimingCapture, TimingScorer
+from .session_log import SessionLog, KIND_POSITION, KIND_LOOP, KIND_TRANSPOSE
+from .metrics import timed, METRICS
 
 class Player:
     '''Plays MIDILike Objects'''
+    # Milliseconds that the notes of a chord are gathered over before checking them, see ControllerManager
+    CHORD_WINDOW = 5
 
     def kill(self):
         ''''Shutdown the player'''
         self.is_active = False
+        self.follower.stop()
         self.controller_manager.close()
+        self.scorer.stop()
+        if self.session_log is not None:
+            self.session_log.close()
 
+    @timed('next_state')
     def next_state(self):
         '''Change the song position to the next state with notes.'''
         new_position = self.song_position + 1
@@ -31,6 +45,7 @@ class Player:
             self.song_position = new_position
         self.update_tempo()
 
+    @timed('prev_state')
     def prev_state(self):
         '''Change the song position to the last state with notes.'''
         self.song_position -= 1
@@ -40,6 +55,7 @@ class Player:
 
         self.set_state(max(0, self.song_position))
 
+    @timed('set_state')
     def set_state(self, song_position):
         '''
             Set the song position as the value in the register,
@@ -58,6 +74,8 @@ class Player:
         self.update_tempo()
 
     def update_tempo(self):
+        # Every change of position finishes here
+        self.log_session_event(KIND_POSITION, self.song_position)
         tick = self.midi_interface.get_real_tick(self.song_position)
         self.current_tempo = self.midi_interface.get_tempo_at_tick(tick)
 
@@ -65,19 +83,71 @@ class Player:
         position = self.midi_interface.get_first_position_in_measure(measure)
         self.set_state(position)
 
+    def can_recompile(self):
+        ''' Compiled song files don't keep the midi, so they can't be recompiled, eg to transpose '''
+        return not self.active_path.endswith(EXTENSION)
+
     def reinit_midi_interface(self, **kwargs):
-        self.active_midi = MIDI.load(self.active_path)
-        self.midi_interface = MIDIInterface(self.active_midi, **kwargs)
+        '''
+            Recompile the song with different options, eg transpose.
+            With a SongCompiler it's compiled in the background and switched to once it's ready.
+        '''
+        if not self.can_recompile():
+            return
+
+        # Recompiling to change one option shouldn't lose the others
+        options = {
+            'quantize': self.midi_interface.quantize,
+            'quantize_tolerance': self.midi_interface.quantize_tolerance
+        }
+        options.update(kwargs)
+
+        if self.compiler is None:
+            self.set_midi_interface(MIDIInterface(MIDI.load(self.active_path), **options))
+            return
+
+        future = self.compiler.submit(self.active_path, **options)
+        self.pending_compile = future
+        future.add_done_callback(self._compile_done_callback)
+
+    def _compile_done_callback(self, future):
+        # Only the latest recompile is switched to
+        if future is not self.pending_compile or not self.is_active:
+            return
+        self.pending_compile = None
+
+        try:
+            midi_interface = future.result()
+        except Exception:
+            # Keep playing the song as it was
+            return
+        self.set_midi_interface(midi_interface)
+
+    def set_midi_interface(self, midi_interface):
+        ''' Switch to another compiled song, starting from its beginning '''
+        self.midi_interface = midi_interface
+        self.active_midi = midi_interface.midi
+        self.log_song()
         self.clear_loop()
         self.song_position = -1
         self.next_state()
+        self.scorer.reset()
 
     def get_transpose(self):
         return self.midi_interface.transpose
 
     def __init__(self, **kwargs):
+        # Opened once the controller manager is up, so there's a TimingCapture to log notes from
+        self.session_log = None
         self.active_path = kwargs.get('path', '')
-        self.active_midi = MIDI.load(self.active_path)
+        # A SongCompiler to recompile in, rather than on the calling thread
+        self.compiler = kwargs.get('compiler', None)
+        self.pending_compile = None
+        # A MIDIInterface may already have been compiled ahead of time (see SongPrefetcher)
+        self.midi_interface = kwargs.get('midi_interface', None)
+        if self.midi_interface is None:
+            self.midi_interface = MIDIInterface(MIDI.load(self.active_path), **kwargs)
+        self.active_midi = self.midi_interface.midi
         self.current_tempo = 120
 
         self.is_active = True
@@ -88,21 +158,41 @@ class Player:
 
         self.ignored_channels = set()
 
-        self.midi_interface = MIDIInterface(self.active_midi, **kwargs)
-
         self.clear_loop()
 
         self.need_to_release = set()
+        # Seconds between the note that completed a state and the song advancing
+        self.advance_latencies = deque(maxlen=64)
 
         self.song_position = -1
 
         self.next_state()
 
+        # Scrolls through the song in real time when following
+        self.follower = FollowScheduler(self)
 
         self.flag_range_input = False
         self._new_range = None
 
-        self.controller_manager = ControllerManager()
+        # Notes come from ALSA devices unless another input backend is given
+        input_backend = kwargs.get('input_backend', None)
+        if input_backend is None and kwargs.get('input_path', None):
+            input_backend = PipeBackend(kwargs['input_path'])
+        # Every note played is timestamped as it comes in, then scored on another thread
+        self.timing_capture = TimingCapture(lambda: self.song_position)
+        self.scorer = TimingScorer(self, self.timing_capture)
+        self.controller_manager = ControllerManager(
+            backend=input_backend,
+            capture=self.timing_capture,
+            chord_window=kwargs.get('chord_window', self.CHORD_WINDOW) / 1000
+        )
+        self.controller_manager.target_check = self.is_state_satisfied
+
+        if kwargs.get('session_log_path', None):
+            self.session_log = SessionLog(kwargs['session_log_path'], self.timing_capture)
+            self.log_song()
+            self.log_session_event(KIND_LOOP, *self.loop)
+            self.log_session_event(KIND_POSITION, self.song_position)
         self.controller_manager.add_callback("release_note", self._release_note_callback)
         self.controller_manager.add_callback("new_controller", self._callback_clear_releases)
         self.controller_manager.add_callback("do_state_check", self.do_state_check)
@@ -149,15 +239,46 @@ class Player:
     def flag_new_range(self):
         self.flag_range_input = True
 
+    def is_following(self):
+        return self.follower.is_running()
+
+    def get_scores(self, measures=None):
+        ''' Get the timing and accuracy of each measure played so far (see TimingScorer.get_scores) '''
+        return self.scorer.get_scores(measures)
+
+    def toggle_follow(self):
+        ''' Start or stop scrolling through the song at its own tempo '''
+        if self.is_following():
+            self.follower.stop()
+        else:
+            self.follower.start()
+
+    def is_state_satisfied(self, pressed):
+        '''
+            Check if the pressed notes would advance the song, without changing anything.
+            Called on the input thread for every note, so it only does the set comparisons.
+        '''
+        if self.follower.is_running():
+            return False
+        song_state = self.midi_interface.get_state(self.song_position, self.ignored_channels)
+        return song_state.issubset(pressed) and self.need_to_release.isdisjoint(song_state)
+
     def do_state_check(self):
         ''' Check if the midi device is pressing the coresponding notes '''
+        # The song moves on by itself when following
+        if self.is_following():
+            return
+
         song_state = self.midi_interface.get_state(self.song_position, self.ignored_channels)
         pressed = self.get_pressed_notes()
-        if song_state.intersection(pressed) == song_state \
-        and not self.need_to_release.intersection(song_state):
-            self.need_to_release = self.need_to_release.union(pressed)
+        if song_state.issubset(pressed) and self.need_to_release.isdisjoint(song_state):
+            self.need_to_release |= pressed
             self.next_state()
 
+            latency = time.perf_counter() - self.controller_manager.last_input_time
+            self.advance_latencies.append(latency)
+            METRICS.add_time('input_to_advance', latency)
+
     def toggle_ignore_channel(self, channel):
         '''
             Add or remove a channel to be ignored when considering
@@ -191,14 +312,28 @@ class Player:
     def set_loop_start(self, position):
         '''set current positions as loop start'''
         self.loop[0] = min(max(0, position), len(self.midi_interface.state_map) - 1)
+        self.log_session_event(KIND_LOOP, *self.loop)
 
     def set_loop_end(self, position):
         '''set current positions as loop end'''
         self.loop[1] = min(max(0, position), len(self.midi_interface.state_map) - 1)
+        self.log_session_event(KIND_LOOP, *self.loop)
 
     def clear_loop(self):
         '''Stop Looping'''
         self.loop = [0, len(self.midi_interface.state_map) - 1]
+        self.log_session_event(KIND_LOOP, *self.loop)
+
+    def log_session_event(self, kind, a=0, b=0):
+        ''' Record a change in the session log, if one is being kept '''
+        if self.session_log is not None:
+            self.session_log.log(kind, a, b)
+
+    def log_song(self):
+        ''' Record which song is being played, and its transpose, in the session log '''
+        if self.session_log is not None:
+            self.session_log.log_song(self.active_path)
+            self.session_log.log(KIND_TRANSPOSE, self.midi_interface.transpose)
 
     def set_register_digit(self, digit):
         '''Insert digit to register'''
@@ -219,25 +354,3 @@ class Player:
         '''Set the song position to the value of the input register'''
         self.set_state(self.get_register())
 
-
-class RoryController(MIDIController):
-    def __init__(self, channel, device_index, controller_manager):
-        super().__init__(channel, device_index)
-        self.controller_manager = controller_manager
-
-    def hook_NoteOn(self, event):
-        if event.velocity == 0:
-            self.release_note(event.note)
-        else:
-            self.press_note(event.note)
-
-    def hook_NoteOff(self, event):
-        self.release_note(event.note)
-
-    def press_note(self, note):
-        '''Press a Midi Note'''
-        self.controller_manager.press_note(note)
-
-    def release_note(self, note):
-        '''Release a Midi Note'''
-        self.controller_manager.release_note(note)
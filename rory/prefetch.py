@@ -0,0 +1,116 @@
+'''Compile songs ahead of time so the Player can open them instantly'''
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from apres import MIDI
+from .midiinterface import MIDIInterface
+
+class SongPrefetcher:
+    '''
+        Compiles MIDIInterfaces on a bounded pool of workers
+        and keeps the most recently finished ones.
+    '''
+    # MIDIInterface kwargs that change the compiled song
+    COMPILE_OPTIONS = ('transpose', 'quantize', 'quantize_tolerance')
+
+    def __init__(self, max_cached=4, workers=1, compiler=None):
+        # Songs are compiled by a SongCompiler when given one, otherwise on the workers themselves
+        self.compiler = compiler
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.max_cached = max_cached
+        self.lock = threading.Lock()
+        self.cache = OrderedDict() # key: MIDIInterface
+        self.futures = {} # key: Future
+
+    @classmethod
+    def get_compile_options(cls, kwargs):
+        ''' Pick out the kwargs that a song is compiled with '''
+        return {
+            key: kwargs[key]
+            for key in cls.COMPILE_OPTIONS
+            if key in kwargs
+        }
+
+    @classmethod
+    def get_key(cls, path, **kwargs):
+        ''' Identify a compiled song by its file and the options it was compiled with '''
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        options = tuple(kwargs.get(key, 0) for key in cls.COMPILE_OPTIONS)
+        return (path, stat.st_mtime_ns, stat.st_size, options)
+
+    def prefetch(self, path, **kwargs):
+        '''
+            Start compiling a song in the background.
+            Queued compiles of any other song are cancelled. One that has already started
+            is allowed to finish and is cached, in case the cursor comes back to it.
+        '''
+        try:
+            key = self.get_key(path, **kwargs)
+        except OSError:
+            return
+
+        with self.lock:
+            for other_key, future in list(self.futures.items()):
+                if other_key != key and future.cancel():
+                    del self.futures[other_key]
+
+            if key in self.cache or key in self.futures:
+                return
+
+            self.futures[key] = self.pool.submit(self._compile, key, path, kwargs, True)
+
+    def take(self, path, **kwargs):
+        '''
+            Get the compiled song, waiting on a compile that is already underway
+            or compiling it now if it was never prefetched.
+            A compile that was only queued is taken over rather than left behind the others.
+        '''
+        key = self.get_key(path, **kwargs)
+        with self.lock:
+            midi_interface = self.cache.get(key)
+            if midi_interface is not None:
+                self.cache.move_to_end(key)
+                return midi_interface
+            future = self.futures.get(key)
+            if future is not None and future.cancel():
+                del self.futures[key]
+                future = None
+
+        if future is not None:
+            try:
+                return future.result()
+            except CancelledError:
+                pass
+
+        return self._compile(key, path, kwargs)
+
+    def _compile(self, key, path, kwargs, background=False):
+        try:
+            if self.compiler is not None:
+                midi_interface = self.compiler.compile(path, background, **kwargs)
+            else:
+                midi_interface = MIDIInterface(MIDI.load(path), **kwargs)
+        except BaseException:
+            # Forgotten, so the song is tried again the next time it's asked for
+            with self.lock:
+                self.futures.pop(key, None)
+            raise
+
+        with self.lock:
+            self.futures.pop(key, None)
+            self.cache[key] = midi_interface
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+
+        return midi_interface
+
+    def close(self):
+        ''' Drop any queued compiles and stop the workers '''
+        # shutdown(cancel_futures=True) needs python 3.9
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,124 @@
+'''Low overhead sampling profiler covering every thread'''
+import marshal
+import sys
+import threading
+import time
+
+class SamplingProfiler:
+    '''
+        Samples the call stack of every thread at a fixed interval.
+        Timings are wall-clock, so threads waiting on input or sleeping show up too.
+        Results can be written as pstats (for pstats/snakeviz) and as collapsed stacks
+        (for flamegraph.pl/speedscope).
+    '''
+    def __init__(self, interval=.005):
+        self.interval = interval
+        self.samples = {} # (thread_name, (code, ...)): count
+        self.sample_count = 0
+        self.elapsed = 0
+        self.is_sampling = False
+        self.thread = None
+
+    def start(self):
+        self.is_sampling = True
+        self.thread = threading.Thread(target=self.sample_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_sampling = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def sample_loop(self):
+        own_id = threading.get_ident()
+        thread_names = {}
+        start = time.perf_counter()
+        while self.is_sampling:
+            frames = sys._current_frames()
+            if len(thread_names) != len(frames):
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+
+                # Only code objects are kept while sampling. They're turned into names on write.
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                key = (thread_names.get(thread_id, str(thread_id)), tuple(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+            self.sample_count += 1
+            time.sleep(self.interval)
+
+        self.elapsed = time.perf_counter() - start
+
+    @staticmethod
+    def get_function_key(code):
+        ''' Identify a function the same way pstats does '''
+        return (code.co_filename, code.co_firstlineno, code.co_name)
+
+    def get_seconds_per_sample(self):
+        if not self.sample_count:
+            return 0
+        return self.elapsed / self.sample_count
+
+    def write_collapsed(self, path):
+        ''' Write "thread;outer;...;inner count" lines '''
+        lines = {}
+        for (thread_name, stack), count in self.samples.items():
+            names = [thread_name]
+            for code in reversed(stack):
+                names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            line = ';'.join(name.replace(';', ':') for name in names)
+            lines[line] = lines.get(line, 0) + count
+
+        with open(path, 'w') as fp:
+            for line, count in sorted(lines.items()):
+                fp.write(f"{line} {count}\n")
+
+    def write_pstats(self, path):
+        '''
+            Write the samples in the marshalled format pstats.Stats() loads.
+            Call counts are sample counts.
+        '''
+        seconds = self.get_seconds_per_sample()
+        stats = {} # function: [cc, nc, tt, ct, callers]
+        for (_thread_name, stack), count in self.samples.items():
+            functions = [self.get_function_key(code) for code in stack]
+            seen = set()
+            for i, function in enumerate(functions):
+                entry = stats.setdefault(function, [0, 0, 0, 0, {}])
+                if i == 0:
+                    entry[2] += count * seconds
+
+                # Recursive functions are only counted once per sample
+                if function in seen:
+                    continue
+                seen.add(function)
+                entry[0] += count
+                entry[1] += count
+                entry[3] += count * seconds
+
+                if i + 1 < len(functions):
+                    caller = functions[i + 1]
+                    caller_stats = entry[4].get(caller, (0, 0, 0, 0))
+                    entry[4][caller] = (
+                        caller_stats[0] + count,
+                        caller_stats[1] + count,
+                        caller_stats[2] + (count * seconds if i == 0 else 0),
+                        caller_stats[3] + count * seconds
+                    )
+
+        with open(path, 'wb') as fp:
+            marshal.dump({function: tuple(entry) for function, entry in stats.items()}, fp)
+
+    def write(self, path_prefix):
+        ''' Write both <path_prefix>.pstats and <path_prefix>.folded. Returns the paths '''
+        paths = (path_prefix + '.pstats', path_prefix + '.folded')
+        self.write_pstats(paths[0])
+        self.write_collapsed(paths[1])
+        return paths
@@ -0,0 +1,171 @@
+'''Capture when notes are played and score them against the song, away from the input thread'''
+import threading
+from array import array
+
+class TimingCapture:
+    '''
+        Ring buffer of the notes pressed and released, with when they came in and the song
+        position at the time. Everything is allocated up front and recording an event is
+        a handful of array stores, so it can sit in front of the input callbacks.
+        Written by one thread; read with read() by any other.
+    '''
+    def __init__(self, get_position, size=4096):
+        self.get_position = get_position
+        self.size = size
+        self.times = array('d', [0]) * size # perf_counter
+        self.notes = array('B', [0]) * size
+        self.pressed = array('B', [0]) * size
+        self.positions = array('i', [0]) * size
+        # Total events ever recorded. Only advanced once an event is fully written
+        self.count = 0
+
+    def record(self, timestamp, note, pressed):
+        index = self.count % self.size
+        self.times[index] = timestamp
+        self.notes[index] = note
+        self.pressed[index] = pressed
+        self.positions[index] = self.get_position()
+        self.count += 1
+
+    def read(self, since=0):
+        '''
+            Get the events recorded after the first `since`, as (timestamp, note, pressed, position).
+            Events overwritten before they could be read are skipped.
+            Returns (events, count to pass as `since` next time)
+        '''
+        count = self.count
+        first = max(since, count - self.size)
+        events = []
+        for i in range(first, count):
+            index = i % self.size
+            events.append((self.times[index], self.notes[index], bool(self.pressed[index]), self.positions[index]))
+
+        # The writer may have lapped the oldest of these while they were copied
+        overwritten = self.count - self.size - first
+        if overwritten > 0:
+            events = events[overwritten:]
+
+        return (events, count)
+
+
+class TimingScorer:
+    '''
+        Scores captured presses against the song every interval seconds on its own thread.
+        A press is a hit if its note is in the state at, or just after, the position it was
+        played at. Timing is judged within each measure: every hit's offset from the song's
+        time for its position, relative to the median offset of the measure, so how fast
+        the song is played as a whole doesn't count against it.
+    '''
+    def __init__(self, player, capture, interval=.5):
+        self.player = player
+        self.capture = capture
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.since = 0
+        self.measures = {} # measure: {"hits": {(position, note): offset}, "wrong": count}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.update()
+
+    def update(self):
+        ''' Score everything captured since the last update '''
+        player = self.player
+        midi_interface = player.midi_interface
+        with self.lock:
+            events, self.since = self.capture.read(self.since)
+            for timestamp, note, pressed, position in events:
+                if not pressed or position < 0 or position >= len(midi_interface.state_map):
+                    continue
+
+                matched = None
+                next_position = min(position + 1, len(midi_interface.state_map) - 1)
+                for candidate in (position, next_position):
+                    if note in midi_interface.get_state(candidate, player.ignored_channels):
+                        matched = candidate
+                        break
+
+                if matched is None:
+                    measure = self.__get_measure(midi_interface.get_measure(position))
+                    measure["wrong"] += 1
+                    continue
+
+                measure = self.__get_measure(midi_interface.get_measure(matched))
+                # Only the first press of each expected note counts
+                measure["hits"].setdefault(
+                    (matched, note),
+                    timestamp - midi_interface.get_seconds(matched)
+                )
+
+    def __get_measure(self, measure):
+        try:
+            output = self.measures[measure]
+        except KeyError:
+            output = {"hits": {}, "wrong": 0}
+            self.measures[measure] = output
+        return output
+
+    def get_scores(self, measures=None):
+        '''
+            Get {measure: score} for the given measures, or every measure played so far. Each score has
+            expected, hits, wrong and missed note counts, accuracy (0 to 1)
+            and the mean and max timing error in seconds.
+        '''
+        player = self.player
+        midi_interface = player.midi_interface
+        with self.lock:
+            if measures is None:
+                measures = list(self.measures.keys())
+            measures = {
+                measure: (dict(self.measures[measure]["hits"]), self.measures[measure]["wrong"])
+                for measure in measures
+                if measure in self.measures
+            }
+
+        output = {}
+        for measure, (hits, wrong) in sorted(measures.items()):
+            first = midi_interface.get_first_position_in_measure(measure)
+            if measure + 1 < len(midi_interface.measure_map):
+                last = midi_interface.measure_map[measure + 1]
+            else:
+                last = len(midi_interface.state_map)
+            expected = 0
+            for position in range(first, last):
+                expected += len(midi_interface.get_state(position, player.ignored_channels))
+
+            offsets = sorted(hits.values())
+            errors = []
+            if offsets:
+                median = offsets[len(offsets) // 2]
+                errors = [abs(offset - median) for offset in offsets]
+
+            output[measure] = {
+                "expected": expected,
+                "hits": len(hits),
+                "wrong": wrong,
+                "missed": max(0, expected - len(hits)),
+                "accuracy": len(hits) / max(1, expected + wrong),
+                "mean_error": sum(errors) / len(errors) if errors else 0,
+                "max_error": max(errors) if errors else 0
+            }
+
+        return output
+
+    def get_latest_measure(self):
+        ''' Get the last measure anything was played in, or None '''
+        with self.lock:
+            return max(self.measures, default=None)
+
+    def reset(self):
+        ''' Forget every score, eg when switching songs '''
+        with self.lock:
+            self.measures = {}
+            self.since = self.capture.count
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
@@ -0,0 +1,251 @@
+'''
+    Append-only binary log of practice sessions, and export of what was played as a MIDI file.
+
+    Layout (little-endian):
+        Header, 16 bytes:
+            4s  magic, b'RLOG'
+            H   format version
+            H   reserved, 0
+            d   when the log was started, as a unix timestamp
+        Records, 20 bytes each, in the order they were written:
+            d   seconds since the log was started
+            B   kind, one of the KIND_* constants
+            3x  padding
+            i   a
+            i   b
+        KIND_PRESS and KIND_RELEASE have the note in a and the song position in b.
+        KIND_POSITION has the position in a, KIND_LOOP the start and end of the loop in a and b,
+        KIND_TRANSPOSE the transpose in a.
+        KIND_SONG is followed by a bytes of the song's path, utf-8 encoded.
+    Reopening a log appends to it, so one file can hold any number of sessions.
+'''
+import struct
+import threading
+import time
+from heapq import merge
+
+MAGIC = b'RLOG'
+VERSION = 1
+EXTENSION = '.rorylog'
+
+HEADER = struct.Struct('<4sHHd')
+RECORD = struct.Struct('<dB3xii')
+
+KIND_PRESS = 1
+KIND_RELEASE = 2
+KIND_POSITION = 3
+KIND_LOOP = 4
+KIND_TRANSPOSE = 5
+KIND_SONG = 6
+# Longest song path a KIND_SONG record can hold
+MAX_PATH_LENGTH = 65536
+
+# What exported MIDI files are timed in. 120bpm, the default tempo, so no SetTempo is needed
+EXPORT_PPQN = 480
+EXPORT_TICKS_PER_SECOND = EXPORT_PPQN * 2
+EXPORT_VELOCITY = 100
+
+class InvalidSessionLog(Exception):
+    '''Raised when a file isn't a session log this version can read'''
+
+def read_header(fp):
+    ''' Read and check the header of a session log. Returns when it was started '''
+    data = fp.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise InvalidSessionLog("Too short to be a session log")
+
+    magic, version, _, started = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise InvalidSessionLog("Not a session log")
+    if version != VERSION:
+        raise InvalidSessionLog(f"Session log is version {version}, expected {VERSION}")
+
+    return started
+
+
+class SessionLog:
+    '''
+        Writes a Player's session to a log. Records are only buffered in memory by
+        whichever thread makes them; a background thread writes them out every interval
+        seconds, so the Player never waits on the disk.
+        Notes played are taken from a TimingCapture on the background thread as well,
+        so logging them costs the input thread nothing more than capturing them already does.
+    '''
+    def __init__(self, path, capture=None, interval=1):
+        self.path = path
+        self.capture = capture
+        self.since = capture.count if capture is not None else 0
+        self.interval = interval
+
+        self.fp = open(path, 'ab+')
+        self.fp.seek(0)
+        if self.fp.read(1):
+            self.fp.seek(0)
+            try:
+                started = read_header(self.fp)
+            except InvalidSessionLog:
+                self.fp.close()
+                raise
+        else:
+            started = time.time()
+            self.fp.write(HEADER.pack(MAGIC, VERSION, 0, started))
+
+        # perf_counter time the log started at, so records can be timed with perf_counter
+        self.perf_start = time.perf_counter() - (time.time() - started)
+
+        self.lock = threading.Lock()
+        self.pending = [] # (perf_counter, kind, a, b, data)
+        self.wake = threading.Event()
+        self.is_running = True
+        self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+
+    def log(self, kind, a=0, b=0, data=b''):
+        ''' Queue a record to be written '''
+        with self.lock:
+            self.pending.append((time.perf_counter(), kind, a, b, data))
+
+    def log_song(self, path):
+        self.log(KIND_SONG, data=path.encode()[:MAX_PATH_LENGTH])
+
+    def flush_loop(self):
+        while self.is_running:
+            self.wake.wait(self.interval)
+            self.flush()
+
+    def flush(self):
+        ''' Write out everything queued or captured so far '''
+        # Only swapping out the queue blocks log()
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+
+        played = []
+        if self.capture is not None:
+            events, self.since = self.capture.read(self.since)
+            for timestamp, note, pressed, position in events:
+                kind = KIND_PRESS if pressed else KIND_RELEASE
+                played.append((timestamp, kind, note, position, b''))
+
+        if not pending and not played:
+            return
+
+        # Both are already in order, so they only need merging
+        output = bytearray()
+        for timestamp, kind, a, b, data in merge(pending, played, key=lambda record: record[0]):
+            if kind == KIND_SONG:
+                a = len(data)
+            output += RECORD.pack(timestamp - self.perf_start, kind, a, b)
+            output += data
+
+        self.fp.write(output)
+        self.fp.flush()
+
+    def close(self):
+        ''' Stop the background thread, writing anything left '''
+        self.is_running = False
+        self.wake.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+        self.fp.close()
+
+
+def read_records(path, chunk_size=4096):
+    '''
+        Yield every record of a session log as (seconds, kind, a, b, data),
+        reading chunk_size records at a time so logs of any length fit in memory.
+        A record cut off at the end of the file, eg by a crash, is ignored.
+    '''
+    with open(path, 'rb') as fp:
+        read_header(fp)
+        buffer = b''
+        while True:
+            chunk = fp.read(RECORD.size * chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+
+            index = 0
+            while index + RECORD.size <= len(buffer):
+                seconds, kind, a, b = RECORD.unpack_from(buffer, index)
+                data = b''
+                if kind == KIND_SONG:
+                    if a < 0 or a > MAX_PATH_LENGTH:
+                        raise InvalidSessionLog("Session log is corrupt")
+                    if index + RECORD.size + a > len(buffer):
+                        break
+                    data = buffer[index + RECORD.size:index + RECORD.size + a]
+                    index += a
+                index += RECORD.size
+                yield (seconds, kind, a, b, data)
+
+            buffer = buffer[index:]
+
+def write_varlen(value):
+    ''' Encode a MIDI variable length quantity '''
+    output = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        output.insert(0, 0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(output)
+
+def export_midi(log_path, midi_path):
+    '''
+        Write the notes played in a session log to a single track MIDI file.
+        Streams from one file to the other, so memory use doesn't grow with the log.
+        Notes still held when a session ends are released at its last record.
+        Returns the number of notes written.
+    '''
+    note_count = 0
+    with open(midi_path, 'wb') as fp:
+        fp.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, EXPORT_PPQN))
+        fp.write(b'MTrk')
+        length_offset = fp.tell()
+        fp.write(struct.pack('>I', 0))
+
+        track_length = 0
+        last_tick = None
+        held = set()
+        session_end = None # seconds of the latest record in the current session
+
+        def write_event(seconds, event):
+            nonlocal last_tick, track_length
+            tick = int(seconds * EXPORT_TICKS_PER_SECOND)
+            if last_tick is None:
+                # Start from the first note rather than from when the log was opened
+                last_tick = tick
+            data = write_varlen(max(0, tick - last_tick)) + event
+            last_tick = max(last_tick, tick)
+            fp.write(data)
+            track_length += len(data)
+
+        def release_held():
+            for note in sorted(held):
+                write_event(session_end, bytes([0x80, note, 0]))
+            held.clear()
+
+        for seconds, kind, note, _position, _data in read_records(log_path):
+            if kind == KIND_SONG:
+                release_held()
+            session_end = seconds
+
+            if kind == KIND_PRESS:
+                held.add(note & 0x7F)
+                write_event(seconds, bytes([0x90, note & 0x7F, EXPORT_VELOCITY]))
+                note_count += 1
+            elif kind == KIND_RELEASE:
+                held.discard(note & 0x7F)
+                write_event(seconds, bytes([0x80, note & 0x7F, 0]))
+
+        release_held()
+
+        end_of_track = b'\x00\xFF\x2F\x00'
+        fp.write(end_of_track)
+        track_length += len(end_of_track)
+
+        fp.seek(length_offset)
+        fp.write(struct.pack('>I', track_length))
+
+    return note_count
@@ -0,0 +1,492 @@
+'''
+    Versioned binary format for compiled songs, read in place through mmap or shared memory.
+
+    Layout (little-endian, every array starts on a multiple of 8 bytes):
+        Header, 32 bytes:
+            4s  magic, b'RORY'
+            H   format version
+            H   reserved, 0
+            i   transpose
+            i   quantize
+            i   quantize tolerance
+            q   tick of the last event
+            I   number of arrays
+        Array table, 40 bytes per array:
+            16s name, null padded
+            c   typecode (B: uint8, i: int32, I: uint32, q: int64, d: float64)
+            7x  padding
+            Q   offset from the start of the file
+            Q   number of items
+        Arrays:
+            state_offsets  I  positions + 1. Notes of position p are notes[state_offsets[p]:state_offsets[p + 1]]
+            notes          B  Every note of every position, sorted within each position
+            channels       B  The channel of each note in notes
+            flags          B  Per position. FLAG_MEASURE if it starts a measure, FLAG_BEAT if it starts a beat
+            timing         q  Per position. Tick in the original MIDI, or -1 if it wasn't recorded
+            timed_positions I Every position with a tick in timing, in order
+            beats          i  Per position. Beat that starts at it, or -1
+            beat_positions I  Per beat. Position it starts at
+            measures       I  Per measure. Position it starts at
+            tempo_ticks    q  Ticks where the tempo changes, latest first
+            tempo_bpms     d  Tempo from each of tempo_ticks
+            seconds        d  positions + 1. Seconds from the start of the song to each position, then to the end
+            sustain_starts   I  Per held note, sorted. Position it starts at
+            sustain_ends     I  Per held note. Position it's released at
+            sustain_max_ends i  IntervalIndex tree over sustain_ends, so it isn't rebuilt on load
+            sustain_notes    B  Per held note
+            sustain_channels B  Per held note
+'''
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from collections.abc import Mapping
+from apres import MIDI
+from .midiinterface import MIDIInterface
+from .structures import IntervalIndex
+from .prefetch import SongPrefetcher
+
+MAGIC = b'RORY'
+VERSION = 4
+EXTENSION = '.rory'
+# Where POSIX shared memory blocks can be opened as files
+SHARED_MEMORY_PATH = '/dev/shm'
+# Bytes the CompiledSongCache may hold before its least recently used songs are removed
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+# Seconds before a half written cache file is taken to be left over from a crash
+CACHE_TEMPORARY_AGE = 3600
+
+HEADER = struct.Struct('<4sHHiiiqI')
+ARRAY_ENTRY = struct.Struct('<16sc7xQQ')
+# Every array is started on a multiple of this many bytes
+ALIGNMENT = 8
+ITEM_SIZES = {'B': 1, 'i': 4, 'I': 4, 'q': 8, 'd': 8}
+
+ARRAY_NAMES = {
+    "state_offsets", "notes", "channels", "flags", "timing", "timed_positions",
+    "beats", "beat_positions", "measures", "tempo_ticks", "tempo_bpms", "seconds",
+    "sustain_starts", "sustain_ends", "sustain_max_ends", "sustain_notes", "sustain_channels"
+}
+
+FLAG_MEASURE = 1
+FLAG_BEAT = 2
+
+# Stands in for the NoteOn events of a MIDIInterface's active_notes_map
+CompiledNote = namedtuple('CompiledNote', ['note', 'channel'])
+
+class InvalidSongFile(Exception):
+    '''Raised when a buffer isn't a compiled song this version can read'''
+
+def get_arrays(midi_interface):
+    ''' Flatten a MIDIInterface into {name: array} '''
+    position_count = len(midi_interface.state_map)
+    state_offsets = array('I', [0])
+    notes = array('B')
+    channels = array('B')
+    for row in midi_interface.active_notes_map:
+        for note, event in sorted(row.items()):
+            notes.append(note)
+            channels.append(event.channel)
+        state_offsets.append(len(notes))
+
+    flags = array('B', [0]) * position_count
+    for position in midi_interface.beat_map:
+        flags[position] |= FLAG_BEAT
+    for position in midi_interface.measure_map:
+        if position < position_count:
+            flags[position] |= FLAG_MEASURE
+
+    timing = array('q', [-1]) * position_count
+    for position, tick in midi_interface.timing_map.items():
+        if position < position_count:
+            timing[position] = tick
+
+    beats = array('i', [-1]) * position_count
+    for position, beat in midi_interface.beat_map.items():
+        beats[position] = beat
+
+    beat_positions = array('I', [0]) * len(midi_interface.inv_beat_map)
+    for beat, position in midi_interface.inv_beat_map.items():
+        beat_positions[beat] = position
+
+    return {
+        "state_offsets": state_offsets,
+        "notes": notes,
+        "channels": channels,
+        "flags": flags,
+        "timing": timing,
+        "timed_positions": array('I', [position for position in midi_interface.timed_positions if position < position_count]),
+        "beats": beats,
+        "beat_positions": beat_positions,
+        "measures": array('I', midi_interface.measure_map),
+        "tempo_ticks": array('q', [tick for tick, _bpm in midi_interface.tempo_map]),
+        "tempo_bpms": array('d', [bpm for _tick, bpm in midi_interface.tempo_map]),
+        "seconds": array('d', midi_interface.seconds_map),
+        "sustain_starts": array('I', midi_interface.sustain_starts),
+        "sustain_ends": array('I', midi_interface.sustain_ends),
+        "sustain_max_ends": array('i', midi_interface.sustain_index.max_ends),
+        "sustain_notes": array('B', midi_interface.sustain_notes),
+        "sustain_channels": array('B', midi_interface.sustain_channels)
+    }
+
+def serialize(midi_interface):
+    ''' Get a MIDIInterface in the compiled song format '''
+    arrays = get_arrays(midi_interface)
+
+    table = []
+    offset = HEADER.size + (ARRAY_ENTRY.size * len(arrays))
+    for name, values in arrays.items():
+        offset += (ALIGNMENT - (offset % ALIGNMENT)) % ALIGNMENT
+        table.append((name, values, offset))
+        offset += len(values) * ITEM_SIZES[values.typecode]
+
+    output = bytearray(offset)
+    HEADER.pack_into(
+        output,
+        0,
+        MAGIC,
+        VERSION,
+        0,
+        midi_interface.transpose,
+        midi_interface.quantize,
+        midi_interface.quantize_tolerance,
+        midi_interface.midi_length,
+        len(arrays)
+    )
+
+    for i, (name, values, offset) in enumerate(table):
+        ARRAY_ENTRY.pack_into(
+            output,
+            HEADER.size + (i * ARRAY_ENTRY.size),
+            name.encode(),
+            values.typecode.encode(),
+            offset,
+            len(values)
+        )
+        if sys.byteorder != 'little':
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+        output[offset:offset + len(data)] = data
+
+    return output
+
+def replace_file(path, write_contents):
+    '''
+        Write a file with write_contents(fp) and move it over path in one step, so a reader never
+        maps half a file. Each writer gets a temporary file of its own, since several processes
+        can be caching the same song at once.
+    '''
+    fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        # mkstemp only lets the owner read it
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'wb') as fp:
+            write_contents(fp)
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.unlink(temporary_path)
+        except OSError:
+            pass
+        raise
+
+def write(midi_interface, path):
+    ''' Write a MIDIInterface to path in the compiled song format '''
+    data = serialize(midi_interface)
+    replace_file(path, lambda fp: fp.write(data))
+
+def compile_file(midi_path, output_path=None, **kwargs):
+    '''
+        Compile a midi file into a compiled song file.
+        Defaults to writing next to the midi file. Returns the compiled MIDIInterface and path written
+    '''
+    if output_path is None:
+        output_path = os.path.splitext(midi_path)[0] + EXTENSION
+    midi_interface = MIDIInterface(MIDI.load(midi_path), **SongPrefetcher.get_compile_options(kwargs))
+    write(midi_interface, output_path)
+    return (midi_interface, output_path)
+
+
+class StateMap:
+    ''' Read-only list of the set of notes at each position '''
+    def __init__(self, offsets, notes):
+        self.offsets = offsets
+        self.notes = notes
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_range(self, position):
+        if position < 0:
+            position += len(self)
+        if position < 0 or position >= len(self):
+            raise IndexError(position)
+        return (self.offsets[position], self.offsets[position + 1])
+
+    def __getitem__(self, position):
+        start, end = self.get_range(position)
+        return set(self.notes[start:end])
+
+
+class ActiveNotesMap(StateMap):
+    ''' Read-only list of {note: CompiledNote} at each position '''
+    def __init__(self, offsets, notes, channels):
+        super().__init__(offsets, notes)
+        self.channels = channels
+
+    def __getitem__(self, position):
+        start, end = self.get_range(position)
+        output = {}
+        for i in range(start, end):
+            output[self.notes[i]] = CompiledNote(self.notes[i], self.channels[i])
+        return output
+
+
+class PositionMap(Mapping):
+    ''' Read-only {position: value} over an array with -1 wherever a position has no value '''
+    def __init__(self, values):
+        self.values = values
+        self.length = None
+
+    def __getitem__(self, position):
+        if not isinstance(position, int) or position < 0 or position >= len(self.values):
+            raise KeyError(position)
+        value = self.values[position]
+        if value == -1:
+            raise KeyError(position)
+        return value
+
+    def __contains__(self, position):
+        try:
+            self[position]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        for position, value in enumerate(self.values):
+            if value != -1:
+                yield position
+
+    def __len__(self):
+        if self.length is None:
+            self.length = len([value for value in self.values if value != -1])
+        return self.length
+
+
+class MeasureMap:
+    ''' Read-only list of the position each measure starts at, with constant time "in" '''
+    def __init__(self, positions, flags):
+        self.positions = positions
+        self.flags = flags
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        return self.positions[index]
+
+    def __contains__(self, position):
+        return 0 <= position < len(self.flags) and bool(self.flags[position] & FLAG_MEASURE)
+
+
+class TempoMap:
+    ''' Read-only list of (tick, bpm) '''
+    def __init__(self, ticks, bpms):
+        self.ticks = ticks
+        self.bpms = bpms
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def __getitem__(self, index):
+        return (self.ticks[index], self.bpms[index])
+
+
+class CompiledMIDIInterface(MIDIInterface):
+    '''
+        A MIDIInterface read straight out of a buffer in the compiled song format.
+        Only the query methods are usable. There is no midi, since the events weren't kept.
+    '''
+    def __init__(self, buffer, owner=None):
+        # MIDIInterface.__init__ compiles, so it's deliberately not called
+        # owner is closed along with this, eg the mmap or SharedMemory that buffer belongs to
+        self.owner = owner
+        self.views = []
+
+        buffer = memoryview(buffer)
+        self.views.append(buffer)
+        if len(buffer) < HEADER.size:
+            self.close()
+            raise InvalidSongFile("Too short to be a compiled song")
+
+        magic, version, _, transpose, quantize, quantize_tolerance, midi_length, array_count = \
+            HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            self.close()
+            raise InvalidSongFile("Not a compiled song")
+        if version != VERSION:
+            self.close()
+            raise InvalidSongFile(f"Compiled song is version {version}, expected {VERSION}")
+        if sys.byteorder != 'little':
+            self.close()
+            raise InvalidSongFile("Compiled songs can only be read on little-endian machines")
+        if HEADER.size + (array_count * ARRAY_ENTRY.size) > len(buffer):
+            self.close()
+            raise InvalidSongFile("Compiled song is truncated or corrupt")
+
+        arrays = {}
+        for i in range(array_count):
+            name, typecode, offset, length = ARRAY_ENTRY.unpack_from(buffer, HEADER.size + (i * ARRAY_ENTRY.size))
+            typecode = typecode.decode()
+            end = offset + (length * ITEM_SIZES.get(typecode, 0))
+            if typecode not in ITEM_SIZES or end > len(buffer):
+                self.close()
+                raise InvalidSongFile("Compiled song is truncated or corrupt")
+            view = buffer[offset:end].cast(typecode)
+            self.views.append(view)
+            arrays[name.rstrip(b'\0').decode()] = view
+
+        if not ARRAY_NAMES.issubset(arrays):
+            self.close()
+            raise InvalidSongFile("Compiled song is missing arrays")
+
+        self.midi = None
+        self.transpose = transpose
+        self.quantize = quantize
+        self.quantize_tolerance = quantize_tolerance
+        self.midi_length = midi_length
+
+        self.state_map = StateMap(arrays['state_offsets'], arrays['notes'])
+        self.active_notes_map = ActiveNotesMap(arrays['state_offsets'], arrays['notes'], arrays['channels'])
+        self.timing_map = PositionMap(arrays['timing'])
+        self.timed_positions = arrays['timed_positions']
+        self.beat_map = PositionMap(arrays['beats'])
+        self.inv_beat_map = arrays['beat_positions']
+        self.measure_map = MeasureMap(arrays['measures'], arrays['flags'])
+        self.tempo_map = TempoMap(arrays['tempo_ticks'], arrays['tempo_bpms'])
+        self.seconds_map = arrays['seconds']
+        self.rhythm_map = {
+            0: (0, 1)
+        }
+        self.sustain_starts = arrays['sustain_starts']
+        self.sustain_ends = arrays['sustain_ends']
+        self.sustain_notes = arrays['sustain_notes']
+        self.sustain_channels = arrays['sustain_channels']
+        self.sustain_index = IntervalIndex(
+            self.sustain_starts,
+            self.sustain_ends,
+            arrays['sustain_max_ends']
+        )
+
+    @classmethod
+    def open(cls, path):
+        ''' Map a compiled song file. Only the pages that are read get loaded '''
+        with open(path, 'rb') as fp:
+            try:
+                mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as exception:
+                # Empty files can't be mapped
+                raise InvalidSongFile(str(exception)) from exception
+        return cls(mapped, mapped)
+
+    def get_measure(self, test_position):
+        return max(0, bisect_right(self.measure_map, test_position) - 1)
+
+    def close(self):
+        ''' Unmap the buffer. Nothing can be read afterwards '''
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        if self.owner is not None:
+            self.owner.close()
+            self.owner = None
+
+    def __del__(self):
+        self.close()
+
+
+class CompiledSongCache:
+    '''
+        Compiled song files kept on disk, so a song is only ever compiled once
+        for each set of compile options. Once they add up to more than max_size bytes,
+        the least recently used are removed (see prune()).
+    '''
+    def __init__(self, path=None, max_size=CACHE_MAX_SIZE):
+        if path is None:
+            path = os.path.join(
+                os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                'rory'
+            )
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def get_path(self, midi_path, **kwargs):
+        ''' Get where the song would be cached. Changes whenever the midi file does '''
+        midi_path = os.path.realpath(midi_path)
+        stat = os.stat(midi_path)
+        options = tuple(kwargs.get(key, 0) for key in SongPrefetcher.COMPILE_OPTIONS)
+        key = repr((midi_path, stat.st_mtime_ns, stat.st_size, options, VERSION))
+        return os.path.join(self.path, hashlib.sha1(key.encode()).hexdigest() + EXTENSION)
+
+    def load(self, midi_path, **kwargs):
+        ''' Get the cached song, or None '''
+        try:
+            path = self.get_path(midi_path, **kwargs)
+            midi_interface = CompiledMIDIInterface.open(path)
+        except (OSError, InvalidSongFile):
+            return None
+
+        # Marks it as recently used. Access times aren't reliable, eg with noatime
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return midi_interface
+
+    def prune(self):
+        '''
+            Remove the least recently used songs until the cache fits in max_size.
+            Called whenever songs are added. Songs that are still mapped stay readable.
+        '''
+        now = time.time()
+        songs = [] # (last used, size, path)
+        total = 0
+        try:
+            entries = list(os.scandir(self.path))
+        except OSError:
+            return
+
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+
+            if entry.name.endswith(EXTENSION):
+                songs.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            # Every writer has its own, so this only catches ones left by writers that died
+            elif entry.name.endswith('.tmp') and now - stat.st_mtime > CACHE_TEMPORARY_AGE:
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+
+        songs.sort()
+        for _last_used, size, path in songs:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
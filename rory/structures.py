@@ -1,9 +1,10 @@
 """
     Specialized generic structures to help with midi note processing.
-    Only Grouping at the moment.
+    Grouping, and IntervalIndex for looking up held notes.
 """
 from __future__ import annotations
 import math, json
+from bisect import bisect_left
 from enum import Enum, auto
 from typing import Optional, List, Tuple, Dict
 
@@ -494,6 +495,73 @@ class Grouping:
                 self.divisions[i] = div[0]
 
 
+class IntervalIndex:
+    """
+        Static index of half-open [start, end) intervals, given sorted by start.
+        Alongside the starts and ends, a complete binary tree holds the largest end
+        under each node, so finding the k intervals overlapping a range takes
+        O(log n) per result instead of a scan of every interval.
+    """
+    def __init__(self, starts, ends, max_ends=None):
+        self.starts = starts
+        self.ends = ends
+        # The tree can be built ahead of time (see songfile) and passed back in as is
+        if max_ends is None:
+            max_ends = IntervalIndex.build_max_ends(ends)
+        self.max_ends = max_ends
+        self.leaf_count: int = len(max_ends) // 2
+
+    @staticmethod
+    def build_max_ends(ends) -> List[int]:
+        """
+            Build the tree of largest ends. Node 1 is the root, node n's children are 2n and 2n + 1
+            and the leaves start at the first power of 2 >= len(ends). Empty leaves are -1.
+        """
+        leaf_count = 1
+        while leaf_count < len(ends):
+            leaf_count *= 2
+
+        tree = [-1] * (leaf_count * 2)
+        for i, end in enumerate(ends):
+            tree[leaf_count + i] = end
+        for node in range(leaf_count - 1, 0, -1):
+            tree[node] = max(tree[node * 2], tree[(node * 2) + 1])
+
+        return tree
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, first: int, last: int) -> List[int]:
+        """Get the indices, in order, of every interval overlapping [first, last)"""
+        # Only intervals starting before last can overlap
+        count = bisect_left(self.starts, last)
+        output = []
+        stack = [1]
+        while stack:
+            node = stack.pop()
+            if self.max_ends[node] <= first:
+                continue
+
+            depth = node.bit_length() - 1
+            width = self.leaf_count >> depth
+            if (node - (1 << depth)) * width >= count:
+                continue
+
+            if node >= self.leaf_count:
+                output.append(node - self.leaf_count)
+            else:
+                # Right first so the left child is popped first
+                stack.append((node * 2) + 1)
+                stack.append(node * 2)
+
+        return output
+
+    def at(self, position: int) -> List[int]:
+        """Get the indices of every interval containing position"""
+        return self.overlapping(position, position + 1)
+
+
 def get_prime_factors(n):
     primes = []
     for i in range(2, n // 2):
@@ -0,0 +1,45 @@
+import unittest
+import tempfile
+import shutil
+import os
+
+from rory.batch import BatchCompiler, find_songs, STATUS_OK, STATUS_INVALID, STATUS_TIMEOUT
+from rory.songfile import CompiledSongCache
+from benchmarks.corpus import generate_song
+
+class BatchCompilerTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        os.makedirs(self.path + '/nested')
+        generate_song(0, bars=4).save(self.path + '/short.mid')
+        generate_song(1, bars=4).save(self.path + '/nested/other.MID')
+        with open(self.path + '/nested/bad.mid', 'wb') as fp:
+            fp.write(b'not a midi file')
+        with open(self.path + '/notes.txt', 'w') as fp:
+            fp.write('not a song')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_find_songs(self):
+        songs = [os.path.relpath(path, self.path) for path in find_songs(self.path)]
+        assert songs == ['nested/bad.mid', 'nested/other.MID', 'short.mid'], f"Wrong songs found: {songs}"
+
+    def test_run(self):
+        cache = CompiledSongCache(self.path + '/cache')
+        batch = BatchCompiler(workers=2, timeout=30, cache=cache)
+        results = dict(batch.run(find_songs(self.path)))
+
+        assert results[self.path + '/nested/bad.mid']['status'] == STATUS_INVALID, "Bad file wasn't reported"
+        for name in ('short.mid', 'nested/other.MID'):
+            result = results[self.path + '/' + name]
+            assert result['status'] == STATUS_OK, f"{name} didn't compile: {result}"
+            assert result['states'] > 0, f"{name} has no states"
+            assert cache.load(self.path + '/' + name) is not None, f"{name} wasn't cached"
+
+    def test_timeout(self):
+        # Nothing ever writes to the pipe, so reading the song blocks until the worker is killed
+        os.mkfifo(self.path + '/stuck.mid')
+        batch = BatchCompiler(workers=1, timeout=.2)
+        results = dict(batch.run([self.path + '/stuck.mid']))
+        assert results[self.path + '/stuck.mid']['status'] == STATUS_TIMEOUT, "Stuck song wasn't stopped"
@@ -0,0 +1,65 @@
+import unittest
+import tempfile
+import shutil
+import apres
+
+from rory.classroom import Classroom
+from rory.input_backends import ScriptedBackend
+
+class ClassroomTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for name, base in (('a', 60), ('b', 40)):
+            midi = apres.MIDI(ppqn=120)
+            for i in range(8):
+                midi.add_event(apres.NoteOn(note=base + i, velocity=64, channel=0), tick=i * 120)
+                midi.add_event(apres.NoteOff(note=base + i, velocity=0, channel=0), tick=(i + 1) * 120)
+            midi.save(f"{self.path}/{name}.mid")
+
+        self.classroom = Classroom()
+
+    def tearDown(self):
+        self.classroom.close()
+        shutil.rmtree(self.path)
+
+    def test_shared_song(self):
+        path = self.path + '/a.mid'
+        backends = [ScriptedBackend() for _ in range(3)]
+        sessions = [
+            self.classroom.add_session(f"student {i}", path, backend)
+            for i, backend in enumerate(backends)
+        ]
+
+        midi_interface = sessions[0].player.midi_interface
+        for session in sessions:
+            assert session.player.midi_interface is midi_interface, "Sessions didn't share the compiled song"
+        assert len(self.classroom.songs) == 1, "Song was compiled more than once"
+
+        # Playing in one session leaves the others where they are
+        backends[0].press_note(60)
+        backends[0].release_note(60)
+        positions = [session.player.song_position for session in sessions]
+        assert positions[0] > positions[1], "Session didn't advance"
+        assert positions[1] == positions[2] == 0, "Other sessions moved"
+
+    def test_release(self):
+        path = self.path + '/a.mid'
+        session = self.classroom.add_session("first", path, ScriptedBackend())
+        self.classroom.add_session("second", path, ScriptedBackend())
+
+        self.classroom.remove_session("first")
+        assert self.classroom.songs.get_users(session.song_key) == 1, "Song wasn't released"
+        self.classroom.remove_session("second")
+        assert len(self.classroom.songs) == 0, "Unused song was kept"
+
+    def test_assign(self):
+        self.classroom.add_session("first", self.path + '/a.mid', ScriptedBackend())
+        self.classroom.add_session("second", self.path + '/a.mid', ScriptedBackend())
+        self.classroom.assign(self.path + '/b.mid')
+
+        states = [
+            session.player.midi_interface.get_state(session.player.song_position)
+            for session in (self.classroom.get_session("first"), self.classroom.get_session("second"))
+        ]
+        assert states == [{40}, {40}], f"Sessions weren't moved to the new song: {states}"
+        assert len(self.classroom.songs) == 1, "Previous song wasn't released"
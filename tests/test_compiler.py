@@ -0,0 +1,111 @@
+import unittest
+import tempfile
+import shutil
+import time
+import glob
+import apres
+
+from rory.compiler import SongCompiler, SHARED_MEMORY_PREFIX, get_block_path
+from rory.midiinterface import MIDIInterface
+from rory.player import Player
+from rory.songfile import compile_file
+from rory.input_backends import ScriptedBackend
+from benchmarks.corpus import generate_song
+
+class SongCompilerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Starting the worker process is the slow part, so it's shared
+        cls.compiler = SongCompiler()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.compiler.close()
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        midi = apres.MIDI(ppqn=120)
+        midi.add_event(apres.SetTempo(400000), tick=0)
+        for i in range(16):
+            for j, channel in ((0, 0), (4, 1)):
+                note = 50 + i + j
+                midi.add_event(apres.NoteOn(note=note, velocity=64, channel=channel), tick=i * 60)
+                midi.add_event(apres.NoteOff(note=note, velocity=0, channel=channel), tick=(i + 1) * 60)
+        self.song_path = self.path + '/song.mid'
+        midi.save(self.song_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_matches_midiinterface(self):
+        compiled = self.compiler.compile(self.song_path, transpose=2)
+        expected = MIDIInterface(apres.MIDI.load(self.song_path), transpose=2)
+
+        assert len(compiled.state_map) == len(expected.state_map), "Different number of states"
+        assert list(compiled.state_map) == expected.state_map, "States differ"
+        for position, row in enumerate(expected.active_notes_map):
+            assert {note: event.channel for note, event in compiled.active_notes_map[position].items()} \
+                == {note: event.channel for note, event in row.items()}, f"Channels differ at {position}"
+            assert compiled.get_real_tick(position) == expected.get_real_tick(position), f"Timing differs at {position}"
+            assert compiled.get_measure(position) == expected.get_measure(position), f"Measure differs at {position}"
+        assert dict(compiled.beat_map) == expected.beat_map, "Beats differ"
+        assert list(compiled.tempo_map) == expected.tempo_map, "Tempos differ"
+        assert compiled.transpose == 2
+
+        compiled.close()
+
+    def test_player(self):
+        compiled = self.compiler.compile(self.song_path)
+        backend = ScriptedBackend()
+        player = Player(path=self.song_path, midi_interface=compiled, input_backend=backend)
+        try:
+            for note in sorted(compiled.get_state(player.song_position)):
+                backend.press_note(note)
+            assert player.song_position > 0, "Player didn't advance on a compiled song"
+        finally:
+            player.kill()
+
+    def test_invalid_file(self):
+        with open(self.path + '/bad.mid', 'wb') as fp:
+            fp.write(b'not a midi file')
+        with self.assertRaises(Exception):
+            self.compiler.compile(self.path + '/bad.mid')
+
+    def test_transpose(self):
+        backend = ScriptedBackend()
+        player = Player(path=self.song_path, compiler=self.compiler, input_backend=backend)
+        try:
+            player.reinit_midi_interface(transpose=3)
+            for _ in range(100):
+                if player.get_transpose() == 3:
+                    break
+                time.sleep(.05)
+            assert player.get_transpose() == 3, "Recompiled song wasn't switched to"
+            assert player.midi_interface.get_state(0) == {53, 57}, "Song wasn't transposed"
+        finally:
+            player.kill()
+
+    def test_transpose_compiled_file(self):
+        compile_file(self.song_path, self.path + '/song.rory')
+        compiled = self.compiler.compile(self.path + '/song.rory')
+        backend = ScriptedBackend()
+        player = Player(path=self.path + '/song.rory', midi_interface=compiled, compiler=self.compiler, input_backend=backend)
+        try:
+            assert not player.can_recompile(), "Compiled song file was taken to be recompilable"
+            player.reinit_midi_interface(transpose=3)
+            assert player.pending_compile is None and player.get_transpose() == 0, "Compiled song file was recompiled"
+        finally:
+            player.kill()
+
+    def test_close_during_compile(self):
+        generate_song(0, bars=1000).save(self.path + '/long.mid')
+        compiler = SongCompiler()
+        future = compiler.submit(self.path + '/long.mid')
+        # Long enough for the worker to have started, not to have finished
+        time.sleep(1)
+        assert not future.done(), "Song compiled too quickly to test with"
+
+        start = time.perf_counter()
+        compiler.close()
+        assert time.perf_counter() - start < 1, "Closing waited on the compile"
+        assert not glob.glob(get_block_path(SHARED_MEMORY_PREFIX + '*')), "Shared memory was left behind"
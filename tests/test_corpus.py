@@ -0,0 +1,30 @@
+import unittest
+import tempfile
+import shutil
+
+from rory.midiinterface import MIDIInterface
+from benchmarks.corpus import CORPUS, generate_song
+
+class CorpusTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get_song_bytes(self, seed):
+        generate_song(seed, bars=4, tuplets=True, jitter=5).save(self.path + '/song.mid')
+        with open(self.path + '/song.mid', 'rb') as fp:
+            output = fp.read()
+        return output
+
+    def test_seeded(self):
+        first = self.get_song_bytes(3)
+        assert first == self.get_song_bytes(3), "The same seed didn't generate the same song"
+        assert first != self.get_song_bytes(4)
+
+    def test_compiles(self):
+        for name, kwargs in CORPUS.items():
+            kwargs = dict(kwargs, bars=4, tempo_changes=min(4, kwargs.get('tempo_changes', 0)))
+            midi_interface = MIDIInterface(generate_song(0, **kwargs))
+            assert midi_interface.state_map, f"'{name}' song had no states"
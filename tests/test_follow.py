@@ -0,0 +1,60 @@
+import unittest
+import tempfile
+import shutil
+import time
+import apres
+
+from rory.player import Player
+from rory.midiinterface import MIDIInterface
+from rory.input_backends import ScriptedBackend
+
+class FollowTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.midi_path = self.path + '/song.mid'
+
+        midi = apres.MIDI(ppqn=120)
+        midi.add_event(apres.SetTempo.from_bpm(600), tick=0)
+        for i in range(16):
+            midi.add_event(apres.NoteOn(note=60 + i, velocity=100, channel=0), tick=i * 60)
+            midi.add_event(apres.NoteOff(note=60 + i, velocity=0, channel=0), tick=(i + 1) * 60)
+            # Twice as fast halfway through
+            if i == 7:
+                midi.add_event(apres.SetTempo.from_bpm(1200), tick=(i + 1) * 60)
+        midi.save(self.midi_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_seconds_map(self):
+        midi_interface = MIDIInterface(apres.MIDI.load(self.midi_path))
+        seconds_map = midi_interface.seconds_map
+        assert len(seconds_map) == len(midi_interface.state_map) + 1, "Should have an entry for the end of the song"
+        # An eighth note at 600bpm is .05s, at 1200bpm .025s
+        for position in range(1, len(midi_interface.state_map)):
+            tick = midi_interface.timing_map[position]
+            expected = min(tick, 480) * .05 / 60 + max(0, tick - 480) * .025 / 60
+            assert abs(seconds_map[position] - expected) < 1e-9, f"Wrong time at position {position}"
+
+    def test_follow(self):
+        player = Player(path=self.midi_path, input_backend=ScriptedBackend())
+        try:
+            midi_interface = player.midi_interface
+            last_position = len(midi_interface.state_map) - 1
+            duration = midi_interface.get_seconds(last_position) - midi_interface.get_seconds(player.song_position)
+
+            player.toggle_follow()
+            assert player.is_following(), "Follow didn't start"
+            time.sleep(duration + .01)
+            assert player.song_position in (last_position, player.loop[0]), \
+                f"Expected to reach the end of the song, at {player.song_position}"
+
+            player.toggle_follow()
+            assert not player.is_following(), "Follow didn't stop"
+
+            lateness = sorted(player.follower.lateness)
+            assert lateness, "Never advanced"
+            median = lateness[len(lateness) // 2]
+            assert median < .001, f"Advanced {median * 1000:.2f}ms late"
+        finally:
+            player.kill()
@@ -0,0 +1,194 @@
+import unittest
+import tempfile
+import shutil
+import time
+import os
+import threading
+
+from rory.controller_manager import ControllerManager
+from rory.input_backends import ScriptedBackend, PipeBackend, RawMIDIParser, RoryController
+from rory.scoring import TimingCapture
+
+class RawMIDIParserTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.parser = RawMIDIParser(
+            lambda note: self.events.append(('on', note)),
+            lambda note: self.events.append(('off', note))
+        )
+
+    def test_running_status(self):
+        self.parser.feed(b'\x90\x40\x64\x41\x64\x40\x00')
+        assert self.events == [('on', 0x40), ('on', 0x41), ('off', 0x40)], "Running status wasn't followed"
+
+    def test_split_chunks(self):
+        self.parser.feed(b'\x90\x40')
+        assert not self.events
+        self.parser.feed(b'\x64\x80\x40\x00')
+        assert self.events == [('on', 0x40), ('off', 0x40)], "Message split across chunks was lost"
+
+    def test_skipped_messages(self):
+        # Clock in the middle of a message, a sysex, then a program change
+        self.parser.feed(b'\x90\x40\xF8\x64\xF0\x01\x02\x03\xF7\xC0\x05\x90\x41\x64')
+        assert self.events == [('on', 0x40), ('on', 0x41)]
+
+
+class ControllerBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.checks = 0
+        self.backend = ScriptedBackend()
+        self.manager = ControllerManager(backend=self.backend)
+        self.manager.add_callback('do_state_check', self.count_check)
+
+    def tearDown(self):
+        self.manager.close()
+
+    def count_check(self):
+        self.checks += 1
+
+    def test_scripted(self):
+        assert self.manager.is_connected()
+        self.backend.play([(0, 60, 100), (0, 64, 100), (0, 60, 0)])
+        assert self.manager.get_pressed() == {64}
+        assert self.checks == 3, "Every note should trigger a state check"
+
+    def test_scripted_source(self):
+        # Scripted notes are one device among others, so a note another device holds stays down
+        self.manager.queue_note('other', 60, True)
+        self.backend.press_note(60)
+        self.backend.release_note(60)
+        assert self.manager.get_pressed() == {60}, "Released a note another device still holds"
+        assert self.manager.source_notes['scripted'] == set(), "Scripted notes weren't tracked as their own device"
+
+    def test_pipe(self):
+        path = tempfile.mkdtemp()
+        try:
+            os.mkfifo(path + '/input')
+            self.manager.close()
+            backend = PipeBackend(path + '/input')
+            self.manager = ControllerManager(backend=backend)
+
+            with open(path + '/input', 'wb') as fp:
+                fp.write(b'\x90\x40\x64\x3C\x64')
+
+            for _ in range(40):
+                if self.manager.get_pressed() == {0x40, 0x3C}:
+                    break
+                time.sleep(.05)
+            assert self.manager.get_pressed() == {0x40, 0x3C}, "Notes weren't read from the pipe"
+        finally:
+            shutil.rmtree(path)
+
+
+class RoryControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.capture = TimingCapture(lambda: 0)
+        self.manager = ControllerManager(backend=ScriptedBackend(), capture=self.capture)
+        # No such device, so it's fed bytes directly
+        self.controller = RoryController(99, 99, self.manager)
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_read_time(self):
+        data = iter(b'\x90\x40\x64\x80\x40\x00')
+        self.controller.get_next_byte = lambda: next(data)
+
+        events = []
+        for _ in range(2):
+            event = self.controller.get_next_event()
+            events.append((time.perf_counter(), event))
+            self.controller.event_queue.append((getattr(self.controller, "hook_" + type(event).__name__), event))
+
+        # apres calls the hooks later, from its own polling thread
+        time.sleep(.05)
+        while self.controller.event_queue:
+            hook, event = self.controller.event_queue.pop(0)
+            hook(event)
+        self.manager.wait_for_input()
+
+        recorded, _since = self.capture.read()
+        assert [(note, pressed) for _time, note, pressed, _position in recorded] == [(0x40, True), (0x40, False)]
+        for (read_time, _event), (recorded_time, _note, _pressed, _position) in zip(events, recorded):
+            assert recorded_time <= read_time, "Note was timed when its hook ran rather than when it was read"
+
+
+class ChordWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.checks = []
+        self.backend = ScriptedBackend()
+        self.manager = ControllerManager(backend=self.backend, chord_window=.02)
+        self.manager.add_callback('do_state_check', lambda: self.checks.append(self.manager.get_pressed()))
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_coalesced(self):
+        for note in range(60, 66):
+            self.backend.press_note(note)
+        assert not self.checks, "Checked before the window was up"
+        time.sleep(.1)
+        assert self.checks == [set(range(60, 66))], f"Expected one check of the whole chord, got {self.checks}"
+
+    def test_immediate(self):
+        chord = {60, 64, 67}
+        self.manager.target_check = lambda pressed: chord.issubset(pressed)
+        for note in sorted(chord):
+            self.backend.press_note(note)
+        assert self.checks == [chord], "Completing the chord should be checked right away"
+        time.sleep(.1)
+        assert len(self.checks) == 1, "Notes already checked were checked again"
+
+
+class MultipleDeviceTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = ScriptedBackend()
+        self.manager = ControllerManager(backend=self.backend)
+
+    def tearDown(self):
+        self.manager.close()
+
+    def wait_for_pressed(self, expected):
+        for _ in range(40):
+            if self.manager.get_pressed() == expected:
+                break
+            time.sleep(.01)
+        return self.manager.get_pressed()
+
+    def test_concurrent(self):
+        def play(source, notes):
+            for note in notes:
+                self.manager.queue_note(source, note, True)
+            self.manager.queue_note(source, notes[0], False)
+
+        threads = [
+            threading.Thread(target=play, args=(i, list(range(i * 10, i * 10 + 10))))
+            for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        expected = set(range(40)) - {0, 10, 20, 30}
+        pressed = self.wait_for_pressed(expected)
+        assert pressed == expected, f"Notes from every device should be merged, got {pressed}"
+
+    def test_shared_note(self):
+        self.manager.queue_note('a', 60, True)
+        self.manager.queue_note('b', 60, True)
+        self.manager.queue_note('a', 60, False)
+        # Applied in order, so once 72 is in, the release before it has been too
+        self.manager.queue_note('c', 72, True)
+        assert self.wait_for_pressed({60, 72}) == {60, 72}, "Note released while another device still held it"
+        self.manager.queue_note('c', 72, False)
+        self.manager.queue_note('b', 60, False)
+        assert self.wait_for_pressed(set()) == set(), "Note wasn't released by the last device holding it"
+
+    def test_disconnect(self):
+        self.manager.queue_note('a', 60, True)
+        self.manager.queue_note('a', 62, True)
+        self.manager.queue_note('b', 64, True)
+        self.manager.queue_disconnect('a')
+        pressed = self.wait_for_pressed({64})
+        assert pressed == {64}, f"Disconnected device's notes should be released, got {pressed}"
@@ -0,0 +1,110 @@
+import unittest
+import tempfile
+import shutil
+import time
+import os
+import apres
+
+from rory.library import LibraryIndex, SongSummaryScanner, read_song_summary
+
+class LibraryIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        os.mkdir(self.path + '/scales')
+        for filename in ('b.mid', 'a.MID', 'notes.txt'):
+            with open(self.path + '/' + filename, 'w') as fp:
+                fp.write('')
+
+        self.index = LibraryIndex()
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.path)
+
+    def wait_for(self, check):
+        for _ in range(40):
+            if check():
+                return True
+            time.sleep(.05)
+        return False
+
+    def test_listing(self):
+        dirs, files = self.index.get_listing(self.path)
+        assert dirs == ['scales'], "Directory wasn't found"
+        assert files == ['a.MID', 'b.mid'], "Only .mid files should be listed, sorted"
+
+    def test_inotify_updates(self):
+        self.index.get_listing(self.path)
+        with open(self.path + '/c.mid', 'w') as fp:
+            fp.write('')
+
+        listing = self.index.listings[os.path.realpath(self.path)]
+        assert self.wait_for(lambda: 'c.mid' in listing.files), "Created file wasn't picked up"
+
+        os.remove(self.path + '/b.mid')
+        assert self.wait_for(lambda: 'b.mid' not in listing.files), "Deleted file wasn't dropped"
+
+        _dirs, files = self.index.get_listing(self.path)
+        assert files == ['a.MID', 'c.mid']
+
+    def test_mtime_revalidation(self):
+        index = LibraryIndex(watch=False)
+        index.get_listing(self.path)
+
+        os.mkdir(self.path + '/arpeggios')
+        # Make sure the mtime changes even on coarse filesystems
+        mtime = os.stat(self.path).st_mtime + 5
+        os.utime(self.path, (mtime, mtime))
+
+        dirs, _files = index.get_listing(self.path)
+        assert dirs == ['arpeggios', 'scales'], "Stale listing was returned"
+        index.close()
+
+
+class SongSummaryTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.midi_path = self.path + '/summary.mid'
+
+        midi = apres.MIDI(ppqn=120)
+        midi.add_event(apres.TimeSignature(numerator=3, denominator=2), tick=0)
+        midi.add_event(apres.SetTempo(1000000), tick=0)
+        # 60bpm, doubling halfway through
+        midi.add_event(apres.SetTempo(500000), tick=480)
+        for i in range(8):
+            midi.add_event(apres.NoteOn(note=60 + i, velocity=100, channel=i % 2), tick=i * 120)
+            midi.add_event(apres.NoteOff(note=60 + i, velocity=0, channel=i % 2), tick=(i + 1) * 120)
+        # Percussion isn't counted
+        midi.add_event(apres.NoteOn(note=40, velocity=100, channel=9), tick=0)
+        midi.save(self.midi_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_summary(self):
+        summary = read_song_summary(self.midi_path)
+        assert summary.note_count == 8
+        assert summary.channels == {0, 1}
+        assert summary.time_signature == (3, 4)
+        assert round(summary.bpm) == 60
+        # 4 beats at 60bpm, then 4 beats at 120bpm
+        assert abs(summary.duration - 6) < .01, "Duration didn't follow the tempo map"
+
+    def test_invalid(self):
+        with open(self.midi_path, 'wb') as fp:
+            fp.write(b'not a midi')
+
+        with self.assertRaises(ValueError):
+            read_song_summary(self.midi_path)
+
+    def test_scanner(self):
+        scanner = SongSummaryScanner()
+        assert scanner.request([self.midi_path]) == {}, "Nothing should be cached yet"
+        for _ in range(40):
+            if scanner.get(self.midi_path) is not None:
+                break
+            time.sleep(.05)
+
+        assert scanner.has_updates()
+        assert scanner.get(self.midi_path).note_count == 8
+        scanner.close()
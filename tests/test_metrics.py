@@ -0,0 +1,63 @@
+import unittest
+import tempfile
+import shutil
+import json
+
+from rory.metrics import Metrics, MetricsWriter, METRICS, timed, get_rss, percentile
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.metrics = Metrics()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_aggregate(self):
+        self.metrics.increment('frames_skipped')
+        self.metrics.increment('input_bytes', 3)
+        self.metrics.add_time('frame', .5)
+        self.metrics.add_time('frame', .25)
+
+        assert self.metrics.get_count('frames_skipped') == 1
+        assert self.metrics.get_count('input_bytes') == 3
+        assert self.metrics.get_timer('frame') == (2, .75, .5), "Timer didn't track count, total and max"
+
+    def test_timed(self):
+        @timed('test_timed_function')
+        def function(value):
+            return value * 2
+
+        assert function(2) == 4
+        assert METRICS.get_timer('test_timed_function')[0] == 1, "Decorated call wasn't timed"
+
+    def test_helpers(self):
+        assert get_rss() > 0, "Couldn't read this process's memory"
+        assert percentile([], 95) == 0
+        assert abs(percentile(list(range(1, 101)), 95) - 95.05) < 1e-9
+        assert percentile([3, 1, 2], 50) == 2
+
+    def test_prometheus(self):
+        self.metrics.increment('state_checks', 2)
+        self.metrics.add_time('next_state', .125)
+        text = self.metrics.to_prometheus()
+        assert "rory_state_checks_total 2\n" in text
+        assert "rory_next_state_seconds_count 1\n" in text
+        assert "rory_next_state_seconds_sum 0.125\n" in text
+
+    def test_writer(self):
+        self.metrics.increment('state_checks')
+        writer = MetricsWriter(self.metrics, self.path + '/metrics.jsonl')
+        writer.flush()
+        self.metrics.increment('state_checks')
+        writer.stop()
+
+        with open(self.path + '/metrics.jsonl', 'r') as fp:
+            lines = [json.loads(line) for line in fp]
+        assert [line['counters']['state_checks'] for line in lines] == [1, 2], "Each flush should append a snapshot"
+
+        writer = MetricsWriter(self.metrics, self.path + '/metrics.prom')
+        writer.flush()
+        writer.flush()
+        with open(self.path + '/metrics.prom', 'r') as fp:
+            assert fp.read().count("rory_state_checks_total 2") == 1, "Prometheus file should be replaced, not appended"
@@ -44,7 +44,7 @@ class PlayerTest(unittest.TestCase):
 
         self.player = Player(
             path=self.test_midi_path,
-            controller_path=self.midi_controller_path
+            input_path=self.midi_controller_path
         )
 
     def tearDown(self):
@@ -0,0 +1,100 @@
+import unittest
+import tempfile
+import shutil
+import time
+import os
+import threading
+import apres
+
+from rory.prefetch import SongPrefetcher
+from rory.midiinterface import MIDIInterface
+
+class SongPrefetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        midi = apres.MIDI(ppqn=120)
+        for i in range(8):
+            midi.add_event(apres.NoteOn(note=60 + i, velocity=64, channel=0), tick=i * 120)
+            midi.add_event(apres.NoteOff(note=60 + i, velocity=0, channel=0), tick=(i + 1) * 120)
+        midi.save(self.path + '/song.mid')
+
+        self.prefetcher = SongPrefetcher(max_cached=1)
+
+    def tearDown(self):
+        self.prefetcher.close()
+        shutil.rmtree(self.path)
+
+    def test_prefetch(self):
+        path = self.path + '/song.mid'
+        self.prefetcher.prefetch(path)
+        first = self.prefetcher.take(path)
+        assert self.prefetcher.take(path) is first, "Compiled song wasn't reused"
+        assert self.prefetcher.take(path, transpose=2) is not first, "Transposed song shouldn't share a compile"
+        assert self.prefetcher.take(path, quantize=16) is not first, "Quantized song shouldn't share a compile"
+
+    def test_invalidated_by_change(self):
+        path = self.path + '/song.mid'
+        first = self.prefetcher.take(path)
+
+        time.sleep(.01)
+        shutil.copy(path, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        assert self.prefetcher.take(path) is not first, "Stale compile was reused after the file changed"
+
+    def test_missing_file(self):
+        # Nothing to do, but the browser shouldn't crash for it
+        self.prefetcher.prefetch(self.path + '/missing.mid')
+
+    def test_failed_retried(self):
+        path = self.path + '/song.mid'
+        shutil.copy(path, path + '.bak')
+        with open(path, 'wb') as fp:
+            fp.write(b'not a midi file')
+
+        self.prefetcher.prefetch(path)
+        with self.assertRaises(Exception):
+            self.prefetcher.take(path)
+        assert not self.prefetcher.futures, "Failed compile was kept"
+
+        time.sleep(.01)
+        os.replace(path + '.bak', path)
+        assert len(self.prefetcher.take(path).state_map), "Song wasn't compiled again once it was fixed"
+
+
+class BlockingCompiler:
+    ''' Holds background compiles for a few seconds, to see what waits on them '''
+    def __init__(self):
+        self.release = threading.Event()
+
+    def compile(self, path, background=False, **kwargs):
+        if background:
+            self.release.wait(3)
+        return MIDIInterface(apres.MIDI.load(path), **kwargs)
+
+
+class PrefetchPriorityTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        midi = apres.MIDI(ppqn=120)
+        midi.add_event(apres.NoteOn(note=60, velocity=64, channel=0), tick=0)
+        midi.add_event(apres.NoteOff(note=60, velocity=0, channel=0), tick=120)
+        for name in ('first', 'second', 'third'):
+            midi.save(f"{self.path}/{name}.mid")
+
+        self.compiler = BlockingCompiler()
+        self.prefetcher = SongPrefetcher(compiler=self.compiler)
+
+    def tearDown(self):
+        self.compiler.release.set()
+        self.prefetcher.close()
+        shutil.rmtree(self.path)
+
+    def test_take_not_held_back(self):
+        # first is being compiled speculatively, and second is queued behind it
+        self.prefetcher.prefetch(self.path + '/first.mid')
+        self.prefetcher.prefetch(self.path + '/second.mid')
+
+        start = time.perf_counter()
+        self.prefetcher.take(self.path + '/third.mid')
+        self.prefetcher.take(self.path + '/second.mid')
+        assert time.perf_counter() - start < 1, "Opening a song waited on a speculative compile"
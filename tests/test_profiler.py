@@ -0,0 +1,41 @@
+import unittest
+import tempfile
+import shutil
+import threading
+import time
+import pstats
+
+from rory.profiler import SamplingProfiler
+
+def busy_loop(until):
+    total = 0
+    while time.perf_counter() < until:
+        total += 1
+    return total
+
+class SamplingProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_profile(self):
+        profiler = SamplingProfiler(interval=.001)
+        profiler.start()
+        worker = threading.Thread(target=busy_loop, args=(time.perf_counter() + .3,), name="worker")
+        worker.start()
+        worker.join()
+        profiler.stop()
+
+        pstats_path, folded_path = profiler.write(self.path + '/profile')
+
+        stats = pstats.Stats(pstats_path).stats
+        functions = {function[2]: values for function, values in stats.items()}
+        assert 'busy_loop' in functions, "Function in another thread wasn't sampled"
+        assert functions['busy_loop'][2] > .1, "Time spent in busy_loop was lost"
+
+        with open(folded_path, 'r') as fp:
+            lines = fp.read().splitlines()
+        assert any(line.startswith('worker;') and 'busy_loop' in line for line in lines), "Collapsed stacks weren't rooted at the thread"
+        assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
@@ -0,0 +1,58 @@
+import unittest
+import apres
+
+from rory.midiinterface import MIDIInterface
+
+class QuantizeTest(unittest.TestCase):
+    def build_midi(self):
+        ''' Four beats of 3-note chords, each note struck a few ticks off the beat '''
+        midi = apres.MIDI(ppqn=120)
+        offsets = [-5, 0, 6]
+        for beat in range(4):
+            for i, offset in enumerate(offsets):
+                tick = max(0, (beat * 120) + offset + beat)
+                midi.add_event(apres.NoteOn(note=60 + (beat * 4) + i, velocity=64, channel=0), tick=tick)
+                midi.add_event(apres.NoteOff(note=60 + (beat * 4) + i, velocity=0, channel=0), tick=tick + 100)
+        return midi
+
+    def get_chords(self, midi_interface):
+        return [state for state in midi_interface.state_map if state]
+
+    def test_unquantized(self):
+        chords = self.get_chords(MIDIInterface(self.build_midi()))
+        assert len(chords) > 4, "Jittered notes should land in separate states when not quantized"
+
+    def test_grid(self):
+        midi_interface = MIDIInterface(self.build_midi(), quantize=16)
+        chords = self.get_chords(midi_interface)
+        assert len(chords) == 4, f"Expected 4 chords on a 1/16 grid, found {len(chords)}"
+        for beat, chord in enumerate(chords):
+            assert chord == {60 + (beat * 4) + i for i in range(3)}, f"Wrong notes in chord {beat}: {chord}"
+
+        unquantized = MIDIInterface(self.build_midi())
+        assert len(midi_interface.state_map) < len(unquantized.state_map), "Quantizing didn't reduce the states"
+
+    def test_grid_carries_into_next_beat(self):
+        midi = apres.MIDI(ppqn=120)
+        midi.add_event(apres.NoteOn(note=60, velocity=64, channel=0), tick=0)
+        midi.add_event(apres.NoteOff(note=60, velocity=0, channel=0), tick=100)
+        # Closer to the 2nd beat than to the last 1/8th of the first
+        midi.add_event(apres.NoteOn(note=62, velocity=64, channel=0), tick=115)
+        midi.add_event(apres.NoteOff(note=62, velocity=0, channel=0), tick=200)
+
+        midi_interface = MIDIInterface(midi, quantize=8)
+        assert midi_interface.state_map[0] == {60}, "First note moved"
+        position = midi_interface.inv_beat_map[1]
+        assert midi_interface.state_map[position] == {62}, "Note wasn't snapped onto the next beat"
+
+    def test_tolerance(self):
+        chords = self.get_chords(MIDIInterface(self.build_midi(), quantize_tolerance=12))
+        assert len(chords) == 4, f"Expected 4 chords within the tolerance, found {len(chords)}"
+
+        chords = self.get_chords(MIDIInterface(self.build_midi(), quantize_tolerance=3))
+        assert len(chords) > 4, "Notes outside the tolerance were merged"
+
+    def test_timing_kept(self):
+        midi_interface = MIDIInterface(self.build_midi(), quantize=16)
+        position = midi_interface.inv_beat_map[2]
+        assert abs(midi_interface.timing_map[position] - 242) <= 6, "Real ticks should be kept for timing"
@@ -0,0 +1,23 @@
+import unittest
+import tempfile
+import shutil
+
+from benchmarks.corpus import generate_song
+from benchmarks.render import run_offscreen, SCENARIOS
+
+class RenderBenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.midi_path = self.path + '/song.mid'
+        generate_song(0, bars=8).save(self.midi_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_offscreen(self):
+        # Also covers moving between looping and not looping, which drops cached frames
+        results = run_offscreen(self.midi_path, 120, 30, 3)
+        assert results['size'] == [120, 30], "Scene wasn't run at the requested terminal size"
+        for name in SCENARIOS:
+            assert results['scenarios'][name]['total']['count'] == 3
+        assert results['bytes_written'] > 0, "Nothing drawn was counted"
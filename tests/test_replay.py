@@ -0,0 +1,45 @@
+import unittest
+import tempfile
+import shutil
+import apres
+
+from rory.player import Player
+from rory.input_backends import ScriptedBackend
+from benchmarks.replay import get_song_events, replay
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.midi_path = self.path + '/song.mid'
+
+        self.midi = apres.MIDI(ppqn=120)
+        for i in range(8):
+            # The same pitch on two channels, overlapping
+            self.midi.add_event(apres.NoteOn(note=60, velocity=100, channel=0), tick=i * 120)
+            self.midi.add_event(apres.NoteOn(note=60, velocity=100, channel=1), tick=i * 120 + 60)
+            self.midi.add_event(apres.NoteOff(note=60, velocity=0, channel=0), tick=i * 120 + 90)
+            self.midi.add_event(apres.NoteOff(note=60, velocity=0, channel=1), tick=i * 120 + 110)
+        self.midi.save(self.midi_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_restrike(self):
+        events = get_song_events(self.midi)
+        held = False
+        for _seconds, _note, velocity in events:
+            assert bool(velocity) != held, "Held key was pressed again without being released"
+            held = bool(velocity)
+        assert not held, "Key was left held down"
+
+    def test_replay(self):
+        backend = ScriptedBackend()
+        player = Player(path=self.midi_path, input_backend=backend)
+        try:
+            result = replay(player, backend, get_song_events(self.midi))
+        finally:
+            player.kill()
+
+        assert result.advances == 16, "Every state should have been reached by replaying the song"
+        assert len(result.advance_latencies) == 16
+        assert len(player.advance_latencies) == 16, "Player didn't record its input-to-advance latency"
@@ -0,0 +1,61 @@
+import unittest
+import tempfile
+import shutil
+import apres
+
+from rory.player import Player
+from rory.scoring import TimingCapture
+from rory.input_backends import ScriptedBackend
+
+class ScoringTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.midi_path = self.path + '/song.mid'
+
+        midi = apres.MIDI(ppqn=120)
+        # Two measures of quarter notes
+        for i in range(8):
+            midi.add_event(apres.NoteOn(note=60 + i, velocity=100, channel=0), tick=i * 120)
+            midi.add_event(apres.NoteOff(note=60 + i, velocity=0, channel=0), tick=(i + 1) * 120)
+        midi.save(self.midi_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_ring_buffer(self):
+        capture = TimingCapture(lambda: 3, size=8)
+        for i in range(5):
+            capture.record(i, 60 + i, True)
+        events, since = capture.read()
+        assert [event[1] for event in events] == [60, 61, 62, 63, 64], "Wrong events read"
+        assert events[0] == (0, 60, True, 3), f"Event recorded wrong: {events[0]}"
+
+        for i in range(20):
+            capture.record(i, i, i % 2 == 0)
+        events, since = capture.read(since)
+        assert since == 25, "Count should include overwritten events"
+        assert [event[1] for event in events] == list(range(12, 20)), "Should only get the events still in the buffer"
+
+    def test_scores(self):
+        backend = ScriptedBackend()
+        player = Player(path=self.midi_path, input_backend=backend)
+        try:
+            # A wrong note, then the first measure played through
+            backend.press_note(50)
+            backend.release_note(50)
+            for i in range(4):
+                backend.press_note(60 + i)
+                backend.release_note(60 + i)
+
+            player.scorer.update()
+            scores = player.get_scores()
+            assert list(scores.keys()) == [0], f"Only the first measure was played, got {list(scores.keys())}"
+            score = scores[0]
+            assert score['expected'] == 4, f"Expected 4 notes, got {score['expected']}"
+            assert score['hits'] == 4, f"Expected 4 hits, got {score['hits']}"
+            assert score['wrong'] == 1, f"Expected 1 wrong note, got {score['wrong']}"
+            assert score['missed'] == 0, "No notes were missed"
+            assert score['accuracy'] == .8, f"Wrong accuracy {score['accuracy']}"
+            assert player.scorer.get_latest_measure() == 0, "Wrong latest measure"
+        finally:
+            player.kill()
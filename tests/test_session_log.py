@@ -0,0 +1,98 @@
+import unittest
+import tempfile
+import shutil
+import apres
+
+from rory.player import Player
+from rory.input_backends import ScriptedBackend
+from rory.session_log import SessionLog, read_records, export_midi, InvalidSessionLog, \
+    KIND_PRESS, KIND_RELEASE, KIND_POSITION, KIND_LOOP, KIND_SONG, KIND_TRANSPOSE
+
+class SessionLogTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.midi_path = self.path + '/song.mid'
+        self.log_path = self.path + '/session.rorylog'
+
+        midi = apres.MIDI(ppqn=120)
+        for i in range(8):
+            midi.add_event(apres.NoteOn(note=60 + i, velocity=100, channel=0), tick=i * 120)
+            midi.add_event(apres.NoteOff(note=60 + i, velocity=0, channel=0), tick=(i + 1) * 120)
+        midi.save(self.midi_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def play_session(self):
+        backend = ScriptedBackend()
+        player = Player(path=self.midi_path, input_backend=backend, session_log_path=self.log_path)
+        try:
+            for i in range(3):
+                backend.press_note(60 + i)
+                backend.release_note(60 + i)
+            player.set_loop_end(5)
+        finally:
+            player.kill()
+
+    def test_session(self):
+        self.play_session()
+        records = list(read_records(self.log_path))
+        kinds = [kind for _seconds, kind, _a, _b, _data in records]
+        assert kinds[0:2] == [KIND_SONG, KIND_TRANSPOSE], f"Log should start with the song, got {kinds[0:2]}"
+        assert records[0][4].decode() == self.midi_path, "Wrong song path logged"
+
+        presses = [(a, b) for _seconds, kind, a, b, _data in records if kind == KIND_PRESS]
+        assert presses == [(60, 0), (61, 1), (62, 2)], f"Wrong presses logged: {presses}"
+        assert kinds.count(KIND_RELEASE) == 3, "Releases weren't logged"
+        assert (KIND_POSITION, 3) in [(kind, a) for _seconds, kind, a, _b, _data in records], "Position change wasn't logged"
+        assert records[-1][1:4] == (KIND_LOOP, 0, 5), f"Last record should be the loop change, got {records[-1]}"
+
+        times = [seconds for seconds, _kind, _a, _b, _data in records]
+        assert times == sorted(times), "Records are out of order"
+
+        # Reopening appends another session to the same log
+        self.play_session()
+        assert len(list(read_records(self.log_path))) == len(records) * 2, "Second session wasn't appended"
+
+    def test_export(self):
+        self.play_session()
+        midi_path = self.path + '/played.mid'
+        assert export_midi(self.log_path, midi_path) == 3, "Wrong number of notes exported"
+
+        notes = [
+            (event.note, event.velocity > 0)
+            for _tick, event in apres.MIDI.load(midi_path).get_all_events()
+            if isinstance(event, (apres.NoteOn, apres.NoteOff))
+        ]
+        expected = []
+        for i in range(3):
+            expected += [(60 + i, True), (60 + i, False)]
+        assert notes == expected, f"Wrong notes exported: {notes}"
+
+    def test_export_held(self):
+        # Notes left held at the end of each session
+        for _ in range(2):
+            backend = ScriptedBackend()
+            player = Player(path=self.midi_path, input_backend=backend, session_log_path=self.log_path)
+            try:
+                backend.press_note(60)
+                backend.press_note(61)
+                backend.release_note(61)
+            finally:
+                player.kill()
+
+        midi_path = self.path + '/played.mid'
+        export_midi(self.log_path, midi_path)
+        notes = [
+            (event.note, event.velocity > 0)
+            for _tick, event in apres.MIDI.load(midi_path).get_all_events()
+            if isinstance(event, (apres.NoteOn, apres.NoteOff))
+        ]
+        session = [(60, True), (61, True), (61, False), (60, False)]
+        assert notes == session * 2, f"Held notes weren't released at the end of each session: {notes}"
+
+    def test_invalid(self):
+        with open(self.log_path, 'wb') as fp:
+            fp.write(b'not a log at all')
+        with self.assertRaises(InvalidSessionLog):
+            SessionLog(self.log_path)
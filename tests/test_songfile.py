@@ -0,0 +1,124 @@
+import unittest
+import tempfile
+import shutil
+import struct
+import os
+import time
+import glob
+import threading
+import apres
+
+from rory.songfile import CompiledMIDIInterface, CompiledSongCache, InvalidSongFile, compile_file, write, HEADER, VERSION
+from rory.compiler import SongCompiler
+
+class SongFileTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        midi = apres.MIDI(ppqn=120)
+        midi.add_event(apres.SetTempo(400000), tick=0)
+        midi.add_event(apres.TimeSignature(numerator=3, denominator=2), tick=0)
+        for i in range(24):
+            for j, channel in ((0, 0), (7, 3)):
+                note = 48 + (i % 12) + j
+                midi.add_event(apres.NoteOn(note=note, velocity=64, channel=channel), tick=i * 60)
+                midi.add_event(apres.NoteOff(note=note, velocity=0, channel=channel), tick=(i + 1) * 60)
+        self.midi_path = self.path + '/song.mid'
+        midi.save(self.midi_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        expected, output_path = compile_file(self.midi_path, quantize=8)
+        assert output_path == self.path + '/song.rory', "Didn't default to writing next to the midi"
+
+        compiled = CompiledMIDIInterface.open(output_path)
+        try:
+            assert list(compiled.state_map) == expected.state_map, "States differ"
+            assert compiled.quantize == 8, "Compile options weren't kept"
+            for position in range(len(expected.state_map)):
+                assert (position in compiled.measure_map) == (position in expected.measure_map), f"Measure flag differs at {position}"
+                assert (position in compiled.beat_map) == (position in expected.beat_map), f"Beat flag differs at {position}"
+                assert compiled.get_measure(position) == expected.get_measure(position), f"Measure differs at {position}"
+                assert compiled.get_real_tick(position) == expected.get_real_tick(position), f"Timing differs at {position}"
+                assert compiled.get_active_channels(position) == expected.get_active_channels(position), f"Channels differ at {position}"
+            assert list(compiled.tempo_map) == expected.tempo_map, "Tempos differ"
+        finally:
+            compiled.close()
+
+    def test_invalid(self):
+        _, output_path = compile_file(self.midi_path)
+        with open(output_path, 'rb') as fp:
+            data = bytearray(fp.read())
+
+        bad_path = self.path + '/bad.rory'
+        for bad_data in (b'', b'MThd' + bytes(64), data[0:HEADER.size + 8]):
+            with open(bad_path, 'wb') as fp:
+                fp.write(bad_data)
+            with self.assertRaises(InvalidSongFile):
+                CompiledMIDIInterface.open(bad_path)
+
+        struct.pack_into('<H', data, 4, VERSION + 1)
+        with open(bad_path, 'wb') as fp:
+            fp.write(data)
+        with self.assertRaises(InvalidSongFile):
+            CompiledMIDIInterface.open(bad_path)
+
+    def test_cache(self):
+        cache = CompiledSongCache(self.path + '/cache')
+        assert cache.load(self.midi_path) is None, "Found a song that was never cached"
+        assert cache.get_path(self.midi_path) != cache.get_path(self.midi_path, transpose=1), "Options don't change the cached path"
+
+        compiler = SongCompiler(cache=cache)
+        try:
+            compiled = compiler.compile(self.midi_path)
+            compiled.close()
+            # Handed over first, then cached
+            for _ in range(40):
+                if os.path.exists(cache.get_path(self.midi_path)):
+                    break
+                time.sleep(.05)
+            assert os.path.exists(cache.get_path(self.midi_path)), "Compiled song wasn't cached"
+
+            cached = cache.load(self.midi_path)
+            assert cached is not None and len(cached.state_map) == 24, "Cached song wasn't usable"
+            cached.close()
+        finally:
+            compiler.close()
+
+        # Changing the midi file changes its key
+        os.utime(self.midi_path, ns=(0, 0))
+        assert cache.load(self.midi_path) is None, "Stale song was loaded from the cache"
+
+    def test_concurrent_writes(self):
+        path = self.path + '/song.rory'
+        midi_interface, _path = compile_file(self.midi_path, self.path + '/first.rory')
+        threads = [threading.Thread(target=write, args=(midi_interface, path)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not glob.glob(self.path + '/*.tmp'), "Temporary files were left behind"
+        compiled = CompiledMIDIInterface.open(path)
+        assert len(compiled.state_map) == 24, "Writers of the same song mixed their output"
+        compiled.close()
+
+    def test_cache_prune(self):
+        cache = CompiledSongCache(self.path + '/cache')
+        paths = []
+        for transpose in range(4):
+            path = cache.get_path(self.midi_path, transpose=transpose)
+            compile_file(self.midi_path, path, transpose=transpose)
+            os.utime(path, (transpose, transpose))
+            paths.append(path)
+        size = os.path.getsize(paths[0])
+
+        # Loading a song counts as using it
+        cached = cache.load(self.midi_path, transpose=0)
+        cached.close()
+
+        cache.max_size = size * 2
+        cache.prune()
+        remaining = [os.path.exists(path) for path in paths]
+        assert remaining == [True, False, False, True], f"Least recently used songs weren't the ones removed: {remaining}"
@@ -0,0 +1,64 @@
+import unittest
+import random
+import tempfile
+import shutil
+import apres
+
+from rory.structures import IntervalIndex
+from rory.midiinterface import MIDIInterface
+from rory.songfile import CompiledMIDIInterface, write
+
+class SustainTest(unittest.TestCase):
+    def build_midi(self):
+        ''' A whole note held under a run of quarter notes, then a quarter note on its own '''
+        midi = apres.MIDI(ppqn=120)
+        midi.add_event(apres.NoteOn(note=48, velocity=64, channel=1), tick=0)
+        midi.add_event(apres.NoteOff(note=48, velocity=0, channel=1), tick=480)
+        for i in range(5):
+            midi.add_event(apres.NoteOn(note=60 + i, velocity=64, channel=0), tick=i * 120)
+            midi.add_event(apres.NoteOff(note=60 + i, velocity=0, channel=0), tick=(i + 1) * 120)
+        return midi
+
+    def test_interval_index(self):
+        generator = random.Random(4)
+        intervals = []
+        for _ in range(300):
+            start = generator.randrange(1000)
+            intervals.append((start, start + generator.randrange(1, 60)))
+        intervals.sort()
+        starts = [start for start, _end in intervals]
+        ends = [end for _start, end in intervals]
+        index = IntervalIndex(starts, ends)
+
+        for _ in range(200):
+            first = generator.randrange(-10, 1010)
+            last = first + generator.randrange(1, 40)
+            expected = [i for i, (start, end) in enumerate(intervals) if start < last and end > first]
+            assert index.overlapping(first, last) == expected, f"Wrong intervals in [{first}, {last})"
+
+        position = intervals[10][0]
+        assert 10 in index.at(position), "Interval missing at its own start"
+        assert IntervalIndex([], []).overlapping(0, 100) == [], "Empty index found intervals"
+
+    def test_held_notes(self):
+        midi_interface = MIDIInterface(self.build_midi(), transpose=2)
+        sustained = midi_interface.get_sustained_notes(0, len(midi_interface.state_map))
+        assert sustained == [(0, 4, 50, 1)], f"Expected only the transposed whole note to be held, got {sustained}"
+
+        assert midi_interface.get_sounding_notes(2) == {50, 64}, "Held note isn't sounding under later notes"
+        assert midi_interface.get_sounding_notes(4) == {66}, "Held note still sounding after its release"
+        assert midi_interface.get_sustained_notes(4, 5) == [], "Released note found past its end"
+
+    def test_compiled(self):
+        path = tempfile.mkdtemp()
+        try:
+            expected = MIDIInterface(self.build_midi())
+            write(expected, path + '/song.rory')
+            compiled = CompiledMIDIInterface.open(path + '/song.rory')
+            try:
+                for position in range(len(expected.state_map)):
+                    assert compiled.get_sustained_notes(position, position + 3) == expected.get_sustained_notes(position, position + 3), f"Held notes differ at {position}"
+            finally:
+                compiled.close()
+        finally:
+            shutil.rmtree(path)